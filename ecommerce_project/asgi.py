@@ -5,6 +5,19 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+ASGI deployment
+---------------
+Loading this module switches the storefront pages (home, categories, product
+detail, cart) to the async views in shop/async_views.py. Run it under an ASGI
+server, e.g.
+
+    pip install uvicorn
+    gunicorn ecommerce_project.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+One async worker can keep many slow clients in flight while their queries run
+on the thread pool. Static files are still served by WhiteNoise. Set
+DJANGO_ASYNC_VIEWS=0 to keep the sync views under ASGI.
 """
 
 import os
@@ -12,5 +25,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_project.settings')
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -1,13 +1,320 @@
-from django.contrib import admin
-from .models import Product, ProductThumbnail
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import search, tracking
+from .fragment_cache import bump_version
+from .models import (
+    Cart, CartItem, Category, Job, MediaBlob, Order, OrderItem, OrderStatusEvent, Product,
+    ProductBenefit, ProductImage, ProductThumbnail, ProductUserImage, RelatedProduct, Review,
+)
+from .pagination import EstimatedCountPaginator
+
+# -------------------------
+# Shared
+# -------------------------
+# Change lists on the big tables must not scan them: totals come from
+# EstimatedCountPaginator, foreign keys are joined in the list query and
+# edited through autocomplete widgets, and searches only use lookups an
+# index can answer (exact matches, or the product search index).
+
+SEARCH_LIMIT = 200
+
+
+class ShopModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) under a filtered list
+    show_full_result_count = False
+    list_per_page = 50
+    # Primary key order is free, and autocomplete pages need a stable one
+    ordering = ('-pk',)
+
+
+class ReadOnlyAdminMixin:
+    """Rows written by the application only (timelines, refcounts)."""
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# -------------------------
+# Catalog
+# -------------------------
+def _bump_products(rows):
+    """Fragment versions to bump after a bulk UPDATE; rows are (id, category_id)."""
+    product_ids = {product_id for product_id, category_id in rows}
+    category_ids = {category_id for product_id, category_id in rows}
+
+    def bump():
+        for product_id in product_ids:
+            bump_version('product', product_id)
+        for category_id in category_ids:
+            bump_version('category', category_id)
+    transaction.on_commit(bump)
+
+
+class StockActionForm(ActionForm):
+    amount = forms.IntegerField(required=False, help_text="Stock change for “Adjust stock” (may be negative)")
+
 
 class ProductThumbnailInline(admin.TabularInline):
     model = ProductThumbnail
     extra = 1
 
+
+class ProductImageInline(admin.TabularInline):
+    model = ProductImage
+    extra = 0
+
+
+class ProductBenefitInline(admin.TabularInline):
+    model = ProductBenefit
+    fields = ('title', 'position')
+    extra = 1
+
+
+@admin.register(Category)
+class CategoryAdmin(ShopModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+
+
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'stock', 'is_featured', 'badge')
+class ProductAdmin(ShopModelAdmin):
+    list_display = ('name', 'sku', 'category', 'price', 'stock', 'rating_avg', 'is_featured', 'badge')
     list_filter = ('category', 'is_featured')
-    search_fields = ('name', 'description')
-    inlines = [ProductThumbnailInline]
+    list_select_related = ('category',)
+    # Plus the search index, see get_search_results()
+    search_fields = ('=sku',)
+    autocomplete_fields = ('category',)
+    # Maintained from Review writes by shop/ratings.py
+    readonly_fields = (
+        'rating', 'rating_avg', 'rating_sum', 'rating_count',
+        'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5',
+    )
+    inlines = [ProductBenefitInline, ProductImageInline, ProductThumbnailInline]
+    action_form = StockActionForm
+    actions = ['adjust_stock', 'mark_featured', 'unmark_featured']
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        matches = Q(sku=term) | Q(id__in=search.search_ids(term, limit=SEARCH_LIMIT))
+        if term.isdigit():
+            matches |= Q(id=int(term))
+        return queryset.filter(matches), False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The product was indexed on save, before its benefit inlines
+        search.index_product(search.searchable_products().get(pk=form.instance.pk))
+
+    def _update(self, queryset, **values):
+        with transaction.atomic():
+            rows = list(queryset.values_list('id', 'category_id'))
+            updated = queryset.update(**values)
+            _bump_products(rows)
+        return updated
+
+    @admin.action(description="Adjust stock by amount", permissions=['change'])
+    def adjust_stock(self, request, queryset):
+        amount = request.POST.get('amount', '').strip()
+        try:
+            amount = int(amount)
+        except ValueError:
+            self.message_user(request, "Enter a whole number to adjust stock by.", messages.ERROR)
+            return
+        # Stock is unsigned, so a decrease stops at zero
+        updated = self._update(queryset, stock=Greatest(F('stock') + amount, Value(0)))
+        self.message_user(request, f"Adjusted stock of {updated} products by {amount:+d}.")
+
+    @admin.action(description="Mark as featured", permissions=['change'])
+    def mark_featured(self, request, queryset):
+        updated = self._update(queryset.filter(is_featured=False), is_featured=True)
+        self.message_user(request, f"Featured {updated} products.")
+
+    @admin.action(description="Remove from featured", permissions=['change'])
+    def unmark_featured(self, request, queryset):
+        updated = self._update(queryset.filter(is_featured=True), is_featured=False)
+        self.message_user(request, f"Unfeatured {updated} products.")
+
+
+@admin.register(ProductImage)
+class ProductImageAdmin(ShopModelAdmin):
+    list_display = ('id', 'product', 'image')
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=product__sku',)
+
+
+@admin.register(ProductThumbnail)
+class ProductThumbnailAdmin(ShopModelAdmin):
+    list_display = ('id', 'product', 'image')
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=product__sku',)
+
+
+@admin.register(ProductUserImage)
+class ProductUserImageAdmin(ShopModelAdmin):
+    list_display = ('id', 'product', 'user', 'uploaded_at')
+    list_select_related = ('product', 'user')
+    autocomplete_fields = ('product', 'user')
+    search_fields = ('=product__sku', '=user__username')
+
+
+@admin.register(ProductBenefit)
+class ProductBenefitAdmin(ShopModelAdmin):
+    list_display = ('title', 'product', 'position')
+    list_select_related = ('product',)
+    autocomplete_fields = ('product',)
+    search_fields = ('=product__sku',)
+
+
+@admin.register(RelatedProduct)
+class RelatedProductAdmin(ShopModelAdmin):
+    list_display = ('product', 'rank', 'related', 'kind', 'score', 'updated_at')
+    list_filter = ('kind',)
+    list_select_related = ('product', 'related')
+    autocomplete_fields = ('product', 'related')
+    search_fields = ('=product__sku',)
+
+
+@admin.register(Review)
+class ReviewAdmin(ShopModelAdmin):
+    list_display = ('product', 'user', 'rating', 'created_at')
+    list_filter = ('rating',)
+    list_select_related = ('product', 'user')
+    autocomplete_fields = ('product', 'user')
+    search_fields = ('=product__sku', '=user__username')
+
+
+# -------------------------
+# Carts
+# -------------------------
+@admin.register(Cart)
+class CartAdmin(ShopModelAdmin):
+    list_display = ('user', 'product', 'quantity', 'created_at')
+    list_select_related = ('user', 'product')
+    autocomplete_fields = ('user', 'product')
+    search_fields = ('=user__username', '=product__sku')
+
+
+@admin.register(CartItem)
+class CartItemAdmin(ShopModelAdmin):
+    list_display = ('id', 'cart', 'product', 'quantity')
+    list_select_related = ('cart__user', 'cart__product', 'product')
+    autocomplete_fields = ('cart', 'product')
+    search_fields = ('=product__sku',)
+
+
+# -------------------------
+# Orders
+# -------------------------
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    autocomplete_fields = ('product',)
+    extra = 0
+
+
+class OrderStatusEventInline(ReadOnlyAdminMixin, admin.TabularInline):
+    model = OrderStatusEvent
+    fields = ('status', 'note', 'created_at')
+    readonly_fields = fields
+    extra = 0
+
+
+@admin.register(Order)
+class OrderAdmin(ShopModelAdmin):
+    list_display = ('id', 'email', 'first_name', 'last_name', 'total', 'status', 'payment_status', 'created_at')
+    list_filter = ('status', 'payment_status')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    # Plus order ids, see get_search_results()
+    search_fields = ('=email',)
+    readonly_fields = ('razorpay_order_id', 'razorpay_payment_id', 'razorpay_signature', 'created_at')
+    inlines = [OrderItemInline, OrderStatusEventInline]
+    actions = ['mark_shipped', 'mark_delivered', 'mark_cancelled']
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip().lstrip('#')
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(id=int(term)), False
+        # Emails are stored normalized, so the index on email is usable
+        return queryset.filter(email=tracking.normalize_email(term)), False
+
+    def _transition(self, request, queryset, status):
+        moved = tracking.bulk_set_status(queryset, status, note=f"Set by {request.user.get_username()}")
+        skipped = queryset.count() - moved
+        self.message_user(request, f"Marked {moved} orders as {tracking.STATUS_LABELS[status].lower()}.")
+        if skipped:
+            allowed = ', '.join(tracking.TRANSITIONS[status])
+            self.message_user(request, f"Skipped {skipped} orders not in {allowed}.", messages.WARNING)
+
+    @admin.action(description="Mark as shipped", permissions=['change'])
+    def mark_shipped(self, request, queryset):
+        self._transition(request, queryset, 'shipped')
+
+    @admin.action(description="Mark as delivered", permissions=['change'])
+    def mark_delivered(self, request, queryset):
+        self._transition(request, queryset, 'delivered')
+
+    @admin.action(description="Cancel", permissions=['change'])
+    def mark_cancelled(self, request, queryset):
+        self._transition(request, queryset, 'cancelled')
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(ShopModelAdmin):
+    list_display = ('id', 'order', 'product', 'quantity', 'price')
+    list_select_related = ('order', 'product')
+    autocomplete_fields = ('order', 'product')
+    search_fields = ('=order__id', '=product__sku')
+
+
+@admin.register(OrderStatusEvent)
+class OrderStatusEventAdmin(ReadOnlyAdminMixin, ShopModelAdmin):
+    list_display = ('order', 'status', 'note', 'created_at')
+    list_filter = ('status',)
+    list_select_related = ('order',)
+    search_fields = ('=order__id',)
+
+
+# -------------------------
+# Operations
+# -------------------------
+@admin.register(Job)
+class JobAdmin(ShopModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('=id',)
+    readonly_fields = ('locked_at', 'last_error', 'created_at', 'updated_at')
+    actions = ['retry']
+
+    @admin.action(description="Retry now", permissions=['change'])
+    def retry(self, request, queryset):
+        now = timezone.now()
+        updated = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=now, locked_at=None, last_error=None, updated_at=now,
+        )
+        self.message_user(request, f"Queued {updated} jobs.")
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(ReadOnlyAdminMixin, ShopModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'updated_at')
+    # Rows follow the files; `manage.py gc_media` removes unreferenced ones
+    search_fields = ('=name',)
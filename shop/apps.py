@@ -6,3 +6,4 @@ class ShopConfig(AppConfig):
 
     def ready(self):
         import shop.signals  # this loads the signals
+        import shop.tasks  # registers background job tasks
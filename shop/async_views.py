@@ -0,0 +1,148 @@
+import asyncio
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+
+from .catalog import get_catalog_page
+from .fragment_cache import get_fragment_cache
+from .models import Category, Product
+from .page_cache import cached_page
+from .pricing import price_cart
+from . import guest_cart, payments, replicas, reviews
+from .views import (
+    CATALOG_PARAMS, PRODUCT_PARAMS, _catalog_params, _categories_context, _categories_versions,
+    _product_data, _product_key, _product_page_versions, _related_fragment, _related_key, _related_products,
+)
+
+# -------------------------
+# Async storefront views
+# -------------------------
+# Used instead of the matching views in shop/views.py when the site runs under
+# ASGI (settings.ASYNC_VIEWS, set by ecommerce_project/asgi.py). Independent
+# queries are started together with asyncio.gather so a page waits for the
+# slowest one rather than the sum of them.
+
+
+async def _in_thread(func, *args, **kwargs):
+    """Runs blocking ORM work on its own worker thread (and connection).
+
+    The async ORM methods all share one thread, so they can't overlap; this
+    is what lets gathered queries actually run at the same time.
+    """
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return await sync_to_async(call, thread_sensitive=False)()
+
+
+# Template rendering touches request.user/session lazily, so it stays on the
+# request's thread.
+arender = sync_to_async(render)
+
+
+# -------------------------
+# Home
+# -------------------------
+@cached_page()
+async def home(request):
+    hero_image = None
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, "image1.png")):
+        hero_image = {"url": settings.MEDIA_URL + "image1.png"}
+
+    return await arender(request, "shop/home.html", {"hero_image": hero_image})
+
+
+# -------------------------
+# Categories
+# -------------------------
+@cached_page(_categories_versions, params=CATALOG_PARAMS)
+async def categories(request):
+    all_categories, page = await asyncio.gather(
+        _in_thread(list, Category.objects.only('id', 'name').order_by('name')),
+        _in_thread(get_catalog_page, **_catalog_params(request)),
+    )
+    context = _categories_context(request, all_categories, page)
+    return await arender(request, 'shop/categories.html', context)
+
+
+# -------------------------
+# Product Detail
+# -------------------------
+def _cached_fragments(product_id):
+    """Cache lookups for a product page, done in one hop off the event loop."""
+    cache = get_fragment_cache()
+    key, version = _product_key(product_id)
+    data = cache.get(key)
+    related_key = related = None
+    if data is not None:
+        related_key = _related_key(product_id, version, data['product'].category_id)
+        related = cache.get(related_key)
+    return key, version, data, related_key, related
+
+
+@cached_page(_product_page_versions, params=PRODUCT_PARAMS)
+async def product_detail(request, product_id):
+    cache = get_fragment_cache()
+    key, version, data, related_key, related = await _in_thread(_cached_fragments, product_id)
+    if data is None:
+        # Cached under the current version, so not from a lagging replica
+        with replicas.primary():
+            try:
+                product = await Product.objects.select_related('category').prefetch_related('benefits').aget(
+                    id=product_id)
+            except Product.DoesNotExist:
+                raise Http404("No Product matches the given query.")
+            # Thumbnails and related products don't depend on each other
+            thumbnails, related_products = await asyncio.gather(
+                _in_thread(list, product.thumbnails.all()),
+                _in_thread(_related_products, product),
+            )
+        data = _product_data(product, thumbnails)
+        related = _related_fragment(related_products)
+        related_key = await _in_thread(_related_key, product_id, version, product.category_id)
+        await _in_thread(cache.set, key, data)
+        await _in_thread(cache.set, related_key, related)
+    elif related is None:
+        with replicas.primary():
+            related_products = await _in_thread(_related_products, data['product'])
+        related = _related_fragment(related_products)
+        await _in_thread(cache.set, related_key, related)
+
+    context = {
+        'product': data['product'],
+        'fragments': {
+            'gallery': data['gallery'],
+            'benefits': data['benefits'],
+            'related': related,
+        },
+        'from_category': request.GET.get('from_category') == '1',
+        'reviews_page': await _in_thread(reviews.first_page, product_id),
+    }
+    return await arender(request, 'shop/product_detail.html', context)
+
+
+# -------------------------
+# Cart Page
+# -------------------------
+async def cart_page(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        cart = await _in_thread(price_cart, user)
+    else:
+        # Read here, on the request's thread, like the templates do
+        session = await sync_to_async(dict)(request.session)
+        cart = await _in_thread(guest_cart.price_guest_cart, session)
+    context = {
+        'cart_items': cart.items,
+        'subtotal': cart.subtotal,
+        'discount': cart.discount,
+        'total': cart.total,
+        'razorpay_key_id': payments.get_gateway().key_id,
+    }
+    return await arender(request, 'shop/cart.html', context)
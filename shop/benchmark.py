@@ -0,0 +1,381 @@
+import math
+import random
+import time
+from decimal import Decimal
+from importlib import import_module
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from . import loadgen, payments, ratings, search
+from .catalog import SORTS
+from .fragment_cache import get_fragment_cache
+from .models import (
+    Cart, Category, Order, OrderItem, OrderStatusEvent, Product, ProductBenefit, RelatedProduct, Review,
+)
+
+# -------------------------
+# Benchmark harness
+# -------------------------
+# Used by `manage.py benchmark`. seed() writes a deterministic synthetic
+# shop (same seed and scale, same rows) with bulk inserts; every row it
+# owns is marked (BENCH- skus, bench_ usernames, "Bench" categories) so it
+# can be reused between runs and removed with teardown(). Scenarios are
+# planned up front as plain (method, path, data, user) tuples, then run
+# either through the Django test client in this process, where the SQL of
+# each request is counted against the view's query budget, or by worker
+# processes sending real HTTP requests to a running server.
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+SKU_PREFIX = 'BENCH-'
+USERNAME_PREFIX = 'bench_'
+CATEGORY_PREFIX = 'Bench '
+PASSWORD = 'bench-password'
+BATCH_SIZE = 2000
+CATEGORIES = 20
+BENEFITS_PER_PRODUCT = 3
+RELATED_PER_PRODUCT = 4
+INITIAL_STOCK = 1_000_000
+CHECKOUT_LINES = 2
+
+# Most SQL statements a view may run per request; the measured maximum
+# after warm-up is checked against these. product_detail assumes the
+# product has recommendations (seed() writes them): the category fallback
+# for one without is another query.
+QUERY_BUDGETS = {
+    'home': 2,
+    'categories': 3,
+    'product_detail': 6,
+    'add_to_cart': 7,  # includes the BEGIN/COMMIT of get_or_create()
+    'cart_page': 3,
+    'checkout_page': 14,
+}
+SCENARIOS = tuple(QUERY_BUDGETS)
+
+WORDS = (
+    'vitamin', 'herbal', 'tablets', 'syrup', 'cream', 'gel', 'capsules', 'ayurvedic',
+    'immunity', 'digestive', 'skin', 'hair', 'joint', 'baby', 'oil', 'powder', 'drops',
+    'relief', 'daily', 'organic', 'calcium', 'iron', 'zinc', 'omega', 'protein', 'care',
+)
+
+
+def scale_value(scale):
+    """'1k' / '10k' / '100k' or a plain product count."""
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(scale)
+
+
+def sizes(products):
+    users = max(50, products // 20)
+    return {
+        'products': products,
+        'users': users,
+        'carts': users // 2,
+        'orders': users * 2,
+        'reviews': products * 2,
+    }
+
+
+# -------------------------
+# Synthetic data
+# -------------------------
+def bench_products():
+    return Product.objects.filter(sku__startswith=SKU_PREFIX)
+
+
+def bench_users():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def seeded_count():
+    return bench_products().count()
+
+
+def _bulk(model, objects):
+    for start in range(0, len(objects), BATCH_SIZE):
+        model.objects.bulk_create(objects[start:start + BATCH_SIZE])
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(products, seed=42, progress=None):
+    """Writes the synthetic shop; returns the row counts."""
+    rng = random.Random(seed)
+    counts = sizes(products)
+    report = progress or (lambda message: None)
+
+    with transaction.atomic():
+        categories = Category.objects.bulk_create([
+            Category(name=f'{CATEGORY_PREFIX}{i:02d}', description=_text(rng, 8)) for i in range(CATEGORIES)
+        ])
+        category_ids = [c.id for c in Category.objects.filter(name__startswith=CATEGORY_PREFIX).order_by('name')]
+
+        rows = []
+        for i in range(products):
+            price = Decimal(rng.randrange(2000, 200000)) / 100
+            discounted = rng.random() < 0.3
+            rows.append(Product(
+                sku=f'{SKU_PREFIX}{i:07d}',
+                category_id=category_ids[i % len(category_ids)],
+                name=f'{_text(rng, 3).title()} {i}',
+                short_description=_text(rng, 8),
+                description=_text(rng, 40),
+                price=price,
+                discount_price=(price * Decimal('0.85')).quantize(Decimal('0.01')) if discounted else None,
+                image='products/benchmark.png',
+                stock=INITIAL_STOCK,
+                is_featured=rng.random() < 0.05,
+            ))
+        _bulk(Product, rows)
+        product_ids = list(bench_products().order_by('id').values_list('id', flat=True))
+        report(f"{len(product_ids)} products")
+
+        _bulk(ProductBenefit, [
+            ProductBenefit(product_id=product_id, title=_text(rng, 4).capitalize(), position=position)
+            for product_id in product_ids
+            for position in range(BENEFITS_PER_PRODUCT)
+        ])
+
+        # Stands in for `manage.py build_related_products` (which needs
+        # scikit-learn): other products of the same category
+        by_category = {}
+        for product_id, category_id in bench_products().order_by('id').values_list('id', 'category_id'):
+            by_category.setdefault(category_id, []).append(product_id)
+        related = []
+        for siblings in by_category.values():
+            for product_id in siblings:
+                picks = rng.sample(siblings, min(RELATED_PER_PRODUCT + 1, len(siblings)))
+                picks = [pick for pick in picks if pick != product_id][:RELATED_PER_PRODUCT]
+                related.extend(
+                    RelatedProduct(product_id=product_id, related_id=pick, kind='similar',
+                                   score=1 / (rank + 1), rank=rank)
+                    for rank, pick in enumerate(picks)
+                )
+        _bulk(RelatedProduct, related)
+
+        # One hashing for every user instead of one each
+        password = make_password(PASSWORD)
+        _bulk(User, [
+            User(username=f'{USERNAME_PREFIX}{i:06d}', email=f'bench{i}@example.com', password=password)
+            for i in range(counts['users'])
+        ])
+        user_ids = list(bench_users().order_by('username').values_list('id', flat=True))
+        report(f"{len(user_ids)} users")
+
+        carts = []
+        for user_id in user_ids[:counts['carts']]:
+            for product_id in rng.sample(product_ids, rng.randint(1, 5)):
+                carts.append(Cart(user_id=user_id, product_id=product_id, quantity=rng.randint(1, 3)))
+        _bulk(Cart, carts)
+
+        orders = []
+        for _ in range(counts['orders']):
+            buyer = rng.randrange(len(user_ids))
+            orders.append(Order(
+                user_id=user_ids[buyer], first_name='Bench', last_name='Buyer', email=f'bench{buyer}@example.com',
+                phone='0000000000', address='Bench street', payment_method='Cash on Delivery',
+                status=rng.choice(['placed', 'shipped', 'delivered']),
+            ))
+        _bulk(Order, orders)
+        order_ids = list(Order.objects.filter(user_id__in=user_ids).values_list('id', 'status'))
+        items, events = [], []
+        for order_id, status in order_ids:
+            for product_id in rng.sample(product_ids, rng.randint(1, 4)):
+                items.append(OrderItem(order_id=order_id, product_id=product_id, quantity=rng.randint(1, 3),
+                                       price=Decimal(rng.randrange(2000, 200000)) / 100))
+            events.append(OrderStatusEvent(order_id=order_id, status=status))
+        _bulk(OrderItem, items)
+        _bulk(OrderStatusEvent, events)
+        report(f"{len(order_ids)} orders")
+
+        # Popular products get most reviews, like a real catalog
+        reviews = []
+        seen = set()
+        for _ in range(counts['reviews']):
+            if rng.random() < 0.5:
+                index = min(int(rng.paretovariate(1.2)) - 1, len(product_ids) - 1)
+            else:
+                index = rng.randrange(len(product_ids))
+            product_id = product_ids[index]
+            user_id = rng.choice(user_ids)
+            if (product_id, user_id) in seen:
+                continue
+            seen.add((product_id, user_id))
+            reviews.append(Review(product_id=product_id, user_id=user_id,
+                                  rating=rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 2, 4, 6))[0],
+                                  comment=_text(rng, 12)))
+        _bulk(Review, reviews)
+        report(f"{len(reviews)} reviews")
+
+    # bulk_create() skipped the signals that keep these up to date
+    ratings.recompute(product_ids=product_ids)
+    search.index_products(search.searchable_products(bench_products()).iterator(chunk_size=BATCH_SIZE))
+    get_fragment_cache().clear()
+    return {**counts, 'categories': len(categories), 'reviews': len(reviews)}
+
+
+def teardown():
+    """Deletes everything seed() wrote (and the orders placed by bench users)."""
+    bench_users().delete()
+    bench_products().delete()
+    Category.objects.filter(name__startswith=CATEGORY_PREFIX).delete()
+    get_fragment_cache().clear()
+
+
+# -------------------------
+# Scenarios
+# -------------------------
+def session_cookie(user):
+    """A logged-in session for user, in whatever engine the site uses."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store[SESSION_KEY] = str(user.pk)
+    store[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    store.save()
+    return store.session_key
+
+
+def prepare_checkout(user_ids, rng):
+    """Gives each buyer a fresh cart of CHECKOUT_LINES products."""
+    product_ids = list(bench_products().values_list('id', flat=True)[:1000])
+    Cart.objects.filter(user_id__in=user_ids).delete()
+    _bulk(Cart, [
+        Cart(user_id=user_id, product_id=product_id, quantity=1)
+        for user_id in user_ids
+        for product_id in rng.sample(product_ids, CHECKOUT_LINES)
+    ])
+
+
+def plan(name, count, rng, product_ids, category_ids, user_ids):
+    """count requests for a scenario as (method, path, data, user_id) tuples."""
+    requests = []
+    for i in range(count):
+        if name == 'home':
+            requests.append(('GET', reverse('home'), None, None))
+        elif name == 'categories':
+            query = f'?category={rng.choice(category_ids)}&sort={rng.choice(list(SORTS))}'
+            requests.append(('GET', reverse('categories') + query, None, None))
+        elif name == 'product_detail':
+            requests.append(('GET', reverse('product_detail', args=[rng.choice(product_ids)]), None, None))
+        elif name == 'add_to_cart':
+            requests.append(('GET', reverse('add_to_cart', args=[rng.choice(product_ids)]), None,
+                             rng.choice(user_ids)))
+        elif name == 'cart_page':
+            requests.append(('GET', reverse('cart_page'), None, rng.choice(user_ids)))
+        elif name == 'checkout_page':
+            # One order per buyer: the first checkout empties the cart
+            data = {'first_name': 'Bench', 'last_name': 'Buyer', 'phone': '0000000000',
+                    'address': 'Bench street', 'payment_method': 'COD'}
+            requests.append(('POST', reverse('checkout_page'), data, user_ids[i % len(user_ids)]))
+    return requests
+
+
+def run_client(requests, cookies):
+    """Runs requests through the test client; returns (seconds, status, queries) each."""
+    clients = {}
+    results = []
+    for method, path, data, user_id in requests:
+        client = clients.get(user_id)
+        if client is None:
+            client = clients[user_id] = Client()
+            if user_id is not None:
+                client.cookies[settings.SESSION_COOKIE_NAME] = cookies[user_id]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            if method == 'POST':
+                response = client.post(path, data)
+            else:
+                response = client.get(path)
+            elapsed = time.perf_counter() - start
+        results.append((elapsed, response.status_code, len(queries)))
+    return results
+
+
+def run_http(base_url, requests, cookies, workers, timeout=30):
+    """Sends requests from worker processes; returns (results, wall seconds)."""
+    # Django's double-submit check accepts the unmasked secret as the token
+    csrf_token = get_random_string(CSRF_SECRET_LENGTH, CSRF_ALLOWED_CHARS)
+    jobs = [
+        {
+            'base_url': base_url.rstrip('/'),
+            'requests': requests[i::workers],
+            'sessions': {user_id: cookies[user_id] for _, _, _, user_id in requests[i::workers] if user_id},
+            'session_cookie': settings.SESSION_COOKIE_NAME,
+            'csrf_cookie': settings.CSRF_COOKIE_NAME,
+            'csrf_token': csrf_token,
+            'timeout': timeout,
+        }
+        for i in range(workers)
+    ]
+    connections.close_all()
+    # Spawned, not forked: the workers start clean (no connections, threads)
+    with get_context('spawn').Pool(workers) as pool:
+        start = time.perf_counter()
+        chunks = pool.map(loadgen.run, jobs)
+        elapsed = time.perf_counter() - start
+    return [result for chunk in chunks for result in chunk], elapsed
+
+
+# -------------------------
+# Reporting
+# -------------------------
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(results, wall_time, budget=None):
+    latencies = sorted(seconds for seconds, status, queries in results)
+    errors = sum(1 for seconds, status, queries in results if not status or status >= 400)
+    queries = [q for seconds, status, q in results if q is not None]
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    summary = {
+        'requests': len(results),
+        'errors': errors,
+        'throughput_rps': round(len(results) / wall_time, 1) if wall_time else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+    if queries:
+        summary['queries'] = {'max': max(queries), 'mean': round(sum(queries) / len(queries), 2),
+                              'budget': budget}
+    return summary
+
+
+def regressions(report, baseline, tolerance):
+    """Failures comparing report against a previous report's p95s."""
+    failures = []
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous.get('p95_ms') or current.get('p95_ms') is None:
+            continue
+        limit = previous['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit:
+            failures.append(f"{name}: p95 {current['p95_ms']}ms > {limit:.2f}ms "
+                            f"(baseline {previous['p95_ms']}ms + {tolerance:.0%})")
+    return failures
+
+
+def use_fake_gateway():
+    payments.set_gateway(payments.FakeGateway())
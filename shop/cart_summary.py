@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import Cart
+from .pricing import line_total_expression
+
+# -------------------------
+# Cached cart summary
+# -------------------------
+# The cart badge is on every page, so the per-user totals live in the cache
+# instead of being counted on each request. Views that change the cart write
+# the new summary through with refresh(); Cart signals (admin edits, bulk
+# deletes) just invalidate() and the next page recomputes it once.
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+EMPTY_SUMMARY = {
+    'item_count': 0,
+    'quantity': 0,
+    'subtotal': Decimal('0.00'),
+}
+
+
+def _key(user_id):
+    return f'cart_summary:{user_id}'
+
+
+def compute(user_id):
+    """Line count, quantity sum and subtotal for a user's cart in one query."""
+    totals = Cart.objects.filter(user_id=user_id).aggregate(
+        lines=Count('id'),
+        units=Sum('quantity'),
+        amount=Sum(line_total_expression()),
+    )
+    return {
+        'item_count': totals['lines'] or 0,
+        'quantity': totals['units'] or 0,
+        'subtotal': (totals['amount'] or Decimal('0')).quantize(Decimal('0.01')),
+    }
+
+
+def get_summary(user_id):
+    summary = cache.get(_key(user_id))
+    if summary is None:
+        summary = refresh(user_id)
+    return summary
+
+
+def refresh(user_id):
+    summary = compute(user_id)
+    cache.set(_key(user_id), summary, CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate(user_id):
+    cache.delete(_key(user_id))
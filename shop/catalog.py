@@ -0,0 +1,103 @@
+from decimal import InvalidOperation
+
+from .models import Product
+from .pagination import paginate, parse_decimal, parse_int
+
+# -------------------------
+# Catalog query layer
+# -------------------------
+# The categories page used to load every product and sort/filter it in the
+# browser. Everything below runs in the database instead and pages with a
+# keyset cursor, so page N costs the same as page 1 whatever the catalog size.
+
+PAGE_SIZE = 24
+
+# sort key -> (field, descending)
+SORTS = {
+    'popularity': ('rating_avg', True),
+    'low-high': ('price', False),
+    'high-low': ('price', True),
+}
+DEFAULT_SORT = 'popularity'
+DECIMAL_SORT_FIELDS = {'price', 'rating_avg'}
+
+# Columns the product grid actually renders
+LISTING_FIELDS = (
+    'id', 'name', 'description', 'price', 'discount_price', 'image',
+    'rating', 'rating_avg', 'rating_count', 'badge', 'is_featured', 'category_id', 'category__name',
+)
+
+
+class CatalogPage:
+    """One page of catalog results plus the cursor for the next page."""
+
+    def __init__(self, products, next_cursor, sort):
+        self.products = products
+        self.next_cursor = next_cursor
+        self.sort = sort
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.products)
+
+    def __len__(self):
+        return len(self.products)
+
+
+def _to_decimal(value):
+    if value in (None, ''):
+        return None
+    try:
+        return parse_decimal(value)
+    except (ValueError, InvalidOperation):
+        return None
+
+
+def _to_id(value):
+    try:
+        return parse_int(value)
+    except ValueError:
+        return None
+
+
+def listing_queryset():
+    """Base queryset for product grids: category joined in, only rendered columns."""
+    return Product.objects.select_related('category').only(*LISTING_FIELDS)
+
+
+def filter_products(qs, category=None, min_price=None, max_price=None, featured=False):
+    if category:
+        if str(category).isdigit():
+            # An id no row can have matches nothing
+            category_id = _to_id(category)
+            qs = qs.filter(category_id=category_id) if category_id is not None else qs.none()
+        else:
+            qs = qs.filter(category__name=category)
+    min_price = _to_decimal(min_price)
+    if min_price is not None:
+        qs = qs.filter(price__gte=min_price)
+    max_price = _to_decimal(max_price)
+    if max_price is not None:
+        qs = qs.filter(price__lte=max_price)
+    if featured:
+        qs = qs.filter(is_featured=True)
+    return qs
+
+
+def get_catalog_page(category=None, sort=DEFAULT_SORT, cursor=None, min_price=None,
+                     max_price=None, featured=False, page_size=PAGE_SIZE):
+    """Returns a CatalogPage using keyset pagination on (sort field, id)."""
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    field, descending = SORTS[sort]
+
+    qs = filter_products(listing_queryset(), category, min_price, max_price, featured)
+
+    rows, next_cursor = paginate(
+        qs, field, cursor, descending=descending, page_size=page_size,
+        parse=parse_decimal if field in DECIMAL_SORT_FIELDS else parse_int,
+    )
+    return CatalogPage(rows, next_cursor, sort)
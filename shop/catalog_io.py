@@ -0,0 +1,569 @@
+import csv
+import json
+import os
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import cart_summary, images, search, storage
+from .fragment_cache import bump_version
+from .models import Cart, Category, Product, ProductBenefit, ProductImage
+
+# -------------------------
+# Catalog import / export
+# -------------------------
+# `manage.py catalog_import` / `catalog_export` move the catalog in and out
+# as CSV or JSON Lines, one product per row:
+#
+#   sku, id, name, category, short_description, description, price,
+#   discount_price, stock, is_featured, badge, image, images, benefits
+#
+# `images` (gallery) and `benefits` are lists: JSON arrays in JSONL, '|'
+# separated in CSV. Rows are matched on sku (upserted with one INSERT ... ON
+# CONFLICT per batch); rows without a sku update the product with that id.
+# Only the columns a row has are written, so a file with just sku,price,stock
+# reprices a catalog. An empty images/benefits cell clears the list.
+#
+# image / images hold a media name that already exists in storage (what
+# export writes) or a path to a local file, relative to --media-dir, which
+# is uploaded through the default (content-addressed) storage.
+#
+# Rows are streamed through generators and written in batches, so memory
+# stays at one batch however large the file. Bulk writes skip model signals;
+# import_batch() does their work (search index, fragment versions, media
+# refcounts, cart summaries) once per batch instead.
+
+COLUMNS = (
+    'sku', 'id', 'name', 'category', 'short_description', 'description', 'price',
+    'discount_price', 'stock', 'is_featured', 'badge', 'image', 'images', 'benefits',
+)
+FORMATS = ('csv', 'jsonl')
+LIST_SEPARATOR = '|'
+DEFAULT_BATCH_SIZE = 1000
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+MAX_PRICE = Decimal('99999999.99')  # max_digits=10, decimal_places=2
+MAX_ID = 2 ** 63 - 1  # BigAutoField
+MAX_STOCK = 2 ** 31 - 1  # PositiveIntegerField
+CENT = Decimal('0.01')
+# Product fields a row can set directly
+TEXT_FIELDS = {'sku': 64, 'name': 200, 'short_description': 255, 'badge': 50}
+REQUIRED_FOR_NEW = ('name', 'category', 'price', 'image')
+
+
+class RowError(Exception):
+    def __init__(self, line, message):
+        self.line = line
+        super().__init__(f"line {line}: {message}")
+
+
+def guess_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+# -------------------------
+# Reading
+# -------------------------
+def read_csv(stream):
+    """Yields (line, row dict) pairs; cells beyond the header are dropped."""
+    reader = csv.DictReader(stream)
+    unknown = set(reader.fieldnames or ()) - set(COLUMNS)
+    if unknown:
+        raise RowError(1, f"unknown column(s): {', '.join(sorted(unknown))}")
+    for raw in reader:
+        yield reader.line_num, {key: value for key, value in raw.items() if key is not None}
+
+
+def read_jsonl(stream):
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            raw = json.loads(text)
+        except ValueError as exc:
+            yield line, RowError(line, f"invalid JSON ({exc})")
+            continue
+        if not isinstance(raw, dict):
+            yield line, RowError(line, "expected a JSON object")
+            continue
+        yield line, raw
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def _text(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        items = value
+    else:
+        items = str(value).split(LIST_SEPARATOR)
+    return [_text(item) for item in items if _text(item)]
+
+
+def _decimal(line, field, value):
+    try:
+        amount = Decimal(_text(value)).quantize(CENT)
+    except InvalidOperation:
+        raise RowError(line, f"{field}: {value!r} is not a number")
+    if not amount.is_finite():
+        raise RowError(line, f"{field}: {value!r} is not a number")
+    if not 0 <= amount <= MAX_PRICE:
+        raise RowError(line, f"{field}: {value!r} is out of range")
+    return amount
+
+
+def _int(line, field, value, maximum):
+    try:
+        number = int(_text(value) or 0)
+    except ValueError:
+        raise RowError(line, f"{field}: {value!r} is not an integer")
+    if number < 0:
+        raise RowError(line, f"{field} is negative")
+    if number > maximum:
+        raise RowError(line, f"{field}: {value!r} is out of range")
+    return number
+
+
+def _bool(line, field, value):
+    if isinstance(value, bool):
+        return value
+    text = _text(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError(line, f"{field}: {value!r} is not a boolean")
+
+
+def clean(line, raw):
+    """Validates one input row; returns a dict of the fields it sets."""
+    row = {'line': line}
+    unknown = set(raw) - set(COLUMNS)
+    if unknown:
+        raise RowError(line, f"unknown field(s): {', '.join(sorted(unknown))}")
+
+    for field, max_length in TEXT_FIELDS.items():
+        if field in raw:
+            value = _text(raw[field])
+            if len(value) > max_length:
+                raise RowError(line, f"{field} is longer than {max_length} characters")
+            row[field] = value or None
+    if 'name' in row and not row['name']:
+        raise RowError(line, "name is empty")
+
+    if _text(raw.get('id')):
+        row['id'] = _int(line, 'id', raw['id'], MAX_ID)
+    if not row.get('sku'):
+        if 'id' not in row:
+            raise RowError(line, "needs a sku (or the id of an existing product)")
+        # Matched on id; an empty sku cell doesn't clear the stored one
+        row.pop('sku', None)
+
+    if 'category' in raw:
+        row['category'] = _text(raw['category'])
+        if not row['category'] or len(row['category']) > 100:
+            raise RowError(line, "category must be 1-100 characters")
+    if 'description' in raw:
+        row['description'] = _text(raw['description'])
+    if 'price' in raw:
+        row['price'] = _decimal(line, 'price', raw['price'])
+    if 'discount_price' in raw:
+        discount = raw['discount_price']
+        row['discount_price'] = _decimal(line, 'discount_price', discount) if _text(discount) else None
+    if 'stock' in raw:
+        row['stock'] = _int(line, 'stock', raw['stock'], MAX_STOCK)
+    if 'is_featured' in raw:
+        row['is_featured'] = _bool(line, 'is_featured', raw['is_featured'])
+
+    # An empty image cell keeps the current image
+    if _text(raw.get('image')):
+        row['image'] = _text(raw['image'])
+    if 'images' in raw:
+        row['images'] = _list(raw['images'])
+    if 'benefits' in raw:
+        row['benefits'] = _list(raw['benefits'])
+        for title in row['benefits']:
+            if len(title) > 255:
+                raise RowError(line, "a benefit is longer than 255 characters")
+    return row
+
+
+def clean_rows(records, errors):
+    """Validated rows from (line, raw) records; bad rows go to errors."""
+    for line, raw in records:
+        if isinstance(raw, RowError):
+            errors.append(raw)
+            continue
+        try:
+            yield clean(line, raw)
+        except RowError as exc:
+            errors.append(exc)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# -------------------------
+# Writing
+# -------------------------
+# Per-product lists: (row field, model, column)
+LISTS = (('benefits', ProductBenefit, 'title'), ('images', ProductImage, 'image'))
+PRODUCT_FIELDS = ('sku', 'name', 'short_description', 'description', 'price', 'discount_price',
+                  'stock', 'is_featured', 'badge', 'image')
+
+
+def _lists(model, column, product_ids):
+    """{product_id: [column values in display order]}"""
+    lists = {}
+    for product_id, value in (model.objects.filter(product_id__in=product_ids)
+                              .order_by(*model._meta.ordering or ['id']).values_list('product_id', column)):
+        lists.setdefault(product_id, []).append(value)
+    return lists
+
+
+class Importer:
+    """Upserts batches of cleaned rows; keeps lookups across batches."""
+
+    def __init__(self, media_dir='.', dry_run=False):
+        self.media_dir = media_dir
+        self.dry_run = dry_run
+        self.categories = {}   # name -> Category
+        self.stored = {}       # input image value -> storage name
+        self.new_images = set()
+        self.stats = Counter()
+        self.errors = []
+
+    # ----- lookups -----
+    def resolve_categories(self, names):
+        missing = {name for name in names if name not in self.categories}
+        if not missing:
+            return
+        self.categories.update((c.name, c) for c in Category.objects.filter(name__in=missing).only('id', 'name'))
+        new = missing - set(self.categories)
+        self.stats['categories_created'] += len(new)
+        if new and not self.dry_run:
+            Category.objects.bulk_create([Category(name=name) for name in new], ignore_conflicts=True)
+            self.categories.update((c.name, c) for c in Category.objects.filter(name__in=new).only('id', 'name'))
+        for name in new - set(self.categories):
+            # Dry run: would be created
+            self.categories[name] = Category(name=name)
+
+    def resolve_image(self, value):
+        """Storage name for an image cell; uploads local files. None if not found."""
+        if value in self.stored:
+            return self.stored[value]
+        name = None
+        path = os.path.join(self.media_dir, value)
+        if default_storage.exists(value):
+            name = value
+        elif os.path.isfile(path):
+            if self.dry_run:
+                name = value
+            else:
+                with open(path, 'rb') as f:
+                    name = default_storage.save(f'products/{os.path.basename(path)}', File(f))
+                self.new_images.add(name)
+        self.stored[value] = name
+        return name
+
+    def existing(self, rows):
+        """{key: current values} for the rows' products already in the DB.
+
+        A row with both sku and id whose sku is unknown adopts the product
+        with that id if it has no sku yet (e.g. exported before it had one).
+        """
+        columns = ('id', 'category_id', *PRODUCT_FIELDS)
+        skus = [row['sku'] for row in rows if 'sku' in row]
+        ids = [row['id'] for row in rows if 'id' in row]
+        found = {('sku', values['sku']): values
+                 for values in Product.objects.filter(sku__in=skus).values(*columns)}
+        by_id = {values['id']: values for values in Product.objects.filter(id__in=ids).values(*columns)}
+        for row in rows:
+            values = by_id.get(row.get('id'))
+            if values is None:
+                continue
+            if 'sku' not in row:
+                found['id', row['id']] = values
+            elif values['sku'] is None and ('sku', row['sku']) not in found:
+                row['adopt'] = True
+                found['id', row['id']] = values
+
+        # Current benefit / gallery lists, to skip rewriting unchanged ones
+        for field, model, column in LISTS:
+            wanted = {}
+            for row in rows:
+                values = found.get(self.key(row))
+                if field in row and values is not None:
+                    values[field] = []
+                    wanted[values['id']] = values
+            for product_id, values in _lists(model, column, wanted).items():
+                wanted[product_id][field] = values
+        return found
+
+    @staticmethod
+    def key(row):
+        return ('id', row['id']) if 'sku' not in row or row.get('adopt') else ('sku', row['sku'])
+
+    # ----- batches -----
+    def check(self, rows, existing):
+        """Drops rows that can't be written; resolves categories and images."""
+        self.resolve_categories({row['category'] for row in rows if 'category' in row})
+        valid = []
+        for row in rows:
+            key = row['key'] = self.key(row)
+            try:
+                if key not in existing:
+                    if key[0] == 'id':
+                        raise RowError(row['line'], f"no product with id {row['id']}")
+                    missing = [field for field in REQUIRED_FOR_NEW if field not in row]
+                    if missing:
+                        raise RowError(row['line'], f"new product needs {', '.join(missing)}")
+                elif row.get('image') == existing[key]['image']:
+                    # Unchanged (e.g. re-importing an export); nothing to resolve
+                    del row['image']
+                for value in ([row['image']] if 'image' in row else []) + row.get('images', []):
+                    if self.resolve_image(value) is None:
+                        raise RowError(row['line'], f"image {value!r} not found in storage or {self.media_dir}")
+            except RowError as exc:
+                self.errors.append(exc)
+                continue
+            if key in existing and not self.changed(row, existing[key]):
+                self.stats['unchanged'] += 1
+                continue
+            valid.append(row)
+        return valid
+
+    def changed(self, row, current):
+        """Whether row differs from current; drops lists that are unchanged."""
+        for field in ('benefits', 'images'):
+            if field in row:
+                values = row[field] if field == 'benefits' else [self.stored[v] for v in row[field]]
+                if values == current[field]:
+                    del row[field]
+        category = self.categories[row['category']].id if 'category' in row else current['category_id']
+        return (
+            category != current['category_id']
+            or 'benefits' in row or 'images' in row
+            or any(row[field] != current[field] for field in PRODUCT_FIELDS if field in row and field != 'image')
+            or ('image' in row and self.stored[row['image']] != current['image'])
+        )
+
+    def import_batch(self, rows):
+        # Last row wins when a sku appears twice in one batch
+        rows = list({row.get('sku') or row['id']: row for row in rows}.values())
+        existing = self.existing(rows)
+        rows = self.check(rows, existing)
+        self.stats['created'] += sum(row['key'] not in existing for row in rows)
+        self.stats['updated'] += sum(row['key'] in existing for row in rows)
+        if self.dry_run or not rows:
+            return
+
+        with transaction.atomic():
+            products = self.write_products(rows, existing)
+            self.write_children(rows, products, existing)
+            self.after_write(rows, products, existing)
+
+    def build(self, row, current=None):
+        product = Product()
+        if current is not None:
+            # The INSERT half of an upsert must satisfy NOT NULL on its own
+            product.category_id = current['category_id']
+            for field in PRODUCT_FIELDS:
+                setattr(product, field, current[field])
+        for field in PRODUCT_FIELDS:
+            if field in row:
+                setattr(product, field, row[field])
+        if 'image' in row:
+            product.image = self.stored[row['image']]
+        if 'category' in row:
+            product.category = self.categories[row['category']]
+        return product
+
+    def write_products(self, rows, existing):
+        """Upserts the products; returns {key: Product} with ids set."""
+        products = {}
+        # Rows setting different columns go in different statements
+        groups = {}
+        for row in rows:
+            fields = frozenset(field for field in PRODUCT_FIELDS if field in row)
+            if 'category' in row:
+                fields |= {'category'}
+            groups.setdefault((row['key'][0], fields), []).append(row)
+
+        for (by, fields), group in groups.items():
+            if by == 'id':
+                objs = [self.build(row, existing[row['key']]) for row in group]
+                for row, obj in zip(group, objs):
+                    obj.id = existing[row['key']]['id']
+                if fields:
+                    Product.objects.bulk_update(objs, list(fields))
+            else:
+                objs = [self.build(row, existing.get(row['key'])) for row in group]
+                update_fields = sorted(fields - {'sku'})
+                if update_fields:
+                    Product.objects.bulk_create(objs, update_conflicts=True, unique_fields=['sku'],
+                                                update_fields=update_fields)
+                else:
+                    Product.objects.bulk_create(objs, ignore_conflicts=True)
+            products.update((row['key'], obj) for row, obj in zip(group, objs))
+
+        for key, product in products.items():
+            if key in existing:
+                product.id = existing[key]['id']
+        # Not every backend returns ids from an upsert
+        skus = [key[1] for key, product in products.items() if product.id is None]
+        if skus:
+            ids = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'id'))
+            for sku in skus:
+                products['sku', sku].id = ids[sku]
+        return products
+
+    def write_children(self, rows, products, existing):
+        """Replaces benefits/gallery images and counts the new media references."""
+        refs = Counter()
+        for row in rows:
+            if 'image' in row:
+                refs[self.stored[row['image']]] += 1
+                if row['key'] in existing:
+                    refs[existing[row['key']]['image']] -= 1
+
+        with_benefits = [row for row in rows if 'benefits' in row]
+        if with_benefits:
+            ids = [products[row['key']].id for row in with_benefits]
+            ProductBenefit.objects.filter(product_id__in=ids).delete()
+            ProductBenefit.objects.bulk_create([
+                ProductBenefit(product_id=products[row['key']].id, title=title, position=position)
+                for row in with_benefits for position, title in enumerate(row['benefits'])
+            ])
+
+        with_gallery = [row for row in rows if 'images' in row]
+        if with_gallery:
+            ids = [products[row['key']].id for row in with_gallery]
+            # delete() sends post_delete, which releases the old images itself
+            ProductImage.objects.filter(product_id__in=ids).delete()
+            ProductImage.objects.bulk_create([
+                ProductImage(product_id=products[row['key']].id, image=self.stored[value])
+                for row in with_gallery for value in row['images']
+            ])
+            refs.update(self.stored[value] for row in with_gallery for value in row['images'])
+        storage.adjust_refs(refs)
+
+    def after_write(self, rows, products, existing):
+        """What the model signals would have done, once for the batch."""
+        ids = [product.id for product in products.values()]
+        category_ids = {self.categories[row['category']].id for row in rows if 'category' in row}
+        # Products moved out of a category change its listing too
+        category_ids.update(existing[row['key']]['category_id'] for row in rows if row['key'] in existing)
+
+        search.index_products(search.searchable_products(Product.objects.filter(id__in=ids)))
+
+        # New products have nothing cached or in carts yet
+        updated_ids = [existing[row['key']]['id'] for row in rows if row['key'] in existing]
+        user_ids = set(Cart.objects.filter(product_id__in=updated_ids).values_list('user_id', flat=True))
+
+        def invalidate():
+            for product_id in updated_ids:
+                bump_version('product', product_id)
+            for category_id in category_ids:
+                bump_version('category', category_id)
+            for user_id in user_ids:
+                cart_summary.invalidate(user_id)
+        transaction.on_commit(invalidate)
+
+
+def import_catalog(stream, fmt='csv', batch_size=DEFAULT_BATCH_SIZE, media_dir='.', dry_run=False,
+                   progress=None):
+    """Imports a CSV/JSONL stream; returns the Importer (stats, errors)."""
+    importer = Importer(media_dir=media_dir, dry_run=dry_run)
+    try:
+        rows = clean_rows(READERS[fmt](stream), importer.errors)
+        for batch in batched(rows, batch_size):
+            importer.import_batch(batch)
+            importer.stats['rows'] += len(batch)
+            if progress:
+                progress(importer)
+    except RowError as exc:
+        importer.errors.append(exc)
+    if not dry_run:
+        for name in importer.new_images:
+            if not images.available_widths(name):
+                images.schedule(name)
+    return importer
+
+
+# -------------------------
+# Export
+# -------------------------
+EXPORT_FIELDS = ('id', 'sku', 'name', 'category__name', 'short_description', 'description', 'price',
+                 'discount_price', 'stock', 'is_featured', 'badge', 'image')
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    """Yields one dict per product (COLUMNS keys), streaming from the DB.
+
+    Products come from a server-side iterator; benefits and gallery images
+    are fetched with one query each per chunk.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    products = queryset.order_by('id').values(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    for chunk in batched(products, chunk_size):
+        ids = [product['id'] for product in chunk]
+        benefits = _lists(ProductBenefit, 'title', ids)
+        gallery = _lists(ProductImage, 'image', ids)
+        for product in chunk:
+            yield {
+                'sku': product['sku'] or '',
+                'id': product['id'],
+                'name': product['name'],
+                'category': product['category__name'],
+                'short_description': product['short_description'] or '',
+                'description': product['description'],
+                'price': str(product['price']),
+                'discount_price': '' if product['discount_price'] is None else str(product['discount_price']),
+                'stock': product['stock'],
+                'is_featured': product['is_featured'],
+                'badge': product['badge'] or '',
+                'image': product['image'],
+                'images': gallery.get(product['id'], []),
+                'benefits': benefits.get(product['id'], []),
+            }
+
+
+def write_csv(rows, stream):
+    writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        row['images'] = LIST_SEPARATOR.join(row['images'])
+        row['benefits'] = LIST_SEPARATOR.join(row['benefits'])
+        row['is_featured'] = 'true' if row['is_featured'] else 'false'
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(rows, stream):
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(row, ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
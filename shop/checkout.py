@@ -0,0 +1,123 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+
+from . import cart_summary, jobs, payments, tasks
+from .fragment_cache import bump_version
+from .models import Cart, Order, OrderItem, Product
+from .pricing import price_cart
+
+# -------------------------
+# Checkout
+# -------------------------
+# Turns a user's cart into an Order in a single transaction: stock is taken
+# with one conditional UPDATE (no read-modify-write), OrderItem rows are bulk
+# inserted and the ordered cart lines are removed. If any product doesn't have
+# enough stock nothing is written at all.
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    pass
+
+
+class PaymentMismatchError(CheckoutError):
+    """The cart isn't what the payment was made for, or the payment was used already."""
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(p.name for p in products)
+        super().__init__(f"Not enough stock for: {names}")
+
+
+def _reserve_stock(quantities):
+    """Decrements stock for {product_id: quantity} in one statement.
+
+    Every product row must still have enough stock for the UPDATE to touch
+    it, so a short update count means another checkout got there first.
+    """
+    condition = Q()
+    new_stock = []
+    for product_id, quantity in sorted(quantities.items()):
+        condition |= Q(id=product_id, stock__gte=quantity)
+        new_stock.append(When(id=product_id, then=F('stock') - Value(quantity)))
+    updated = Product.objects.filter(condition).update(
+        stock=Case(*new_stock, default=F('stock'), output_field=PositiveIntegerField())
+    )
+    return updated == len(quantities)
+
+
+def _short_products(quantities):
+    products = Product.objects.filter(id__in=quantities).only('id', 'name', 'stock')
+    return [p for p in products if p.stock < quantities[p.id]]
+
+
+def _refresh_caches(user_id, product_ids):
+    # In this process, not the job queue: caches are often per process, and
+    # stock shown on product pages must not wait for a worker
+    for product_id in product_ids:
+        bump_version('product', product_id)
+    cart_summary.refresh(user_id)
+
+
+def place_order(user, payment_order=None, **order_fields):
+    """Creates an Order with OrderItems from the user's cart and clears it.
+
+    order_fields are passed to Order (names, phone, address, payment info).
+    For paid checkouts payment_order is the session's record from
+    payments.get_or_create_order(); the cart must still match it. Raises
+    EmptyCartError, PaymentMismatchError or OutOfStockError; on error
+    nothing is saved.
+    """
+    # Cart lines are read before the transaction so that its first statement
+    # is a write: on SQLite that takes the write lock up front instead of
+    # upgrading a read lock, which is what fails with "database is locked".
+    cart = price_cart(user)
+    if cart.is_empty:
+        raise EmptyCartError("Your cart is empty.")
+    if payment_order is not None and not payments.matches_cart(payment_order, cart):
+        raise PaymentMismatchError("Your cart changed after payment was started.")
+
+    quantities = {}
+    for item in cart.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    with transaction.atomic():
+        if not _reserve_stock(quantities):
+            raise OutOfStockError(_short_products(quantities))
+
+        try:
+            order = Order.objects.create(user=user, total=cart.total, **order_fields)
+        except IntegrityError:
+            # razorpay_order_id is unique: one payment, one order, so an old
+            # session cookie can't replay it
+            if payment_order is None:
+                raise
+            raise PaymentMismatchError("This payment has already been used.")
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                price=item.product.final_price,
+            )
+            for item in cart.items
+        ])
+        # The cart was read outside the transaction: if a concurrent checkout
+        # (double submit) already ordered these lines, this one must not
+        deleted = Cart.objects.filter(id__in=[item.id for item in cart.items]).delete()[1].get(Cart._meta.label, 0)
+        if deleted != len(cart.items):
+            raise EmptyCartError("Your cart has already been ordered.")
+
+        # update() skips post_save, so refresh cached product pages (stock) here
+        product_ids = sorted(quantities)
+        transaction.on_commit(lambda: _refresh_caches(user.id, product_ids))
+        # Slow side work runs in the job queue once the order has committed
+        jobs.enqueue(tasks.send_order_confirmation, order_id=order.id)
+        jobs.enqueue(tasks.record_order_event, order_id=order.id)
+
+    return order
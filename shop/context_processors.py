@@ -1,18 +1,22 @@
 # shop/context_processors.py
-from .models import Cart
+from django.utils.functional import SimpleLazyObject
+
+from . import cart_summary, guest_cart, page_cache
 
-def cart_count(request):
-    cart_items_count = 0
 
-    if request.user.is_authenticated:
-        # Logged-in user: count items from Cart model
-        cart_items_count = Cart.objects.filter(user=request.user).count()
-    else:
-        # Guest user: count items from session
-        cart = request.session.get('cart', {})
-        for item in cart.values():
-            cart_items_count += item.get('quantity', 0)
+def cart_count(request):
+    # Evaluated only when a template actually renders the badge
+    def count():
+        if request.user.is_authenticated:
+            # Logged-in user: cached summary of the Cart rows
+            return cart_summary.get_summary(request.user.id)['item_count']
+        # Guest user: the cart kept in the session
+        return guest_cart.item_count(request.session)
 
     return {
-        'cart_items_count': cart_items_count
+        'cart_items_count': SimpleLazyObject(count),
+        # Pages shared through the page cache (shop/page_cache.py) get the
+        # badge from views.cart_badge instead
+        'defer_cart_badge': getattr(request, 'cacheable_page', False),
+        'cart_badge_esi': page_cache.setting('ESI'),
     }
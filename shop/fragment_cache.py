@@ -0,0 +1,380 @@
+import fnmatch
+import hashlib
+import itertools
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# -------------------------
+# Versioned fragment cache
+# -------------------------
+# Rendered page fragments are stored under keys that include a version number
+# for the object they were built from, e.g. "pdp:12:v1739871234001". Changing
+# the object bumps its version (see shop/signals.py), so old fragments are
+# simply never read again and age out of the backend.
+#
+# Configure with settings.FRAGMENT_CACHE, e.g.
+#   FRAGMENT_CACHE = {'BACKEND': 'locmem', 'OPTIONS': {'max_entries': 5000}}
+#   FRAGMENT_CACHE = {'BACKEND': 'file', 'OPTIONS': {'directory': '/var/cache/kani'}}
+#   FRAGMENT_CACHE = {'BACKEND': 'redis', 'OPTIONS': {'url': 'redis://localhost:6379/1'}}
+# The locmem backend is per process; use file or redis when running several
+# workers so version bumps are seen by all of them.
+
+DEFAULT_TIMEOUT = 3600
+
+
+class CacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def record(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class BaseBackend:
+    """get/set/delete/incr on pickled values with hit/miss accounting."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    def get(self, key):
+        raw = self._get(key)
+        if raw is None:
+            self.stats.record('misses')
+            return None
+        self.stats.record('hits')
+        return pickle.loads(raw)
+
+    def set(self, key, value, timeout=None):
+        self.stats.record('sets')
+        self._set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                  self.timeout if timeout is None else timeout)
+
+    def delete(self, key):
+        self._delete(key)
+
+    def incr(self, key, initial):
+        """Atomically increments an integer key, creating it at initial."""
+        raise NotImplementedError
+
+    def get_counter(self, key):
+        """Current value of an incr() key, or None."""
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, raw, timeout):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+# -------------------------
+# Local-memory LRU
+# -------------------------
+class LocMemLRUBackend(BaseBackend):
+    def __init__(self, max_entries=5000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.data = OrderedDict()  # key -> (expires_at, raw)
+        self.counters = {}
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            expires_at, raw = entry
+            if expires_at and expires_at < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return raw
+
+    def _set(self, key, raw, timeout):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self.lock:
+            self.data[key] = (expires_at, raw)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+                self.stats.record('evictions')
+
+    def _delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.counters.pop(key, None)
+
+    def incr(self, key, initial):
+        # Counters live outside the LRU so versions are never evicted
+        with self.lock:
+            value = self.counters.get(key, initial - 1) + 1
+            self.counters[key] = value
+            return value
+
+    def get_counter(self, key):
+        with self.lock:
+            return self.counters.get(key)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.counters.clear()
+
+
+# -------------------------
+# File-based
+# -------------------------
+class FileBackend(BaseBackend):
+    def __init__(self, directory=None, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'kani_fragment_cache')
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at = float(f.readline())
+                if expires_at and expires_at < time.time():
+                    return None
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def _set(self, key, raw, timeout):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        expires_at = time.time() + timeout if timeout else 0
+        # Write then rename so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'%f\n' % expires_at)
+            f.write(raw)
+        os.replace(tmp, path)
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key, initial):
+        import fcntl
+        path = self._path(key) + '.counter'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            current = f.read().strip()
+            value = int(current) + 1 if current else initial
+            f.seek(0)
+            f.truncate()
+            f.write(str(value))
+            return value
+
+    def get_counter(self, key):
+        try:
+            with open(self._path(key) + '.counter') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+
+# -------------------------
+# Redis-compatible
+# -------------------------
+class LocalRedis:
+    """In-process stand-in for the subset of the redis-py client used here."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def _alive(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at and expires_at < time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self.lock:
+            return self._alive(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and self._alive(key) is not None:
+                return False
+            self.data[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self._alive(key) or 0) + 1
+            self.data[key] = (str(value).encode(), None)
+            return value
+
+    def scan_iter(self, match=None, count=None):
+        with self.lock:
+            keys = list(self.data)
+        if match is not None:
+            # fnmatch has no backslash escapes; [c] matches c literally
+            match = re.sub(r'\\(.)', r'[\1]', match)
+        return (key for key in keys if match is None or fnmatch.fnmatchcase(key, match))
+
+    def unlink(self, *keys):
+        return self.delete(*keys)
+
+
+CLEAR_BATCH_SIZE = 1000
+
+
+def _glob_escape(text):
+    return ''.join('\\' + char if char in '*?[]\\' else char for char in text)
+
+
+class RedisBackend(BaseBackend):
+    def __init__(self, client=None, url=None, prefix='kani:', **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            if url:
+                import redis
+                client = redis.Redis.from_url(url)
+            else:
+                client = LocalRedis()
+        self.client = client
+        self.prefix = prefix
+
+    def _get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def _set(self, key, raw, timeout):
+        self.client.set(self.prefix + key, raw, ex=timeout or None)
+
+    def _delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key, initial):
+        # SET NX seeds the counter at initial - 1 so the first INCR returns initial
+        self.client.set(self.prefix + key, initial - 1, nx=True)
+        return self.client.incr(self.prefix + key)
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + key)
+        return int(value) if value is not None else None
+
+    def clear(self):
+        # Only our keys: the database may hold sessions, queues, other apps...
+        keys = self.client.scan_iter(match=_glob_escape(self.prefix) + '*', count=CLEAR_BATCH_SIZE)
+        while batch := list(itertools.islice(keys, CLEAR_BATCH_SIZE)):
+            self.client.unlink(*batch)
+
+
+BACKENDS = {
+    'locmem': LocMemLRUBackend,
+    'file': FileBackend,
+    'redis': RedisBackend,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_fragment_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, 'FRAGMENT_CACHE', {})
+                backend = BACKENDS[config.get('BACKEND', 'locmem')]
+                _cache = backend(**config.get('OPTIONS', {}))
+    return _cache
+
+
+def set_fragment_cache(cache):
+    """Swaps the process-wide backend (benchmarks, tests)."""
+    global _cache
+    _cache = cache
+
+
+# -------------------------
+# Versions
+# -------------------------
+def _version_key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def get_version(kind, pk):
+    """Current version of an object; seeded from the clock the first time.
+
+    Seeding with a timestamp rather than 1 means a version that was lost (cache
+    flush, restart) can't come back as a number that old fragments still use.
+    """
+    cache = get_fragment_cache()
+    key = _version_key(kind, pk)
+    version = cache.get_counter(key)
+    if version is None:
+        version = cache.incr(key, initial=time.time_ns() // 1000)
+    return version
+
+
+# Versions that move with every bump of a kind: listings spanning all
+# categories (the categories page) depend on each of them
+ROLLUPS = {'category': ('catalog', 0)}
+
+
+def bump_version(kind, pk):
+    cache = get_fragment_cache()
+    if kind in ROLLUPS:
+        cache.incr(_version_key(*ROLLUPS[kind]), initial=time.time_ns() // 1000)
+    return cache.incr(_version_key(kind, pk), initial=time.time_ns() // 1000)
+
+
+def stats():
+    return get_fragment_cache().stats.as_dict()
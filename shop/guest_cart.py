@@ -0,0 +1,99 @@
+from django.db import transaction
+
+from . import cart_summary
+from .models import Cart, Product
+from .pricing import CART_PRODUCT_FIELDS, price_lines
+
+# -------------------------
+# Guest carts
+# -------------------------
+# A guest's cart lives in their session as {"<product id>": quantity}: plain
+# JSON, so it fits the signed-cookie session engine and browsing guests
+# never write to the database. On login merge() folds it into the user's
+# Cart rows with a single upsert (quantities add up) and empties it.
+
+SESSION_KEY = 'cart'
+# Keeps the session cookie well under the 4 KB browsers accept
+MAX_LINES = 50
+# The product columns price_cart() loads, without the join prefix
+PRODUCT_FIELDS = tuple(
+    field.removeprefix('product__') for field in CART_PRODUCT_FIELDS if field.startswith('product__')
+)
+
+
+def get_lines(session):
+    """{product_id: quantity} for the session's cart."""
+    lines = {}
+    for product_id, quantity in session.get(SESSION_KEY, {}).items():
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            # Not written by this module (e.g. an older session format)
+            continue
+        if quantity > 0:
+            lines[product_id] = quantity
+    return lines
+
+
+def _save(session, lines):
+    if lines:
+        session[SESSION_KEY] = {str(product_id): quantity for product_id, quantity in lines.items()}
+    else:
+        session.pop(SESSION_KEY, None)
+
+
+def add(session, product_id, quantity=1):
+    """Adds quantity of a product; returns False if the cart is full."""
+    lines = get_lines(session)
+    if product_id not in lines and len(lines) >= MAX_LINES:
+        return False
+    lines[product_id] = lines.get(product_id, 0) + quantity
+    _save(session, lines)
+    return True
+
+
+def item_count(session):
+    return sum(get_lines(session).values())
+
+
+def clear(session):
+    session.pop(SESSION_KEY, None)
+
+
+def price_guest_cart(session):
+    """The session's cart priced like price_cart(), as unsaved Cart lines."""
+    lines = get_lines(session)
+    products = Product.objects.only(*PRODUCT_FIELDS).in_bulk(list(lines))
+    # Products deleted since they were added just drop out
+    items = [
+        Cart(product=products[product_id], quantity=quantity)
+        for product_id, quantity in lines.items()
+        if product_id in products
+    ]
+    return price_lines(items)
+
+
+def merge(session, user):
+    """Moves the session's cart into user's Cart rows; returns the lines merged."""
+    lines = get_lines(session)
+    if not lines:
+        return 0
+    with transaction.atomic():
+        product_ids = set(Product.objects.filter(id__in=list(lines)).values_list('id', flat=True))
+        current = dict(
+            Cart.objects.filter(user=user, product_id__in=product_ids).select_for_update()
+            .values_list('product_id', 'quantity')
+        )
+        Cart.objects.bulk_create(
+            [
+                Cart(user=user, product_id=product_id, quantity=current.get(product_id, 0) + lines[product_id])
+                for product_id in product_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'product'],
+            update_fields=['quantity'],
+        )
+        # bulk_create() skips the Cart signals
+        transaction.on_commit(lambda: cart_summary.invalidate(user.id))
+    clear(session)
+    return len(product_ids)
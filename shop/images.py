@@ -0,0 +1,248 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from .fragment_cache import bump_version
+from .storage import DERIVATIVE_ROOT
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Responsive image derivatives
+# -------------------------
+# Uploaded images are served as multi-MB originals. For every image we
+# pre-generate fixed-width copies in WebP (plus the original format as a
+# fallback) under media/derivatives/, and templates point srcset at them
+# (see the responsive_img tag in templatetags/custom_tags.py).
+#
+# Generation runs in a process pool after the upload's transaction commits,
+# so resizing never holds up a request. settings.IMAGE_DERIVATIVES_MODE:
+#   'process' - a ProcessPoolExecutor of IMAGE_DERIVATIVES_WORKERS processes
+#   'sync'    - generate inline (tests, scripts)
+#   'off'     - don't generate on upload (backfill with the management command)
+
+WIDTHS = (160, 320, 640, 1280)
+DEFAULT_FORMATS = ('webp',)
+QUALITY = {'webp': 80, 'avif': 60, 'jpeg': 82}
+MIME_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+CACHE_TIMEOUT = 60 * 60 * 24
+MISSING_TIMEOUT = 60  # re-check soon; generation may still be running
+
+# Original formats we re-encode as the fallback; anything else falls back to PNG
+FALLBACK_FORMATS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+
+
+def modern_formats():
+    """The formats to generate besides the fallback (e.g. ['webp', 'avif'])."""
+    formats = getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', DEFAULT_FORMATS)
+    return [fmt for fmt in formats if features.check(fmt)]
+
+
+def _fallback_ext(name):
+    ext = os.path.splitext(name)[1].lower()
+    return ext if ext in FALLBACK_FORMATS else '.png'
+
+
+def derivative_name(name, width, fmt=None):
+    """media-relative name of the width-px copy of name (fmt=None: original format)."""
+    stem = os.path.splitext(name)[0]
+    ext = f'.{fmt}' if fmt else _fallback_ext(name)
+    return f'{DERIVATIVE_ROOT}/{stem}.{width}w{ext}'
+
+
+def _cache_key(name):
+    return f'img-derivatives:{name}'
+
+
+def _done_key(name):
+    return f'img-derivatives-done:{name}'
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    options = {'quality': QUALITY[fmt]} if fmt in QUALITY else {'optimize': True}
+    if fmt == 'webp':
+        options['method'] = 4
+    image.save(buffer, format=fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def _store(name, content, storage):
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content))
+
+
+def generate(name, force=False, storage=None):
+    """Writes the derivatives of name and returns the widths available.
+
+    Widths at or above the original's are skipped; the original is used
+    there.
+    """
+    storage = storage or default_storage
+    with storage.open(name) as f:
+        original = Image.open(f)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    if original.mode == 'P':
+        original = original.convert('RGBA')
+
+    widths = [w for w in WIDTHS if w < original.width]
+    formats = modern_formats() + [None]
+    for width in widths:
+        resized = None
+        for fmt in formats:
+            target = derivative_name(name, width, fmt)
+            if not force and storage.exists(target):
+                continue
+            if resized is None:
+                height = max(1, round(original.height * width / original.width))
+                resized = original.resize((width, height), Image.Resampling.LANCZOS)
+            _store(target, _encode(resized, fmt or FALLBACK_FORMATS[_fallback_ext(name)]), storage)
+    return widths
+
+
+def available_widths(name):
+    """Widths with generated derivatives for name ([] if none yet)."""
+    if not name:
+        return []
+    key = _cache_key(name)
+    widths = cache.get(key)
+    if widths is None:
+        widths = [w for w in WIDTHS if default_storage.exists(derivative_name(name, w))]
+        cache.set(key, widths, CACHE_TIMEOUT if widths else MISSING_TIMEOUT)
+    return widths
+
+
+def processed(name):
+    """Whether derivatives were generated for name (possibly none, for small images)."""
+    return bool(available_widths(name)) or cache.get(_done_key(name)) is not None
+
+
+def srcset(name, fmt=None):
+    return ', '.join(
+        f'{default_storage.url(derivative_name(name, w, fmt))} {w}w' for w in available_widths(name)
+    )
+
+
+def url_for_width(name, width, fmt=None):
+    """URL of the smallest derivative at least width px wide (else the largest)."""
+    widths = available_widths(name)
+    if not widths:
+        return default_storage.url(name)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return default_storage.url(derivative_name(name, chosen, fmt))
+
+
+def refresh_pages(names, batch_size=500):
+    """Bumps the fragment versions of the products (and categories) showing any of names.
+
+    For batch jobs: like the model signals, this reaches every process when
+    FRAGMENT_CACHE is shared, where clearing a local cache wouldn't.
+    """
+    from .models import Product, ProductImage, ProductThumbnail, ProductUserImage
+    names = list(names)
+    product_ids = set()
+    for start in range(0, len(names), batch_size):
+        chunk = names[start:start + batch_size]
+        product_ids.update(Product.objects.filter(image__in=chunk).values_list('id', flat=True))
+        for model in (ProductImage, ProductThumbnail, ProductUserImage):
+            product_ids.update(model.objects.filter(image__in=chunk).values_list('product_id', flat=True))
+    product_ids = sorted(product_ids)
+    category_ids = set()
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        category_ids.update(Product.objects.filter(id__in=chunk).values_list('category_id', flat=True))
+    for product_id in product_ids:
+        bump_version('product', product_id)
+    for category_id in category_ids:
+        bump_version('category', category_id)
+    return len(product_ids)
+
+
+# -------------------------
+# Process pool
+# -------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    django.setup()
+
+
+def _generate_in_worker(name, force=False):
+    # Module-level so it can be pickled for the pool
+    return generate(name, force=force)
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a threaded server process can deadlock the child
+                _pool = ProcessPoolExecutor(
+                    max_workers=getattr(settings, 'IMAGE_DERIVATIVES_WORKERS', 2),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                )
+    return _pool
+
+
+def _finished(name, widths, on_done):
+    # The files were written by another process, maybe to another disk
+    formats = modern_formats() + [None]
+    stored = [w for w in widths if all(default_storage.exists(derivative_name(name, w, fmt)) for fmt in formats)]
+    if stored != widths:
+        logger.warning("Derivatives of %s missing from storage: %s", name, sorted(set(widths) - set(stored)))
+        cache.set(_cache_key(name), stored, MISSING_TIMEOUT)
+        return
+    cache.set(_cache_key(name), widths, CACHE_TIMEOUT)
+    # Names are content-addressed, so this holds for as long as the name does;
+    # images narrower than WIDTHS[0] have no derivatives but count as done
+    cache.set(_done_key(name), True, None)
+    if on_done is not None:
+        on_done()
+
+
+def _submit(name, on_done):
+    mode = getattr(settings, 'IMAGE_DERIVATIVES_MODE', 'process')
+    if mode == 'off':
+        return
+    if mode == 'sync':
+        try:
+            _finished(name, generate(name), on_done)
+        except Exception:
+            logger.exception("Could not generate derivatives for %s", name)
+        return
+
+    def done(future):
+        try:
+            _finished(name, future.result(), on_done)
+        except Exception:
+            logger.exception("Could not generate derivatives for %s", name)
+    _executor().submit(_generate_in_worker, name).add_done_callback(done)
+
+
+def schedule(name, on_done=None):
+    """Generates derivatives for name once the current transaction commits.
+
+    on_done runs in this process afterwards, e.g. to invalidate cached HTML
+    that was rendered before the derivatives existed.
+    """
+    if name:
+        transaction.on_commit(lambda: _submit(name, on_done))
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Background jobs
+# -------------------------
+# Side work that shouldn't hold up a request (emails, analytics, cache
+# refreshes) is registered with @task and queued with enqueue(). Where it
+# runs depends on settings.JOB_QUEUE_MODE:
+#   'db'     - a Job row; processed by `manage.py run_jobs` worker processes
+#   'thread' - an in-process thread pool (development)
+#   'sync'   - run immediately in the caller (tests, scripts)
+# Failed jobs are retried with exponential backoff up to max_attempts.
+
+DEFAULT_MODE = 'db'
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2          # seconds; retry n waits BACKOFF_BASE * 2 ** (n - 1)
+BACKOFF_MAX = 60 * 60
+LOCK_TIMEOUT = 15 * 60    # a 'running' job older than this is assumed orphaned
+
+_registry = {}
+
+
+def task(func):
+    """Registers func so it can be enqueued by name."""
+    _registry[f'{func.__module__}.{func.__name__}'] = func
+    return func
+
+
+def _task_name(func_or_name):
+    name = func_or_name if isinstance(func_or_name, str) else f'{func_or_name.__module__}.{func_or_name.__name__}'
+    if name not in _registry:
+        raise KeyError(f"Unknown task {name!r}; decorate it with @task")
+    return name
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+def get_mode():
+    return getattr(settings, 'JOB_QUEUE_MODE', DEFAULT_MODE)
+
+
+def enqueue(func_or_name, max_attempts=DEFAULT_MAX_ATTEMPTS, delay=0, **payload):
+    """Queues a task call after the current transaction commits.
+
+    payload must be JSON serialisable (pass ids, not model instances).
+    """
+    name = _task_name(func_or_name)
+    mode = get_mode()
+    if mode == 'sync':
+        transaction.on_commit(lambda: _run_with_retries(name, payload, max_attempts, sleep=False))
+    elif mode == 'thread':
+        transaction.on_commit(lambda: _executor().submit(_run_in_thread, name, payload, max_attempts))
+    else:
+        transaction.on_commit(lambda: Job.objects.create(
+            name=name,
+            payload=payload,
+            max_attempts=max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        ))
+
+
+# -------------------------
+# Thread-pool / inline modes
+# -------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'JOB_QUEUE_THREADS', 4),
+                    thread_name_prefix='shop-jobs',
+                )
+    return _pool
+
+
+def _run_with_retries(name, payload, max_attempts, sleep=True):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            _registry[name](**payload)
+            return True
+        except Exception:
+            logger.exception("Job %s failed (attempt %s/%s)", name, attempt, max_attempts)
+            if sleep and attempt < max_attempts:
+                time.sleep(backoff(attempt))
+    return False
+
+
+def _run_in_thread(name, payload, max_attempts):
+    try:
+        _run_with_retries(name, payload, max_attempts)
+    finally:
+        connection.close()
+
+
+# -------------------------
+# Database worker
+# -------------------------
+def claim_jobs(limit=10):
+    """Claims up to limit due jobs for this worker.
+
+    Each job is taken with a conditional UPDATE on its status, so several
+    worker processes can poll the same table without running a job twice.
+    """
+    now = timezone.now()
+    # Requeue jobs whose worker died mid-run
+    Job.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=LOCK_TIMEOUT)).update(
+        status='queued', locked_at=None,
+    )
+    candidates = list(
+        Job.objects.filter(status='queued', run_at__lte=now)
+        .order_by('run_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    claimed = []
+    for job_id in candidates:
+        if Job.objects.filter(id=job_id, status='queued').update(status='running', locked_at=now):
+            claimed.append(job_id)
+    return list(Job.objects.filter(id__in=claimed).order_by('run_at', 'id'))
+
+
+def run_job(job):
+    func = _registry.get(job.name)
+    job.attempts += 1
+    try:
+        if func is None:
+            raise KeyError(f"Unknown task {job.name!r}")
+        func(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            logger.error("Job %s gave up after %s attempts", job, job.attempts)
+        else:
+            job.status = 'queued'
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            logger.warning("Job %s failed, retrying at %s", job, job.run_at)
+    else:
+        job.status = 'done'
+        job.last_error = None
+    job.locked_at = None
+    job.save(update_fields=['status', 'attempts', 'run_at', 'locked_at', 'last_error', 'updated_at'])
+    return job.status == 'done'
+
+
+def work(batch_size=10, poll_interval=1.0, once=False, stop_event=None):
+    """Processes jobs until stopped (or, with once=True, until none are due)."""
+    processed = 0
+    while not (stop_event and stop_event.is_set()):
+        close_old_connections()
+        jobs = claim_jobs(batch_size)
+        for job in jobs:
+            run_job(job)
+            processed += 1
+        if not jobs:
+            if once:
+                break
+            time.sleep(poll_interval)
+    return processed
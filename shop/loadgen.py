@@ -0,0 +1,33 @@
+import time
+
+import requests
+
+# -------------------------
+# HTTP load generator worker
+# -------------------------
+# Runs in the worker processes started by benchmark.run_http(). Kept free of
+# Django imports so a spawned worker starts without setting Django up.
+
+
+def run(job):
+    """Sends job['requests'] in order; returns (seconds, status, None) each."""
+    session = requests.Session()
+    csrf = job['csrf_token']
+    results = []
+    for method, path, data, user_id in job['requests']:
+        cookies = {job['csrf_cookie']: csrf}
+        if user_id is not None:
+            cookies[job['session_cookie']] = job['sessions'][user_id]
+        if data is not None:
+            data = {**data, 'csrfmiddlewaretoken': csrf}
+        start = time.perf_counter()
+        try:
+            response = session.request(method, job['base_url'] + path, data=data, cookies=cookies,
+                                       allow_redirects=False, timeout=job['timeout'])
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        results.append((time.perf_counter() - start, status, None))
+        # Don't carry one user's cookies into the next request
+        session.cookies.clear()
+    return results
@@ -0,0 +1,122 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import benchmark
+from shop.models import Category
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a deterministic synthetic shop and benchmark the storefront views "
+        "through the test client (with query budgets) and/or over HTTP from "
+        "several processes. Prints p50/p95/p99 latency and throughput as JSON "
+        "and exits non-zero when a budget or baseline is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='1k',
+                            help="Products to seed: 1k, 10k, 100k or a number (default 1k).")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed for data and request plans.")
+        parser.add_argument('--reseed', action='store_true', help="Drop and re-create the benchmark data.")
+        parser.add_argument('--teardown', action='store_true', help="Delete the benchmark data and exit.")
+        parser.add_argument('--mode', choices=['client', 'http', 'both'], default='client',
+                            help="Test client in this process, HTTP against --url, or both.")
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help="Server for --mode http (run it with the same database and settings).")
+        parser.add_argument('--workers', type=int, default=4, help="Load generator processes (HTTP mode).")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per scenario first.")
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS, dest='scenarios',
+                            help="Only run this scenario (repeatable).")
+        parser.add_argument('--budget', action='append', default=[], metavar='VIEW=QUERIES',
+                            help="Override a query budget, e.g. --budget categories=3.")
+        parser.add_argument('--baseline', help="Previous JSON report; fail if a p95 regressed.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed p95 growth over --baseline (default 0.25 = 25%%).")
+        parser.add_argument('--output', '-o', help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options['teardown']:
+            benchmark.teardown()
+            self.stdout.write(self.style.SUCCESS("Benchmark data deleted."))
+            return
+
+        budgets = dict(benchmark.QUERY_BUDGETS)
+        for override in options['budget']:
+            view, _, value = override.partition('=')
+            if view not in budgets or not value.isdigit():
+                raise CommandError(f"Bad --budget {override!r}; expected e.g. categories=3")
+            budgets[view] = int(value)
+
+        products = benchmark.scale_value(options['scale'])
+        if options['reseed'] or benchmark.seeded_count() != products:
+            self.stderr.write("Seeding benchmark data...")
+            benchmark.teardown()
+            began = time.perf_counter()
+            counts = benchmark.seed(products, seed=options['seed'],
+                                    progress=lambda message: self.stderr.write(f"  {message}"))
+            self.stderr.write(f"Seeded {counts} in {time.perf_counter() - began:.1f}s")
+
+        rng = random.Random(options['seed'])
+        product_ids = list(benchmark.bench_products().order_by('id').values_list('id', flat=True))
+        category_ids = list(Category.objects.filter(name__startswith=benchmark.CATEGORY_PREFIX)
+                            .values_list('id', flat=True))
+        users = list(benchmark.bench_users().order_by('username'))
+        # Shoppers browse and add to carts; buyers each place one order
+        shoppers, buyers = users[:len(users) // 2], users[len(users) // 2:]
+        cookies = {user.id: benchmark.session_cookie(user) for user in users}
+        benchmark.use_fake_gateway()
+
+        report = {'scale': products, 'seed': options['seed'], 'modes': {}}
+        modes = ['client', 'http'] if options['mode'] == 'both' else [options['mode']]
+        failures = []
+        for mode in modes:
+            scenarios = {}
+            for name in options['scenarios'] or benchmark.SCENARIOS:
+                user_ids = [u.id for u in (buyers if name == 'checkout_page' else shoppers)]
+                count = options['requests'] + options['warmup']
+                if name == 'checkout_page':
+                    count = min(count, len(user_ids))
+                    benchmark.prepare_checkout(user_ids[:count], rng)
+                requests = benchmark.plan(name, count, rng, product_ids, category_ids, user_ids)
+                warmup, measured = requests[:options['warmup']], requests[options['warmup']:]
+
+                if mode == 'client':
+                    benchmark.run_client(warmup, cookies)
+                    began = time.perf_counter()
+                    results = benchmark.run_client(measured, cookies)
+                    elapsed = time.perf_counter() - began
+                    summary = benchmark.summarize(results, elapsed, budgets[name])
+                    if summary['queries']['max'] > budgets[name]:
+                        failures.append(f"{name}: {summary['queries']['max']} queries "
+                                        f"(budget {budgets[name]})")
+                else:
+                    benchmark.run_http(options['url'], warmup, cookies, options['workers'])
+                    results, elapsed = benchmark.run_http(options['url'], measured, cookies, options['workers'])
+                    summary = benchmark.summarize(results, elapsed)
+                if summary['errors']:
+                    failures.append(f"{name}: {summary['errors']} error responses ({mode})")
+                scenarios[name] = summary
+                self.stderr.write(f"  {mode} {name}: p95 {summary['p95_ms']}ms, "
+                                  f"{summary['throughput_rps']} req/s")
+            report['modes'][mode] = {'scenarios': scenarios}
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            for mode, current in report['modes'].items():
+                previous = baseline.get('modes', {}).get(mode, {})
+                failures += [f"{mode} {failure}" for failure in
+                             benchmark.regressions(current, previous, options['tolerance'])]
+
+        report['failures'] = failures
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if failures:
+            raise CommandError("Benchmark failed:\n  " + "\n  ".join(failures))
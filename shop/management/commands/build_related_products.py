@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the RelatedProduct table from order/cart co-occurrence and "
+        "TF-IDF text similarity (see shop/recommendations.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only rebuild products new since the last build or in newer orders/carts.")
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help="Only rebuild this product id (repeatable).")
+        parser.add_argument('--per-product', type=int, default=None,
+                            help="Recommendations stored per product.")
+
+    def handle(self, *args, **options):
+        product_ids = options['product_ids']
+        if options['incremental']:
+            product_ids = set(product_ids or ()) | recommendations.changed_product_ids()
+            if not product_ids:
+                self.stdout.write("Nothing changed since the last build.")
+                return
+            self.stdout.write(f"Rebuilding {len(product_ids)} product(s).")
+
+        began = time.perf_counter()
+        written = recommendations.build(
+            product_ids=product_ids,
+            per_product=options['per_product'],
+            progress=lambda n: self.stdout.write(f"  {n} products written"),
+        )
+        elapsed = time.perf_counter() - began
+        self.stdout.write(self.style.SUCCESS(f"Wrote recommendations for {written} product(s) in {elapsed:.1f}s."))
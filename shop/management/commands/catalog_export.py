@@ -0,0 +1,42 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import catalog_io
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the catalog as CSV or JSON Lines, streamed in chunks; the "
+        "output can be fed back to catalog_import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="Output file (default: stdout).")
+        parser.add_argument('--format', choices=catalog_io.FORMATS,
+                            help="Output format (default: from the file extension, csv for stdout).")
+        parser.add_argument('--category', help="Only products in this category.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Products fetched per query.")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or ('csv' if path == '-' else catalog_io.guess_format(path))
+        products = Product.objects.all()
+        if options['category']:
+            products = products.filter(category__name=options['category'])
+
+        began = time.perf_counter()
+        try:
+            stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            count = catalog_io.WRITERS[fmt](catalog_io.export_rows(products, options['chunk_size']), stream)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        if path != '-':
+            elapsed = time.perf_counter() - began
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} product(s) to {path} in {elapsed:.1f}s."))
@@ -0,0 +1,62 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import catalog_io
+
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert categories, products, benefits and images from a CSV or JSON "
+        "Lines file (see shop/catalog_io.py for the columns)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=catalog_io.FORMATS,
+                            help="Input format (default: from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=catalog_io.DEFAULT_BATCH_SIZE,
+                            help="Rows per bulk write.")
+        parser.add_argument('--media-dir', default='.',
+                            help="Directory that relative image paths in the file are read from.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate the file and report what would change without writing.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or catalog_io.guess_format(path)
+        began = time.perf_counter()
+
+        def progress(importer):
+            stats = importer.stats
+            rate = stats['rows'] / max(time.perf_counter() - began, 1e-6)
+            self.stdout.write(f"  {stats['rows']} rows ({stats['created']} new, {stats['updated']} updated, "
+                              f"{stats['unchanged']} unchanged, {len(importer.errors)} rejected) {rate:,.0f} rows/s")
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            importer = catalog_io.import_catalog(
+                stream, fmt=fmt, batch_size=options['batch_size'], media_dir=options['media_dir'],
+                dry_run=options['dry_run'], progress=progress,
+            )
+
+        for error in importer.errors[:MAX_ERRORS_SHOWN]:
+            self.stderr.write(str(error))
+        if len(importer.errors) > MAX_ERRORS_SHOWN:
+            self.stderr.write(f"... and {len(importer.errors) - MAX_ERRORS_SHOWN} more")
+
+        stats = importer.stats
+        elapsed = time.perf_counter() - began
+        verb = "Would import" if options['dry_run'] else "Imported"
+        summary = (f"{verb} {stats['created'] + stats['updated']} product(s): {stats['created']} new, "
+                   f"{stats['updated']} updated ({stats['unchanged']} unchanged), "
+                   f"{stats['categories_created']} new categories, {len(importer.errors)} row(s) rejected, "
+                   f"in {elapsed:.1f}s.")
+        style = self.style.WARNING if importer.errors else self.style.SUCCESS
+        self.stdout.write(style(summary))
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from shop import checkout
+from shop.models import Cart, Category, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent checkouts against one scarce product and check that "
+        "stock is never oversold. Creates (and afterwards deletes) its own "
+        "product, users and orders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50, help="Users checking out at once.")
+        parser.add_argument('--stock', type=int, default=20, help="Units of the product in stock.")
+        parser.add_argument('--quantity', type=int, default=1, help="Units in each buyer's cart.")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent checkout threads.")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated data.")
+
+    def handle(self, *args, **options):
+        buyers, stock, quantity = options['buyers'], options['stock'], options['quantity']
+
+        category, _ = Category.objects.get_or_create(name='Benchmark')
+        product = Product.objects.create(
+            category=category,
+            name='Checkout benchmark SKU',
+            description='Generated by checkout_benchmark',
+            price=Decimal('100.00'),
+            image='products/benchmark.png',
+            stock=stock,
+        )
+        run_id = int(time.time() * 1000)
+        users = User.objects.bulk_create([
+            User(username=f'bench_checkout_{run_id}_{i}') for i in range(buyers)
+        ])
+        Cart.objects.bulk_create([Cart(user=u, product=product, quantity=quantity) for u in users])
+
+        results = {'placed': 0, 'out_of_stock': 0, 'errors': 0}
+        latencies = []
+        lock = threading.Lock()
+
+        def buy(user):
+            try:
+                began = time.perf_counter()
+                try:
+                    checkout.place_order(user, first_name='Bench', last_name='Buyer',
+                                         phone='0000000000', payment_method='Cash on Delivery')
+                    outcome = 'placed'
+                except checkout.OutOfStockError:
+                    outcome = 'out_of_stock'
+                except Exception as exc:
+                    self.stderr.write(f"{user.username}: {exc!r}")
+                    outcome = 'errors'
+                with lock:
+                    results[outcome] += 1
+                    latencies.append(time.perf_counter() - began)
+            finally:
+                connection.close()
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(buy, users))
+        elapsed = time.perf_counter() - began
+
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+        latencies.sort()
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        report = {
+            **results,
+            'initial_stock': stock,
+            'final_stock': product.stock,
+            'units_sold': sold,
+            'elapsed_s': round(elapsed, 3),
+            'checkouts_per_s': round(buyers / elapsed, 1) if elapsed else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+        if not options['keep']:
+            User.objects.filter(id__in=[u.id for u in users]).delete()
+            product.delete()
+
+        expected_sold = min(stock // quantity, buyers) * quantity
+        if sold > stock or sold + product.stock != stock:
+            raise CommandError("Stock was oversold or lost!")
+        if results['errors'] or sold != expected_sold:
+            raise CommandError(f"Expected {expected_sold} units sold, got {sold} "
+                               f"({results['errors']} errors).")
+        self.stdout.write(self.style.SUCCESS("No overselling."))
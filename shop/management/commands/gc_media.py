@@ -0,0 +1,158 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage, storages
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop import images, storage
+from shop.models import MediaBlob, Product, ProductImage, ProductThumbnail, ProductUserImage
+
+IMAGE_MODELS = (Product, ProductImage, ProductThumbnail, ProductUserImage)
+
+
+def _referenced(names):
+    """The subset of names some row still points at."""
+    found = set()
+    for model in IMAGE_MODELS:
+        found.update(model.objects.filter(image__in=names).values_list('image', flat=True))
+    return found
+
+
+def _derivative_names(name):
+    for width in images.WIDTHS:
+        for fmt in images.modern_formats() + [None]:
+            yield images.derivative_name(name, width, fmt)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete content-addressed media files no row refers to any more "
+        "(see shop/storage.py). --adopt-legacy first moves files uploaded "
+        "before content addressing into it, merging duplicates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help="Keep unreferenced files younger than this (uploads in flight).")
+        parser.add_argument('--scan', action='store_true',
+                            help="Also walk the storage for files with no MediaBlob row.")
+        parser.add_argument('--adopt-legacy', action='store_true',
+                            help="Re-store files with legacy names under their content hash.")
+        parser.add_argument('--dry-run', action='store_true', help="Report without changing anything.")
+
+    def handle(self, *args, **options):
+        if not isinstance(storages['default'], storage.ContentAddressedMixin):
+            raise CommandError("The default storage is not content-addressed.")
+
+        self.dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+
+        if options['adopt_legacy']:
+            self.adopt_legacy()
+
+        freed = deleted = 0
+        candidates = list(
+            MediaBlob.objects.filter(refcount__lte=0, updated_at__lt=cutoff).values_list('name', 'size')
+        )
+        still_used = _referenced([name for name, size in candidates])
+        for name, size in candidates:
+            if name in still_used:
+                # The count drifted (e.g. rows changed with queryset.update()); recount
+                self.fix_refcount(name)
+                continue
+            self.delete_blob(name)
+            deleted += 1
+            freed += size
+
+        if options['scan']:
+            deleted += self.sweep_untracked(cutoff)
+
+        verb = "Would delete" if self.dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} file(s), {freed / 1024:.1f} KiB."))
+
+    def fix_refcount(self, name):
+        count = sum(model.objects.filter(image=name).count() for model in IMAGE_MODELS)
+        self.stdout.write(f"{name}: refcount corrected to {count}")
+        if not self.dry_run:
+            MediaBlob.objects.filter(name=name).update(refcount=count)
+
+    def delete_blob(self, name):
+        self.stdout.write(f"delete {name}")
+        if self.dry_run:
+            return
+        for derivative in _derivative_names(name):
+            if default_storage.exists(derivative):
+                default_storage.delete(derivative)
+        default_storage.delete(name)
+        MediaBlob.objects.filter(name=name).delete()
+
+    def sweep_untracked(self, cutoff):
+        """Deletes old files under the content root that have no MediaBlob row."""
+        deleted = 0
+        pending = [storage.CAS_ROOT]
+        while pending:
+            directory = pending.pop()
+            try:
+                subdirs, files = default_storage.listdir(directory)
+            except FileNotFoundError:
+                continue
+            pending.extend(f'{directory}/{sub}' for sub in subdirs)
+            names = [f'{directory}/{filename}' for filename in files]
+            tracked = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            used = _referenced(names)
+            for name in names:
+                if name in tracked or default_storage.get_modified_time(name) >= cutoff:
+                    continue
+                if name in used:
+                    # Referenced but never registered; track it instead of deleting
+                    if not self.dry_run:
+                        digest, size = storage.hash_file(default_storage.open(name))
+                        storage.register_blob(name, digest, size)
+                        self.fix_refcount(name)
+                    continue
+                self.delete_blob(name)
+                deleted += 1
+        return deleted
+
+    def adopt_legacy(self):
+        """Moves rows' legacy files to content-addressed names."""
+        legacy = set()
+        adopted = {}
+        for model in IMAGE_MODELS:
+            rows = (model.objects.exclude(image='').exclude(image__startswith=storage.CAS_ROOT + '/')
+                    .values_list('pk', 'image'))
+            for pk, name in rows.iterator(chunk_size=500):
+                if name not in adopted:
+                    if not default_storage.exists(name):
+                        self.stderr.write(f"{model.__name__} {pk}: {name} is missing, skipped")
+                        continue
+                    if self.dry_run:
+                        with default_storage.open(name) as f:
+                            digest, size = storage.hash_file(f)
+                        adopted[name] = storage.content_name(digest, name[name.rfind('.'):])
+                    else:
+                        with default_storage.open(name) as f:
+                            adopted[name] = default_storage.save(name, f)
+                    self.stdout.write(f"{name} -> {adopted[name]}")
+                legacy.add(name)
+                if not self.dry_run:
+                    model.objects.filter(pk=pk).update(image=adopted[name])
+                    storage.add_ref(adopted[name])
+
+        merged = len(legacy) - len(set(adopted.values()))
+        self.stdout.write(f"Adopted {len(legacy)} legacy file(s) as {len(set(adopted.values()))} "
+                          f"content-addressed file(s) ({merged} duplicate(s) merged).")
+        if self.dry_run:
+            return
+
+        for name in legacy:
+            for derivative in _derivative_names(name):
+                if default_storage.exists(derivative):
+                    default_storage.delete(derivative)
+            default_storage.delete(name)
+        for name in set(adopted.values()):
+            images.generate(name)
+        # Cached pages still point at the legacy URLs; this reaches the web
+        # workers when FRAGMENT_CACHE is shared ('file' or 'redis')
+        refreshed = images.refresh_pages(set(adopted.values()))
+        self.stdout.write(f"Refreshed the cached pages of {refreshed} product(s).")
@@ -0,0 +1,68 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop import images
+from shop.models import Product, ProductImage, ProductThumbnail, ProductUserImage
+
+IMAGE_MODELS = (Product, ProductImage, ProductThumbnail, ProductUserImage)
+
+
+def _generate(name, force):
+    try:
+        return name, images.generate(name, force=force), None
+    except Exception as exc:
+        return name, [], repr(exc)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate responsive image derivatives for existing uploads (see shop/images.py). "
+        "The pages showing them are refreshed through their fragment versions, which "
+        "reaches the web workers when FRAGMENT_CACHE is shared ('file' or 'redis')."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help="Worker processes.")
+        parser.add_argument('--force', action='store_true', help="Regenerate existing derivatives.")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in IMAGE_MODELS:
+            names.update(model.objects.exclude(image='').values_list('image', flat=True).distinct())
+        names = sorted(names)
+        generated = []
+        self.stdout.write(f"{len(names)} image(s), {options['workers']} worker(s).")
+
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=images._init_worker,
+        ) as pool:
+            futures = [pool.submit(_generate, name, options['force']) for name in names]
+            for future in as_completed(futures):
+                name, widths, error = future.result()
+                done += 1
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                else:
+                    generated.append(name)
+                    # Other processes' caches (with a local CACHES backend)
+                    # notice within images.MISSING_TIMEOUT
+                    cache.delete(images._cache_key(name))
+                    self.stdout.write(f"[{done}/{len(names)}] {name}: {', '.join(map(str, widths)) or 'small, skipped'}")
+
+        # Cached product HTML may still reference the originals
+        refreshed = images.refresh_pages(generated)
+        self.stdout.write(f"Refreshed the cached pages of {refreshed} product(s).")
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Done with {failed} failure(s)."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from the Product table."
+
+    def handle(self, *args, **options):
+        index = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Search index rebuilt ({type(index).__name__})."
+        ))
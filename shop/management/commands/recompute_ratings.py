@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from shop import ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every product's rating aggregates (sum, count, average, star "
+        "histogram) from its reviews in one grouped query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='product_ids',
+                            help="Only this product id (repeatable).")
+        parser.add_argument('--batch-size', type=int, default=500, help="Products per bulk update.")
+
+    def handle(self, *args, **options):
+        updated = ratings.recompute(
+            product_ids=options['product_ids'],
+            batch_size=options['batch_size'],
+            progress=lambda seen: self.stdout.write(f"  {seen} products checked"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} product(s)."))
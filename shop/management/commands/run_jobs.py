@@ -0,0 +1,61 @@
+import multiprocessing
+import signal
+import threading
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop import jobs
+
+
+def _worker(batch_size, poll_interval, once):
+    django.setup()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    return jobs.work(batch_size=batch_size, poll_interval=poll_interval, once=once, stop_event=stop)
+
+
+class Command(BaseCommand):
+    help = "Process queued background jobs (see shop/jobs.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to start.")
+        parser.add_argument('--batch-size', type=int, default=10, help="Jobs claimed per poll.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between polls when idle.")
+        parser.add_argument('--once', action='store_true', help="Exit when no jobs are due.")
+
+    def handle(self, *args, **options):
+        worker_args = (options['batch_size'], options['interval'], options['once'])
+
+        if options['processes'] <= 1:
+            processed = _worker(*worker_args)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
+            return
+
+        # Children must not share the parent's database connection
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=_worker, args=worker_args, name=f'run_jobs-{i}')
+            for i in range(options['processes'])
+        ]
+        for process in workers:
+            process.start()
+        self.stdout.write(f"Started {len(workers)} job workers.")
+
+        def stop_workers(*args):
+            # Workers finish their current job, then exit
+            for process in workers:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stop_workers)
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            stop_workers()
+            for process in workers:
+                process.join()
+        self.stdout.write(self.style.SUCCESS("Job workers stopped."))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary into the SQLite replica files (DATABASE_REPLICA_URLS), "
+        "simulating replication for local testing. With --interval it keeps copying, "
+        "so the replicas lag by up to that many seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Seconds between copies; 0 copies once and exits.")
+
+    def handle(self, *args, **options):
+        aliases = replicas.replica_aliases()
+        if not aliases:
+            raise CommandError("No replicas configured; set DATABASE_REPLICA_URLS.")
+        interval = options['interval']
+        while True:
+            for alias in aliases:
+                try:
+                    elapsed = replicas.sync_sqlite_replica(alias)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(f"{alias}: synced in {elapsed * 1000:.0f}ms")
+            if not interval:
+                break
+            time.sleep(interval)
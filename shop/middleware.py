@@ -0,0 +1,344 @@
+import cProfile
+import logging
+import mimetypes
+import os
+import random
+import re
+import stat
+import time
+from pathlib import Path
+from urllib.parse import unquote
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import profiling, replicas, storage
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Media files
+# -------------------------
+# Serves MEDIA_URL straight from MEDIA_ROOT before the request reaches the
+# URL resolver (static() only works with DEBUG=True). Sits next to
+# WhiteNoiseMiddleware, which does the same for static files.
+#   - Files go out as FileResponse, so WSGI servers with wsgi.file_wrapper
+#     (gunicorn, uWSGI) send them with sendfile().
+#   - ETag / Last-Modified with 304s, single byte ranges.
+#   - name.br / name.gz next to a file are sent to clients that accept them
+#     (create them with e.g. `python -m whitenoise.compress media/`).
+#   - With settings.MEDIA_ACCEL_REDIRECT (e.g. '/protected-media/') the
+#     bytes are left to nginx via X-Accel-Redirect.
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class MediaFilesMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        self.prefix = settings.MEDIA_URL
+        # Media on a CDN / other host (e.g. Cloudinary) isn't ours to serve
+        if not self.prefix or not self.prefix.startswith('/') or not settings.MEDIA_ROOT:
+            raise MiddlewareNotUsed
+        self.root = Path(settings.MEDIA_ROOT).resolve()
+        self.max_age = getattr(settings, 'MEDIA_MAX_AGE', 60 * 60)
+        self.accel_redirect = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.serve(request)
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        response = None
+        if request.path_info.startswith(self.prefix):
+            # stat()/open() off the event loop
+            response = await sync_to_async(self.serve, thread_sensitive=False)(request)
+        return response if response is not None else await self.get_response(request)
+
+    # -------------------------
+    # Serving
+    # -------------------------
+    def serve(self, request):
+        """Returns a response for media URLs, None for everything else."""
+        if not request.path_info.startswith(self.prefix):
+            return None
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+
+        name = unquote(request.path_info[len(self.prefix):])
+        path = self.resolve(name)
+        if path is None:
+            return HttpResponseNotFound()
+
+        encoding, served_path, st = self.choose_variant(request, path)
+        if st is None:
+            return HttpResponseNotFound()
+
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}{"-" + encoding if encoding else ""}"'
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(st.st_mtime),
+            'Cache-Control': self.cache_control(name),
+        }
+        if any(os.path.exists(f'{path}{suffix}') for _, suffix in ENCODINGS):
+            headers['Vary'] = 'Accept-Encoding'
+
+        if not_modified(request, etag, st.st_mtime):
+            return HttpResponse(status=304, headers=headers)
+
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        else:
+            headers['Accept-Ranges'] = 'bytes'
+
+        if self.accel_redirect:
+            response = HttpResponse(content_type=content_type, headers=headers)
+            response['X-Accel-Redirect'] = self.accel_redirect + os.path.relpath(served_path, self.root)
+            return response
+
+        byte_range = None if encoding else requested_range(request, etag, st)
+        if byte_range == 'unsatisfiable':
+            headers['Content-Range'] = f'bytes */{st.st_size}'
+            return HttpResponse(status=416, headers=headers)
+        if request.method == 'HEAD':
+            headers['Content-Length'] = str(st.st_size)
+            return HttpResponse(content_type=content_type, headers=headers)
+        if byte_range:
+            return partial_response(served_path, byte_range, st.st_size, content_type, headers)
+
+        response = FileResponse(open(served_path, 'rb'), content_type=content_type)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def resolve(self, name):
+        """Absolute path for a media name, or None if it escapes MEDIA_ROOT."""
+        if not name or '\x00' in name:
+            return None
+        path = (self.root / name).resolve()
+        if not path.is_relative_to(self.root):
+            return None
+        return path
+
+    def choose_variant(self, request, path):
+        """Returns (encoding, path, stat) for the best file to send."""
+        accepted = {
+            token.split(';')[0].strip()
+            for token in request.headers.get('Accept-Encoding', '').split(',')
+            if not re.search(r';\s*q=0(\.0*)?\s*$', token)
+        }
+        # Ranges refer to the identity bytes, so never answer them compressed
+        if 'Range' not in request.headers:
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted:
+                    st = stat_file(f'{path}{suffix}')
+                    if st is not None:
+                        return encoding, Path(f'{path}{suffix}'), st
+        return None, path, stat_file(path)
+
+    def cache_control(self, name):
+        if storage.is_immutable(name):
+            return storage.IMMUTABLE_CACHE_CONTROL
+        return f'public, max-age={self.max_age}'
+
+
+def stat_file(path):
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or etag in tags
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+def requested_range(request, etag, st):
+    """(start, end) inclusive, 'unsatisfiable', or None for the whole file."""
+    header = request.headers.get('Range')
+    if not header:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(st.st_mtime):
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges and other units: send the whole file
+        return None
+    first, last = match.groups()
+    size = st.st_size
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, end
+
+
+def partial_response(path, byte_range, size, content_type, headers):
+    start, end = byte_range
+    length = end - start + 1
+
+    def chunks():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    response = StreamingHttpResponse(chunks(), status=206, content_type=content_type, headers=headers)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return response
+
+
+# -------------------------
+# Request profiling
+# -------------------------
+# Times each request and its SQL, templates and outbound HTTP calls, see
+# shop/profiling.py. Placed after the static/media middleware so files
+# aren't counted as views.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not profiling.setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        profiling.install()
+
+        self.sample_rate = profiling.setting('SAMPLE_RATE')
+        self.slow = profiling.setting('SLOW_REQUEST_SECONDS')
+        self.duplicate_threshold = profiling.setting('DUPLICATE_QUERIES')
+        self.profile_dir = Path(settings.BASE_DIR, profiling.setting('PROFILE_DIR'))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile, token = profiling.start()
+        profiler = cProfile.Profile() if self.sample_rate and random.random() < self.sample_rate else None
+        start = time.perf_counter()
+        try:
+            if profiler is None:
+                response = self.get_response(request)
+            else:
+                response = profiler.runcall(self.get_response, request)
+        finally:
+            profiling.stop(token)
+        self.finish(request, response, profile, time.perf_counter() - start, profiler)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only sees the event loop thread, so async requests aren't sampled
+        profile, token = profiling.start()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.stop(token)
+        self.finish(request, response, profile, time.perf_counter() - start)
+        return response
+
+    def finish(self, request, response, profile, elapsed, profiler=None):
+        view = profiling.view_name(request)
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        profiling.metrics.record(view, request.method, response.status_code, elapsed, profile, bool(duplicates))
+        if duplicates:
+            sql, count = duplicates[0]
+            logger.warning("%s ran the same query %d times (N+1?): %.200s", view, count, sql)
+        if elapsed >= self.slow:
+            logger.warning(
+                "Slow request %s %s (%s): %.0fms, %d queries in %.0fms, templates %.0fms, http %.0fms",
+                request.method, request.path, view, elapsed * 1000, profile.sql_count,
+                profile.sql_time * 1000, profile.template_time * 1000, profile.http_time * 1000,
+            )
+            if profiler is not None:
+                self.dump(profiler, view, elapsed)
+
+    def dump(self, profiler, view, elapsed):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        path = self.profile_dir / f'{stamp}-{view.replace("<", "").replace(">", "")}-{elapsed * 1000:.0f}ms.prof'
+        profiler.dump_stats(path)
+        logger.info("Wrote profile %s", path)
+
+
+# -------------------------
+# Read replicas
+# -------------------------
+# Lets catalog reads go to replicas during the request, see
+# shop/replicas.py. Unsafe methods, and clients that wrote in the last
+# STICKY_SECONDS (a short-lived cookie, so the signed-cookie session isn't
+# rewritten), read from the primary throughout.
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas.replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.cookie = replicas.setting('COOKIE_NAME')
+        self.sticky = replicas.setting('STICKY_SECONDS')
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state, token = replicas.begin_request(pinned=self.pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.end_request(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = replicas.begin_request(pinned=self.pinned(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replicas.end_request(token)
+        return self.finish(state, response)
+
+    def pinned(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or self.cookie in request.COOKIES
+
+    def finish(self, state, response):
+        if state.wrote:
+            response.set_cookie(self.cookie, '1', max_age=self.sticky, httponly=True, samesite='Lax')
+        return response
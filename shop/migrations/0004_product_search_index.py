@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    # FTS5 only exists on SQLite; other databases use the in-process index
+    # in shop/search.py and need nothing here.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # Some SQLite builds leave FTS5 out; search falls back to the
+        # in-process index when the table is missing.
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+            "name, short_description, description, key_benefits, category, "
+            "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts_vocab "
+            "USING fts5vocab(shop_product_fts, 'row')"
+        )
+        cursor.execute(
+            "INSERT INTO shop_product_fts "
+            "(rowid, name, short_description, description, key_benefits, category) "
+            "SELECT p.id, p.name, COALESCE(p.short_description, ''), p.description, "
+            "COALESCE(p.key_benefits, ''), c.name "
+            "FROM shop_product p JOIN shop_category c ON c.id = p.category_id"
+        )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS shop_product_fts_vocab")
+        cursor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Lower
+
+
+def backfill_tracking(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    OrderStatusEvent = apps.get_model('shop', 'OrderStatusEvent')
+
+    # Lookups match on the lower-cased email
+    Order.objects.update(email=Lower('email'))
+
+    # Seed each existing order's timeline with its current status
+    OrderStatusEvent.objects.bulk_create(
+        [OrderStatusEvent(order_id=order_id, status=status)
+         for order_id, status in Order.objects.values_list('id', 'status').iterator()],
+        batch_size=500,
+    )
+    OrderStatusEvent.objects.update(created_at=Subquery(
+        Order.objects.filter(id=OuterRef('order_id')).values('created_at')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_job_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('placed', 'Placed'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['email', 'created_at'], name='order_email_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderstatusevent',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='shop.order'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstatusevent',
+            index=models.Index(fields=['order', 'created_at'], name='order_event_order_created_idx'),
+        ),
+        migrations.RunPython(backfill_tracking, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:55
+
+import django.core.validators
+from django.conf import settings
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+BATCH_SIZE = 1000
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Review = apps.get_model('shop', 'Review')
+    stars = (1, 2, 3, 4, 5)
+
+    rows = (
+        Review.objects.filter(rating__in=stars).values('product_id')
+        .annotate(total=Sum('rating'), count=Count('id'),
+                  **{f'stars_{n}': Count('id', filter=Q(rating=n)) for n in stars})
+        .order_by()
+    )
+    aggregates = {row['product_id']: row for row in rows}
+
+    fields = ['rating', 'rating_avg', 'rating_sum', 'rating_count'] + [f'stars_{n}' for n in stars]
+    pending = []
+    for product in Product.objects.only('id').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        row = aggregates.get(product.id)
+        # The aggregates only count reviews, as ratings.recompute() does: a
+        # rating entered by hand on a product without reviews is dropped
+        row = row or {'total': 0, 'count': 0, **{f'stars_{n}': 0 for n in stars}}
+        product.rating_sum, product.rating_count = row['total'], row['count']
+        for n in stars:
+            setattr(product, f'stars_{n}', row[f'stars_{n}'])
+        product.rating_avg = Decimal('0.00')
+        if product.rating_count:
+            product.rating_avg = (Decimal(product.rating_sum) / product.rating_count).quantize(
+                Decimal('0.01'), ROUND_HALF_UP)
+        product.rating = int(product.rating_avg.to_integral_value(ROUND_HALF_UP))
+        pending.append(product)
+        if len(pending) >= BATCH_SIZE:
+            Product.objects.bulk_update(pending, fields, batch_size=BATCH_SIZE)
+            pending = []
+    Product.objects.bulk_update(pending, fields, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_media_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_category_rating_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_rating_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'rating_avg'], name='product_category_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating_avg'], name='product_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_at'], name='review_product_created_idx'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
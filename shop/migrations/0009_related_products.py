@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bought_together', 'Frequently bought together'), ('similar', 'Similar product')], max_length=20)),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_links', to='shop.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'rank'], name='related_product_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='related_product_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Stock keeping unit; catalog imports match products on it', max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:13
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def benefits_to_rows(apps, schema_editor):
+    """One ProductBenefit per line of key_benefits, in line order."""
+    Product = apps.get_model('shop', 'Product')
+    ProductBenefit = apps.get_model('shop', 'ProductBenefit')
+    # Products that already have rows (e.g. from catalog_import) keep them,
+    # numbered in the order they were added
+    has_rows = set()
+    renumbered = []
+    rows = ProductBenefit.objects.order_by('product_id', 'id').values_list('id', 'product_id')
+    for product_id, group in groupby(rows.iterator(chunk_size=BATCH_SIZE), key=lambda row: row[1]):
+        has_rows.add(product_id)
+        renumbered.extend(ProductBenefit(id=pk, position=position) for position, (pk, _) in enumerate(group))
+    ProductBenefit.objects.bulk_update(renumbered, ['position'], batch_size=BATCH_SIZE)
+
+    pending = []
+    texts = (Product.objects.exclude(key_benefits__isnull=True).exclude(key_benefits='')
+             .values_list('id', 'key_benefits'))
+    for product_id, text in texts.iterator(chunk_size=BATCH_SIZE):
+        if product_id in has_rows:
+            continue
+        titles = [line.strip()[:255] for line in text.splitlines() if line.strip()]
+        pending.extend(
+            ProductBenefit(product_id=product_id, title=title, position=position)
+            for position, title in enumerate(titles)
+        )
+        if len(pending) >= BATCH_SIZE:
+            ProductBenefit.objects.bulk_create(pending)
+            pending = []
+    ProductBenefit.objects.bulk_create(pending)
+
+
+def rows_to_benefits(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductBenefit = apps.get_model('shop', 'ProductBenefit')
+    rows = ProductBenefit.objects.order_by('product_id', 'position', 'id').values_list('product_id', 'title')
+    products = [
+        Product(id=product_id, key_benefits='\n'.join(title for _, title in group))
+        for product_id, group in groupby(rows.iterator(chunk_size=BATCH_SIZE), key=lambda row: row[0])
+    ]
+    Product.objects.bulk_update(products, ['key_benefits'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productbenefit',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterModelOptions(
+            name='productbenefit',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='productbenefit',
+            index=models.Index(fields=['product', 'position'], name='benefit_product_position_idx'),
+        ),
+        migrations.RunPython(benefits_to_rows, rows_to_benefits),
+        migrations.RemoveField(
+            model_name='product',
+            name='key_benefits',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Folds repeated (user, product) lines into the oldest one, adding quantities."""
+    Cart = apps.get_model('shop', 'Cart')
+    duplicates = (Cart.objects.values('user_id', 'product_id')
+                  .annotate(lines=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+                  .filter(lines__gt=1).order_by())
+    for row in duplicates:
+        lines = Cart.objects.filter(user_id=row['user_id'], product_id=row['product_id'])
+        lines.filter(id=row['keep']).update(quantity=row['quantity'])
+        lines.exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_order_status_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cart_user_product_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def separate_duplicate_payments(apps, schema_editor):
+    """Blank ids become NULL; replayed payments keep their id with a suffix so the oldest order owns it."""
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.filter(razorpay_order_id='').update(razorpay_order_id=None)
+    duplicates = (Order.objects.exclude(razorpay_order_id=None).values('razorpay_order_id')
+                  .annotate(orders=Count('id')).filter(orders__gt=1).order_by())
+    for row in duplicates:
+        payment_id = row['razorpay_order_id']
+        for order in Order.objects.filter(razorpay_order_id=payment_id).order_by('id')[1:]:
+            order.razorpay_order_id = f'{payment_id}#replay-{order.id}'[:255]
+            order.save(update_fields=['razorpay_order_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_cart_user_product_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(separate_duplicate_payments, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 from decimal import Decimal
 
@@ -15,6 +16,8 @@ class Category(models.Model):
 # ----------------- Product -----------------
 class Product(models.Model):
     category = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='products')
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True,
+                           help_text="Stock keeping unit; catalog imports match products on it")
     name = models.CharField(max_length=200)
     short_description = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField()
@@ -25,14 +28,30 @@ class Product(models.Model):
 
     stock = models.PositiveIntegerField(default=0)
 
-    # Ratings
-    rating = models.PositiveIntegerField(default=0)
+    # Ratings, maintained from Review by shop/ratings.py
+    rating = models.PositiveIntegerField(default=0)  # average rounded to whole stars
     rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=Decimal('0.00'))
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
 
     # Extra features
     is_featured = models.BooleanField(default=False)
     badge = models.CharField(max_length=50, blank=True, null=True)
-    key_benefits = models.TextField(blank=True, null=True, help_text="Enter one benefit per line")
+
+    class Meta:
+        indexes = [
+            # Catalog listing filters/sorts (see shop/catalog.py)
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'rating_avg'], name='product_category_rating_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['rating_avg'], name='product_rating_idx'),
+            models.Index(fields=['is_featured'], name='product_featured_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -55,6 +74,16 @@ class Product(models.Model):
         """Returns the price that should be displayed (discounted if available)."""
         return self.discount_price if self.discount_price else self.price
 
+    @property
+    def rating_histogram(self):
+        """[(stars, count, percent), ...] from 5 stars down to 1."""
+        total = self.rating_count
+        histogram = []
+        for stars in (5, 4, 3, 2, 1):
+            count = getattr(self, f'stars_{stars}')
+            histogram.append((stars, count, round(count * 100 / total) if total else 0))
+        return histogram
+
 
 # ----------------- Product Images -----------------
 class ProductImage(models.Model):
@@ -80,6 +109,13 @@ class ProductUserImage(models.Model):
 class ProductBenefit(models.Model):
     product = models.ForeignKey(Product, related_name='benefits', on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['product', 'position'], name='benefit_product_position_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.title}"
@@ -89,14 +125,48 @@ class ProductBenefit(models.Model):
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    rating = models.PositiveIntegerField(default=1)
+    rating = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Paginated review lists per product
+            models.Index(fields=['product', 'created_at'], name='review_product_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.rating})"
 
 
+# ----------------- Related Products -----------------
+RELATED_KIND = [
+    ('bought_together', 'Frequently bought together'),
+    ('similar', 'Similar product'),
+]
+
+class RelatedProduct(models.Model):
+    """A precomputed recommendation (see shop/recommendations.py)."""
+    product = models.ForeignKey(Product, related_name='related_links', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='recommended_for', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=RELATED_KIND)
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='related_product_unique'),
+        ]
+        indexes = [
+            # The product page reads a product's top N in rank order
+            models.Index(fields=['product', 'rank'], name='related_product_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.kind}, #{self.rank})"
+
+
 # ----------------- Cart -----------------
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart_items")
@@ -104,6 +174,12 @@ class Cart(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One line per product; guest carts are merged in with an upsert on it
+            models.UniqueConstraint(fields=['user', 'product'], name='cart_user_product_unique'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} x {self.product.name} ({self.user.username})"
 
@@ -149,17 +225,50 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=50, default="COD")
     payment_status = models.CharField(max_length=20, default="Pending")
 
-    # Razorpay
-    razorpay_order_id = models.CharField(max_length=255, blank=True, null=True)
+    # Razorpay; one order per payment (NULL for Cash on Delivery)
+    razorpay_order_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
     razorpay_payment_id = models.CharField(max_length=255, blank=True, null=True)
     razorpay_signature = models.CharField(max_length=255, blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Guest tracking (order id + email) and order history pages
+            models.Index(fields=['email', 'created_at'], name='order_email_created_idx'),
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # Admin status filter and bulk status transitions
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a status change can be added to the timeline on save
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     def __str__(self):
         return f"Order #{self.id} - {self.email} ({self.payment_status})"
 
 
+# ----------------- Order Status Timeline -----------------
+class OrderStatusEvent(models.Model):
+    order = models.ForeignKey(Order, related_name='status_events', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=ORDER_STATUS)
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='order_event_order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.order_id} {self.status}"
+
+
 # ----------------- Order Item -----------------
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name="items", on_delete=models.CASCADE)
@@ -179,3 +288,48 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f"{self.product.name} in cart"
+
+
+# ----------------- Background Job -----------------
+JOB_STATUS = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+class Job(models.Model):
+    """A queued call to a task registered in shop/jobs.py."""
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JOB_STATUS, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for due jobs with this
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+# ----------------- Media Blob -----------------
+class MediaBlob(models.Model):
+    """A content-addressed media file (see shop/storage.py) and how many rows use it."""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
@@ -0,0 +1,255 @@
+import asyncio
+import functools
+import hashlib
+import time
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, QueryDict
+from django.template.loaders.app_directories import get_app_template_dirs
+from django.utils.cache import patch_cache_control
+
+from . import profiling, replicas
+from .fragment_cache import get_fragment_cache
+
+# -------------------------
+# Full-page cache
+# -------------------------
+# Anonymous GETs of the catalog pages are the same for every visitor once
+# the cart badge is left out (it is filled in by an ESI include or the
+# page's script from views.cart_badge), so @cached_page serves them whole:
+#   - the ETag hashes the fragment versions the page is built from, plus
+#     the release and the query parameters the view declares, so it is
+#     known before rendering: a matching If-None-Match gets a 304 and the
+#     view doesn't run
+#   - pages are kept in the fragment cache under their ETag; a version bump
+#     changes it, so stale pages are never served and just age out
+#   - only one request renders a missing page (a lock in the default
+#     cache); the others wait up to WAIT seconds for it instead of all
+#     rendering it at once
+#   - the page is rendered from the primary: a lagging replica's data would
+#     otherwise be stored under the new versions (see shop/replicas.py)
+#   - other query parameters (utm_* tags...) are hidden from the view so
+#     they don't split the cache, and the responses don't vary on Cookie
+# Logged-in users get the page rendered for them, marked private.
+#
+# The release part of the ETag is settings.PAGE_CACHE['RELEASE'], or a
+# hash of the templates: set RELEASE on deploys that change view code.
+
+DEFAULTS = {
+    'ENABLED': True,
+    'TIMEOUT': 600,
+    'MAX_AGE': 0,
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 2.0,
+    'POLL_INTERVAL': 0.025,
+    'ESI': False,
+    'RELEASE': None,
+}
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def setting(name):
+    return getattr(settings, 'PAGE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+@functools.cache
+def release():
+    configured = setting('RELEASE')
+    if configured:
+        return str(configured)
+    digest = hashlib.sha1()
+    directories = [directory for engine in settings.TEMPLATES for directory in engine.get('DIRS', [])]
+    for directory in [*directories, *get_app_template_dirs('templates')]:
+        for path in sorted(Path(directory).rglob('*')):
+            if path.is_file():
+                digest.update(path.read_bytes())
+    # Hashed static file names end up in the HTML too
+    manifest = Path(settings.STATIC_ROOT or '', 'staticfiles.json')
+    if settings.STATIC_ROOT and manifest.is_file():
+        digest.update(manifest.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def is_anonymous(request):
+    """Whether the session has no logged-in user, without making the response vary on it."""
+    session = request.session
+    accessed = session.accessed
+    anonymous = SESSION_KEY not in session
+    session.accessed = accessed
+    return anonymous
+
+
+def not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags
+
+
+class CachedPage:
+    """One anonymous request for a cacheable page."""
+
+    def __init__(self, request, view_name, params, versions):
+        self.request = request
+        self.view_name = view_name
+        self.query = QueryDict(mutable=True)
+        for name in params:
+            if name in request.GET:
+                self.query.setlist(name, request.GET.getlist(name))
+        parts = [release(), view_name, request.path, self.query.urlencode(), *map(str, versions)]
+        digest = hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+        self.etag = f'"p-{digest[:32]}"'
+        self.key = f'page:{digest}'
+        self.lock_key = f'page-lock:{digest}'
+        self.fragments = get_fragment_cache()
+        self.session_accessed = request.session.accessed
+
+    def count(self, result):
+        profiling.metrics.inc('shop_page_cache_requests_total', (('view', self.view_name), ('result', result)))
+
+    def headers(self):
+        headers = {'ETag': self.etag, 'Cache-Control': f'public, max-age={setting("MAX_AGE")}, must-revalidate'}
+        if setting('ESI'):
+            headers['Surrogate-Control'] = 'content="ESI/1.0"'
+        return headers
+
+    def lookup(self):
+        """A 304 or the cached page, or None if it has to be rendered."""
+        if not_modified(self.request, self.etag):
+            self.count('not_modified')
+            headers = self.headers()
+            return HttpResponseNotModified(headers={'ETag': self.etag, 'Cache-Control': headers['Cache-Control']})
+        page = self.fragments.get(self.key)
+        if page is None:
+            return None
+        self.count('hit')
+        return self.respond(page)
+
+    def respond(self, page):
+        return HttpResponse(page['content'], content_type=page['content_type'], headers=self.headers())
+
+    def lead(self):
+        """Claims the render; False if another request is already on it."""
+        return cache.add(self.lock_key, 1, setting('LOCK_TIMEOUT'))
+
+    def release_lock(self):
+        cache.delete(self.lock_key)
+
+    def poll(self):
+        """(response, done): the page once the leader stored it; done when there's no point waiting."""
+        page = self.fragments.get(self.key)
+        if page is not None:
+            self.count('hit')
+            return self.respond(page), True
+        # The leader gave up (error, uncacheable response) without storing it
+        return None, cache.get(self.lock_key) is None
+
+    def before_render(self):
+        # The view only sees the parameters that are part of the key
+        self.request.GET = self.query
+        # Tells the cart_count context processor to leave the badge out
+        self.request.cacheable_page = True
+
+    def store(self, response):
+        """Caches a rendered response; returns it with the page headers."""
+        session = self.request.session
+        cacheable = (
+            response.status_code == 200 and not response.streaming and not response.cookies
+            and not session.modified
+        )
+        if not cacheable:
+            self.count('uncacheable')
+            return response
+        self.count('miss')
+        self.fragments.set(
+            self.key, {'content': response.content, 'content_type': response['Content-Type']}, setting('TIMEOUT'),
+        )
+        session.accessed = self.session_accessed
+        for header, value in self.headers().items():
+            response[header] = value
+        return response
+
+
+def cached_page(versions=None, params=()):
+    """Full-page cache for a catalog view, see above.
+
+    versions(request, *args, **kwargs) returns the fragment versions the
+    page is built from, or None when it can't tell (the page is then just
+    rendered); params are the query parameters the page depends on.
+    """
+    def decorator(view):
+        view_name = f'{view.__module__}.{view.__qualname__}'
+
+        def start(request, args, kwargs):
+            if not setting('ENABLED') or request.method not in SAFE_METHODS or not is_anonymous(request):
+                return None
+            page_versions = versions(request, *args, **kwargs) if versions else ()
+            if page_versions is None:
+                return None
+            return CachedPage(request, view_name, params, page_versions)
+
+        def private(response):
+            patch_cache_control(response, private=True)
+            return response
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                page = await sync_to_async(start, thread_sensitive=False)(request, args, kwargs)
+                if page is None:
+                    return private(await view(request, *args, **kwargs))
+                in_thread = functools.partial(sync_to_async, thread_sensitive=False)
+                response = await in_thread(page.lookup)()
+                if response is not None:
+                    return response
+                leader = await in_thread(page.lead)()
+                deadline = time.monotonic() + setting('WAIT')
+                while not leader and time.monotonic() < deadline:
+                    await asyncio.sleep(setting('POLL_INTERVAL'))
+                    response, done = await in_thread(page.poll)()
+                    if response is not None:
+                        return response
+                    if done:
+                        break
+                page.before_render()
+                try:
+                    with replicas.primary():
+                        response = await view(request, *args, **kwargs)
+                    return await in_thread(page.store)(response)
+                finally:
+                    if leader:
+                        await in_thread(page.release_lock)()
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                page = start(request, args, kwargs)
+                if page is None:
+                    return private(view(request, *args, **kwargs))
+                response = page.lookup()
+                if response is not None:
+                    return response
+                leader = page.lead()
+                deadline = time.monotonic() + setting('WAIT')
+                while not leader and time.monotonic() < deadline:
+                    time.sleep(setting('POLL_INTERVAL'))
+                    response, done = page.poll()
+                    if response is not None:
+                        return response
+                    if done:
+                        break
+                # The leader, or a waiter that gave up on it
+                page.before_render()
+                try:
+                    with replicas.primary():
+                        response = view(request, *args, **kwargs)
+                    return page.store(response)
+                finally:
+                    if leader:
+                        page.release_lock()
+        return wrapper
+    return decorator
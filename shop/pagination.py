@@ -0,0 +1,138 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+# -------------------------
+# Keyset (cursor) pagination
+# -------------------------
+# Pages are requested "after (value, id)" of the last row shown instead of by
+# offset, so every page is an index range scan no matter how deep it is.
+# Cursors are opaque URL-safe strings.
+
+
+def encode_cursor(value, pk):
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = json.dumps([str(value), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, parse=str):
+    """Returns (value, pk) or None if the cursor is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = parse(value)
+        if value is None:
+            return None
+        return value, parse_int(pk)
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+
+
+# Parsers for decode_cursor; they raise ValueError for values the database
+# can't compare against (NaN, integers wider than a BIGINT...)
+BIGINT_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def parse_decimal(value):
+    value = Decimal(value)
+    if not value.is_finite():
+        raise ValueError(f"{value} is not a finite number")
+    return value
+
+
+def parse_int(value):
+    value = int(value)
+    if value not in BIGINT_RANGE:
+        raise ValueError(f"{value} is out of range")
+    return value
+
+
+parse_timestamp = parse_datetime
+
+
+def paginate(qs, field, cursor=None, descending=False, page_size=20, parse=str):
+    """Returns (rows, next_cursor) ordered by (field, id)."""
+    after = decode_cursor(cursor, parse)
+    if after is not None:
+        value, pk = after
+        op = 'lt' if descending else 'gt'
+        qs = qs.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}))
+
+    prefix = '-' if descending else ''
+    qs = qs.order_by(f'{prefix}{field}', f'{prefix}id')
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return rows, next_cursor
+
+
+# -------------------------
+# Estimated counts
+# -------------------------
+# Offset pagination needs a total, and COUNT(*) scans the whole table on
+# most databases. EstimatedCountPaginator (used by the admin change lists)
+# takes an unfiltered table's size from the database's own statistics once
+# it is large, and stops counting filtered results at COUNT_LIMIT rows.
+
+ESTIMATE_THRESHOLD = 10_000
+COUNT_LIMIT = 10_000
+
+
+def estimated_count(model, using='default'):
+    """Approximate row count of model's table, or None if unavailable."""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == 'mysql':
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+    elif connection.vendor == 'sqlite':
+        # Row counts recorded by ANALYZE (or PRAGMA optimize); the first
+        # number of each stat is the table's row count
+        sql = "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # No statistics yet (sqlite_stat1 only exists after ANALYZE)
+        return None
+    if not row or row[0] is None:
+        return None
+    value = int(str(row[0]).split()[0])
+    # PostgreSQL reports -1 for tables that were never analyzed
+    return value if value >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if not isinstance(qs, QuerySet):
+            return super().count
+        if not qs.query.where:
+            estimate = estimated_count(qs.model, qs.db)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+            return super().count
+        # COUNT(*) over a LIMITed subquery: later pages aren't reachable
+        # past COUNT_LIMIT rows, but searching and filtering narrow it down
+        return qs.order_by()[:COUNT_LIMIT].count()
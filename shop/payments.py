@@ -0,0 +1,187 @@
+import hashlib
+import hmac
+import itertools
+import secrets
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import profiling
+
+# -------------------------
+# Payment gateway
+# -------------------------
+# Remote payment orders are created only when the customer actually starts
+# paying (see views.start_payment), and are reused for as long as the cart is
+# unchanged. The gateway class is configurable so tests and benchmarks can run
+# against FakeGateway instead of the Razorpay API:
+#   PAYMENT_GATEWAY = 'shop.payments.FakeGateway'
+
+CURRENCY = 'INR'
+MIN_AMOUNT = 100  # Razorpay minimum, ₹1 in paise
+SESSION_KEY = 'payment_order'
+
+
+class PaymentVerificationError(Exception):
+    pass
+
+
+class PaymentGateway:
+    key_id = ''
+
+    def create_order(self, amount, currency=CURRENCY, receipt=None):
+        """Creates a remote order for amount (in paise); returns its id."""
+        raise NotImplementedError
+
+    def verify_payment(self, order_id, payment_id, signature):
+        """Raises PaymentVerificationError unless the signature is valid."""
+        raise NotImplementedError
+
+
+class RazorpayGateway(PaymentGateway):
+    """One razorpay.Client per process over a pooled requests.Session."""
+
+    pool_size = 10
+
+    def __init__(self):
+        import razorpay
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.key_id = settings.RAZORPAY_KEY_ID
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        # Counted as outbound HTTP time of the request (shop/profiling.py)
+        session.hooks['response'].append(profiling.record_http)
+        self.client = razorpay.Client(
+            session=session,
+            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+        )
+        self._errors = razorpay.errors
+
+    def create_order(self, amount, currency=CURRENCY, receipt=None):
+        data = {'amount': amount, 'currency': currency, 'payment_capture': 1}
+        if receipt:
+            data['receipt'] = receipt
+        return self.client.order.create(data)['id']
+
+    def verify_payment(self, order_id, payment_id, signature):
+        try:
+            self.client.utility.verify_payment_signature({
+                'razorpay_order_id': order_id,
+                'razorpay_payment_id': payment_id,
+                'razorpay_signature': signature,
+            })
+        except self._errors.SignatureVerificationError as exc:
+            raise PaymentVerificationError(str(exc)) from exc
+
+
+class FakeGateway(PaymentGateway):
+    """Local gateway with Razorpay-style HMAC signatures and no network calls."""
+
+    key_id = 'rzp_fake'
+    secret = b'fake-secret'
+
+    def __init__(self):
+        # Unique across processes and restarts, like real order ids
+        self.prefix = secrets.token_hex(4)
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.orders = {}
+
+    def create_order(self, amount, currency=CURRENCY, receipt=None):
+        with self.lock:
+            order_id = f'order_fake{self.prefix}{next(self._ids):08d}'
+            self.orders[order_id] = {'amount': amount, 'currency': currency, 'receipt': receipt}
+        return order_id
+
+    def sign(self, order_id, payment_id):
+        return hmac.new(self.secret, f'{order_id}|{payment_id}'.encode(), hashlib.sha256).hexdigest()
+
+    def verify_payment(self, order_id, payment_id, signature):
+        if not hmac.compare_digest(self.sign(order_id, payment_id), signature or ''):
+            raise PaymentVerificationError('Signature mismatch')
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                path = getattr(settings, 'PAYMENT_GATEWAY', 'shop.payments.RazorpayGateway')
+                _gateway = import_string(path)()
+    return _gateway
+
+
+def set_gateway(gateway):
+    """Swaps the process-wide gateway (benchmarks, tests)."""
+    global _gateway
+    _gateway = gateway
+
+
+# -------------------------
+# Idempotent order creation
+# -------------------------
+def amount_in_paise(total):
+    return max(int(total * 100), MIN_AMOUNT)
+
+
+def cart_fingerprint(cart):
+    """Hash of what is being paid for; changes whenever the cart does."""
+    digest = hashlib.sha256()
+    for item in sorted(cart.items, key=lambda i: i.product_id):
+        digest.update(f'{item.product_id}:{item.quantity}:{item.product.final_price};'.encode())
+    digest.update(str(cart.total).encode())
+    return digest.hexdigest()
+
+
+def get_or_create_order(session, cart):
+    """Remote order for this cart, reusing the one in the session if unchanged.
+
+    Returns {'order_id', 'amount', 'currency'}.
+    """
+    fingerprint = cart_fingerprint(cart)
+    existing = session.get(SESSION_KEY)
+    if existing and existing.get('fingerprint') == fingerprint:
+        return existing
+
+    amount = amount_in_paise(cart.total)
+    order_id = get_gateway().create_order(amount, receipt=fingerprint[:40])
+    payment_order = {
+        'order_id': order_id,
+        'amount': amount,
+        'currency': CURRENCY,
+        'fingerprint': fingerprint,
+    }
+    session[SESSION_KEY] = payment_order
+    return payment_order
+
+
+def matches_cart(payment_order, cart):
+    """Whether payment_order (from get_or_create_order) was created for exactly this cart."""
+    return (
+        payment_order.get('fingerprint') == cart_fingerprint(cart)
+        and payment_order.get('amount') == amount_in_paise(cart.total)
+    )
+
+
+def session_order(session, order_id):
+    """The session's payment order if it is order_id; raises PaymentVerificationError otherwise.
+
+    A valid signature only proves some order was paid, not that it was this
+    session's order for this cart.
+    """
+    payment_order = session.get(SESSION_KEY)
+    if not payment_order or not order_id or not hmac.compare_digest(str(payment_order.get('order_id')), order_id):
+        raise PaymentVerificationError("Payment is not for this checkout")
+    return payment_order
+
+
+def clear_order(session):
+    session.pop(SESSION_KEY, None)
@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import Cart
+
+# -------------------------
+# Cart pricing
+# -------------------------
+# Shared by cart_page and checkout_page. Cart lines and their products come
+# back in one select_related query (no query per line); for totals alone,
+# aggregate_totals() does the sums in the database.
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# Columns needed to price and display a cart line
+CART_PRODUCT_FIELDS = (
+    'id', 'quantity', 'user_id', 'product_id',
+    'product__id', 'product__name', 'product__image',
+    'product__price', 'product__discount_price', 'product__stock',
+)
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def final_price_expression(prefix='product__'):
+    """SQL equivalent of Product.final_price (a 0/NULL discount means none)."""
+    return Coalesce(
+        NullIf(F(f'{prefix}discount_price'), Value(0)),
+        F(f'{prefix}price'),
+        output_field=MONEY,
+    )
+
+
+def line_total_expression(prefix='product__'):
+    return ExpressionWrapper(F('quantity') * final_price_expression(prefix), output_field=MONEY)
+
+
+class CartPricing:
+    """Priced cart lines plus subtotal/discount/total."""
+
+    def __init__(self, items, subtotal, discount, total):
+        self.items = items
+        self.subtotal = subtotal
+        self.discount = discount
+        self.total = total
+
+    @property
+    def is_empty(self):
+        return not self.items
+
+    @property
+    def quantity(self):
+        return sum(item.quantity for item in self.items)
+
+
+def cart_lines(user):
+    return (Cart.objects.filter(user=user)
+            .select_related('product')
+            .only(*CART_PRODUCT_FIELDS)
+            .order_by('id'))
+
+
+def price_cart(user):
+    """Loads the cart in one query and prices every line."""
+    return price_lines(list(cart_lines(user)))
+
+
+def price_lines(items):
+    """Prices Cart items whose products are already loaded.
+
+    Each item gets line_total / line_discount attributes for the template,
+    so nothing in the page reaches back to the database.
+    """
+    subtotal = discount = ZERO
+    for item in items:
+        price = item.product.price
+        final_price = item.product.final_price
+        item.line_total = (final_price * item.quantity).quantize(CENT)
+        item.line_discount = ((price - final_price) * item.quantity).quantize(CENT)
+        subtotal += price * item.quantity
+        discount += item.line_discount
+    subtotal = subtotal.quantize(CENT)
+    return CartPricing(items, subtotal, discount, (subtotal - discount).quantize(CENT))
+
+
+def aggregate_totals(user_id):
+    """(subtotal, discount, total) computed entirely in the database."""
+    totals = Cart.objects.filter(user_id=user_id).aggregate(
+        gross=Sum(ExpressionWrapper(F('quantity') * F('product__price'), output_field=MONEY)),
+        net=Sum(line_total_expression()),
+    )
+    subtotal = (totals['gross'] or ZERO).quantize(CENT)
+    total = (totals['net'] or ZERO).quantize(CENT)
+    return subtotal, subtotal - total, total
@@ -0,0 +1,234 @@
+import functools
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# -------------------------
+# Request profiling
+# -------------------------
+# ProfilingMiddleware (shop/middleware.py) measures every request by view:
+#   - wall time
+#   - SQL statements and their time, through an execute_wrapper installed
+#     on every database connection (also the worker threads async views
+#     use, since the current profile travels in a ContextVar)
+#   - statements repeated DUPLICATE_QUERIES times or more in one request,
+#     the N+1 pattern, which are logged and counted
+#   - template render time and outbound HTTP time (payments.py reports its
+#     Razorpay calls through record_http())
+# Totals are kept per process and served in the Prometheus text format by
+# views.metrics. A SAMPLE_RATE share of sync requests also runs under
+# cProfile, and the stats of those slower than SLOW_REQUEST_SECONDS are
+# dumped to PROFILE_DIR for `python -m pstats` / snakeviz.
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'DUPLICATE_QUERIES': 5,
+    'PROFILE_DIR': 'profiles',
+    # Bearer token for the metrics endpoint; without one only staff can read it
+    'METRICS_TOKEN': None,
+}
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNRESOLVED = '<unresolved>'
+
+_current = ContextVar('request_profile', default=None)
+
+
+def setting(name):
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+class RequestProfile:
+    """Costs collected while one request is handled."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.http_time = 0.0
+
+    def add_query(self, sql, elapsed):
+        with self.lock:
+            self.sql_count += 1
+            self.sql_time += elapsed
+            self.statements[sql] += 1
+
+    def add_template(self, elapsed):
+        with self.lock:
+            self.template_time += elapsed
+
+    def add_http(self, elapsed):
+        with self.lock:
+            self.http_time += elapsed
+
+    def duplicates(self, threshold):
+        """(sql, count) for statements run at least threshold times, most first."""
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+def current_profile():
+    return _current.get()
+
+
+def start():
+    """Starts collecting for the current request; returns (profile, token)."""
+    profile = RequestProfile()
+    return profile, _current.set(profile)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+# -------------------------
+# Hooks
+# -------------------------
+def sql_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        # sql still has its placeholders, so repeats with other ids group
+        profile.add_query(sql, time.perf_counter() - start)
+
+
+def _wrap_connection(connection, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def _wrap_template_render():
+    from django.template.backends.django import Template
+
+    original = Template.render
+    if getattr(original, 'profiled', False):
+        return
+
+    @functools.wraps(original)
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return original(self, context, request)
+        start = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            profile.add_template(time.perf_counter() - start)
+    render.profiled = True
+    Template.render = render
+
+
+def install():
+    """Hooks SQL and template timing in; safe to call more than once."""
+    connection_created.connect(_wrap_connection, dispatch_uid='shop.profiling')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+    _wrap_template_render()
+
+
+def record_http(response, *args, **kwargs):
+    """requests response hook: adds the call's time to the current request."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add_http(response.elapsed.total_seconds())
+
+
+# -------------------------
+# Metrics
+# -------------------------
+class Metrics:
+    """Per-process counters and histograms, labelled by view."""
+
+    HELP = {
+        'shop_requests_total': ('counter', "Requests handled"),
+        'shop_request_duration_seconds': ('histogram', "Request wall time"),
+        'shop_sql_queries_total': ('counter', "SQL statements executed"),
+        'shop_sql_duration_seconds_total': ('counter', "Time spent in SQL"),
+        'shop_duplicate_query_requests_total': ('counter', "Requests repeating a statement (N+1)"),
+        'shop_template_duration_seconds_total': ('counter', "Time spent rendering templates"),
+        'shop_http_duration_seconds_total': ('counter', "Time spent in outbound HTTP calls"),
+        'shop_page_cache_requests_total': ('counter', "Full-page cache lookups by result (see page_cache.py)"),
+    }
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counters = defaultdict(int)
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.histograms = defaultdict(lambda: [0] * (len(buckets) + 1) + [0.0])
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            row = self.histograms[name, labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def record(self, view, method, status, elapsed, profile, duplicated):
+        labels = (('view', view),)
+        self.inc('shop_requests_total', labels + (('method', method), ('status', str(status))))
+        self.observe('shop_request_duration_seconds', labels, elapsed)
+        self.inc('shop_sql_queries_total', labels, profile.sql_count)
+        self.inc('shop_sql_duration_seconds_total', labels, profile.sql_time)
+        self.inc('shop_template_duration_seconds_total', labels, profile.template_time)
+        self.inc('shop_http_duration_seconds_total', labels, profile.http_time)
+        if duplicated:
+            self.inc('shop_duplicate_query_requests_total', labels)
+
+    def render(self):
+        """The Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(row)) for key, row in self.histograms.items())
+        by_name = defaultdict(list)
+        for (name, labels), value in counters:
+            by_name[name].append(f'{name}{_labels(labels)} {_number(value)}')
+        for (name, labels), row in histograms:
+            lines = by_name[name]
+            for bound, count in zip(self.buckets, row):
+                lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {count}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {row[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {row[-2]}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(row[-1])}')
+        out = []
+        for name, (kind, help_text) in self.HELP.items():
+            out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(by_name.get(name, []))
+        return '\n'.join(out) + '\n'
+
+
+def _labels(labels):
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+def view_name(request):
+    """Dotted path of the view that handled request, e.g. shop.views.cart_page."""
+    match = getattr(request, 'resolver_match', None)
+    return match._func_path if match else UNRESOLVED
@@ -0,0 +1,170 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Greatest, Round
+from django.db.models.lookups import GreaterThan
+
+from .fragment_cache import bump_version
+from .models import Product, Review
+
+# -------------------------
+# Product rating aggregates
+# -------------------------
+# Product carries its review aggregates (rating_sum, rating_count,
+# rating_avg, the rounded star value `rating`, and a stars_1..stars_5
+# histogram) so listings can sort and render ratings without touching
+# Review. Every review write adjusts them with a single UPDATE built from F()
+# expressions, so concurrent reviews can't lose each other's changes;
+# recompute() rebuilds them from scratch in one grouped query.
+
+STARS = (1, 2, 3, 4, 5)
+HISTOGRAM_FIELDS = {stars: f'stars_{stars}' for stars in STARS}
+CENT = Decimal('0.01')
+AGGREGATE_FIELDS = ('rating', 'rating_avg', 'rating_sum', 'rating_count', *HISTOGRAM_FIELDS.values())
+
+
+def _counts(rating):
+    return rating in HISTOGRAM_FIELDS
+
+
+def _shift(field, delta):
+    # Reviews written with bulk_create()/update() skip the signals, so never
+    # let a removal drive a counter negative (recompute() repairs the drift)
+    if delta >= 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, Value(0))
+
+
+def _apply(product_id, add=(), remove=()):
+    """One UPDATE adding/removing the given star ratings to a product."""
+    delta_sum = sum(add) - sum(remove)
+    delta_count = len(add) - len(remove)
+    histogram = {}
+    for stars in add:
+        histogram[stars] = histogram.get(stars, 0) + 1
+    for stars in remove:
+        histogram[stars] = histogram.get(stars, 0) - 1
+
+    new_sum = _shift('rating_sum', delta_sum)
+    new_count = _shift('rating_count', delta_count)
+    # The right-hand side sees the row's old values, so spell out the new ones
+    average = Round(Cast(new_sum, FloatField()) / Cast(new_count, FloatField()), 2)
+    has_reviews = GreaterThan(new_count, 0)
+    updates = {
+        'rating_sum': new_sum,
+        'rating_count': new_count,
+        'rating_avg': Case(When(has_reviews, then=average), default=Value(0.0)),
+        'rating': Case(When(has_reviews, then=Cast(Round(average), IntegerField())), default=Value(0)),
+    }
+    for stars, delta in histogram.items():
+        if delta:
+            field = HISTOGRAM_FIELDS[stars]
+            updates[field] = _shift(field, delta)
+
+    Product.objects.filter(id=product_id).update(**updates)
+    _invalidate([product_id])
+
+
+def _invalidate(product_ids):
+    def bump():
+        category_ids = set(Product.objects.filter(id__in=product_ids).values_list('category_id', flat=True))
+        for product_id in product_ids:
+            bump_version('product', product_id)
+        for category_id in category_ids:
+            bump_version('category', category_id)
+    transaction.on_commit(bump)
+
+
+def review_added(product_id, rating):
+    if _counts(rating):
+        _apply(product_id, add=[rating])
+
+
+def review_removed(product_id, rating):
+    if _counts(rating):
+        _apply(product_id, remove=[rating])
+
+
+def review_changed(old_product_id, old_rating, product_id, rating):
+    if old_product_id != product_id:
+        review_removed(old_product_id, old_rating)
+        review_added(product_id, rating)
+    elif old_rating != rating:
+        _apply(
+            product_id,
+            add=[rating] if _counts(rating) else [],
+            remove=[old_rating] if _counts(old_rating) else [],
+        )
+
+
+def aggregate_reviews(reviews):
+    """{product_id: aggregate row} for a Review queryset, in one grouped query."""
+    rows = (
+        reviews.filter(rating__in=STARS)
+        .values('product_id')
+        .annotate(
+            total=Sum('rating'),
+            count=Count('id'),
+            **{field: Count('id', filter=Q(rating=stars)) for stars, field in HISTOGRAM_FIELDS.items()},
+        )
+        .order_by()
+    )
+    return {row['product_id']: row for row in rows}
+
+
+def _set_aggregates(product, row):
+    """Sets product's aggregate fields from a row; returns True if anything changed."""
+    count = row['count'] if row else 0
+    total = row['total'] if row else 0
+    average = (Decimal(total) / count).quantize(CENT, ROUND_HALF_UP) if count else Decimal('0.00')
+    values = {
+        'rating_sum': total,
+        'rating_count': count,
+        'rating_avg': average,
+        'rating': int(average.to_integral_value(ROUND_HALF_UP)),
+        **{field: row[field] if row else 0 for field in HISTOGRAM_FIELDS.values()},
+    }
+    changed = False
+    for field, value in values.items():
+        if getattr(product, field) != value:
+            setattr(product, field, value)
+            changed = True
+    return changed
+
+
+def recompute(product_ids=None, batch_size=500, progress=None):
+    """Rebuilds the aggregates from Review; returns the number of products changed.
+
+    Products without any review are reset to no rating, as migration 0008 did.
+    """
+    reviews = Review.objects.all()
+    products = Product.objects.only('id', *AGGREGATE_FIELDS).order_by('id')
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(id__in=product_ids)
+    aggregates = aggregate_reviews(reviews)
+
+    changed = []
+    updated = seen = 0
+    for product in products.iterator(chunk_size=batch_size):
+        seen += 1
+        if _set_aggregates(product, aggregates.get(product.id)):
+            changed.append(product)
+        if len(changed) >= batch_size:
+            updated += _save(changed)
+            changed = []
+            if progress:
+                progress(seen)
+    updated += _save(changed)
+    return updated
+
+
+def _save(products):
+    if not products:
+        return 0
+    with transaction.atomic():
+        Product.objects.bulk_update(products, AGGREGATE_FIELDS)
+        _invalidate([p.id for p in products])
+    return len(products)
+
@@ -0,0 +1,182 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from . import search
+from .fragment_cache import bump_version
+from .models import Cart, OrderItem, Product, RelatedProduct
+
+# -------------------------
+# Related products
+# -------------------------
+# Built offline by `manage.py build_related_products` and stored in
+# RelatedProduct, so the product page does a single indexed lookup.
+# Two signals are blended per product pair:
+#   - bought together: how often both appear in the same order or cart,
+#     normalised by how common each product is (cosine over baskets)
+#   - similar: TF-IDF cosine similarity of name/description/benefits/category
+# Both come out of sparse matrix products; rows are scored in chunks so
+# memory stays at chunk_size x catalog size.
+
+DEFAULT_PER_PRODUCT = 8
+DEFAULT_WEIGHTS = {'bought_together': 0.6, 'similar': 0.4}
+CHUNK_SIZE = 512
+MIN_SCORE = 1e-6
+
+
+def _setting(name, default):
+    return getattr(settings, 'RELATED_PRODUCTS', {}).get(name, default)
+
+
+def basket_matrix(product_index):
+    """Baskets x products 0/1 matrix from order lines and carts."""
+    rows, cols = [], []
+    basket_ids = {}
+
+    def add(basket, product_id):
+        col = product_index.get(product_id)
+        if col is not None:
+            rows.append(basket_ids.setdefault(basket, len(basket_ids)))
+            cols.append(col)
+
+    for order_id, product_id in OrderItem.objects.values_list('order_id', 'product_id').iterator(chunk_size=5000):
+        add(('order', order_id), product_id)
+    for user_id, product_id in Cart.objects.values_list('user_id', 'product_id').iterator(chunk_size=5000):
+        add(('cart', user_id), product_id)
+
+    data = np.ones(len(rows), dtype=np.float32)
+    baskets = sparse.csr_matrix((data, (rows, cols)), shape=(len(basket_ids), len(product_index)))
+    # A product listed twice in one basket still counts once
+    baskets.data[:] = 1
+    return baskets
+
+
+def cooccurrence(baskets):
+    """Products x products basket cosine similarity, zero diagonal."""
+    counts = (baskets.T @ baskets).tocsr().astype(np.float32)
+    popularity = np.sqrt(counts.diagonal())
+    popularity[popularity == 0] = 1
+    inverse = sparse.diags(1 / popularity)
+    scores = (inverse @ counts @ inverse).tocsr()
+    scores.setdiag(0)
+    scores.eliminate_zeros()
+    return scores
+
+
+def product_text(product):
+    return ' '.join(filter(None, [
+        product.name, product.name,  # the name counts double
+        product.short_description, product.description,
+        *(benefit.title for benefit in product.benefits.all()),
+        product.category.name,
+    ]))
+
+
+def text_vectors(products):
+    """L2-normalised TF-IDF rows, one per product."""
+    vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True, min_df=1, max_df=0.8)
+    try:
+        vectors = vectorizer.fit_transform(product_text(p) for p in products)
+    except ValueError:
+        # Empty vocabulary (no text at all)
+        return sparse.csr_matrix((len(products), 1), dtype=np.float32)
+    return normalize(vectors).astype(np.float32).tocsr()
+
+
+def top_related(row_indices, together, vectors, weights, per_product):
+    """Yields (row, [(col, score, kind), ...]) for each requested row."""
+    for start in range(0, len(row_indices), CHUNK_SIZE):
+        rows = row_indices[start:start + CHUNK_SIZE]
+        bought = together[rows].toarray()
+        similar = (vectors[rows] @ vectors.T).toarray()
+        blended = weights['bought_together'] * bought + weights['similar'] * similar
+        blended[np.arange(len(rows)), rows] = 0  # never recommend the product itself
+
+        k = min(per_product, blended.shape[1] - 1)
+        if k <= 0:
+            continue
+        best = np.argpartition(-blended, k - 1, axis=1)[:, :k]
+        for offset, row in enumerate(rows):
+            cols = best[offset][np.argsort(-blended[offset, best[offset]])]
+            picks = []
+            for col in cols:
+                score = float(blended[offset, col])
+                if score < MIN_SCORE:
+                    break
+                bought_part = weights['bought_together'] * bought[offset, col]
+                kind = 'bought_together' if bought_part >= score / 2 else 'similar'
+                picks.append((int(col), score, kind))
+            yield row, picks
+
+
+def changed_product_ids():
+    """Products whose recommendations are stale since the last build."""
+    last_build = RelatedProduct.objects.aggregate(last=Max('updated_at'))['last']
+    built = set(RelatedProduct.objects.values_list('product_id', flat=True).distinct())
+    stale = set(Product.objects.exclude(id__in=built).values_list('id', flat=True))
+    if last_build is not None:
+        stale.update(OrderItem.objects.filter(order__created_at__gt=last_build)
+                     .values_list('product_id', flat=True))
+        stale.update(Cart.objects.filter(created_at__gt=last_build).values_list('product_id', flat=True))
+    return stale
+
+
+def build(product_ids=None, per_product=None, progress=None):
+    """(Re)builds RelatedProduct rows for product_ids (all products if None).
+
+    Scores are always computed against the whole catalog, so an incremental
+    build gives the same rows for those products as a full one.
+    Returns the number of products written.
+    """
+    per_product = per_product or _setting('PER_PRODUCT', DEFAULT_PER_PRODUCT)
+    weights = {**DEFAULT_WEIGHTS, **_setting('WEIGHTS', {})}
+
+    products = list(search.searchable_products().order_by('id'))
+    if not products:
+        return 0
+    ids = [p.id for p in products]
+    index = {product_id: i for i, product_id in enumerate(ids)}
+
+    together = cooccurrence(basket_matrix(index))
+    vectors = text_vectors(products)
+
+    if product_ids is None:
+        rows = np.arange(len(ids))
+    else:
+        rows = np.array(sorted(index[pid] for pid in product_ids if pid in index), dtype=np.int64)
+
+    written = 0
+    batch = []
+    for row, picks in top_related(rows, together, vectors, weights, per_product):
+        batch.append((ids[row], [(ids[col], score, kind) for col, score, kind in picks]))
+        if len(batch) >= CHUNK_SIZE:
+            written += _write(batch)
+            batch = []
+            if progress:
+                progress(written)
+    written += _write(batch)
+    return written
+
+
+def _write(batch):
+    if not batch:
+        return 0
+    product_ids = [product_id for product_id, picks in batch]
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+        RelatedProduct.objects.bulk_create([
+            RelatedProduct(product_id=product_id, related_id=related_id, kind=kind, score=score, rank=rank)
+            for product_id, picks in batch
+            for rank, (related_id, score, kind) in enumerate(picks)
+        ])
+
+        def bump():
+            for product_id in product_ids:
+                bump_version('product', product_id)
+        transaction.on_commit(bump)
+    return len(batch)
+
@@ -0,0 +1,208 @@
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# -------------------------
+# Read replicas
+# -------------------------
+# Catalog models are read far more than they are written, so during a
+# request their reads go to a replica (settings.DATABASES aliases named
+# replica_*, configured from DATABASE_REPLICA_URLS). Everything else, and
+# every write, uses the primary. The primary is also used:
+#   - for the rest of a request after it writes, and for STICKY_SECONDS
+#     after that via a cookie, so a client always reads its own writes
+#   - for unsafe methods (POST...) from the start, and inside transactions
+#   - inside primary() blocks: data that fills the shared fragment cache
+#     must not come from a lagging replica, or the stale copy would be
+#     cached under the new version
+#   - outside requests (commands, jobs), which often read-modify-write
+#   - when no replica is within MAX_LAG seconds of the primary; lag is
+#     checked at most every CHECK_INTERVAL seconds per replica
+#
+# For local testing, a second SQLite file works as a replica that
+# `manage.py sync_replicas` copies the primary into.
+
+REPLICA_MODELS = frozenset({
+    'shop.category', 'shop.product', 'shop.productimage', 'shop.productthumbnail',
+    'shop.productbenefit', 'shop.review',
+})
+DEFAULTS = {
+    'MAX_LAG': 5.0,
+    'CHECK_INTERVAL': 2.0,
+    'STICKY_SECONDS': 10,
+    'COOKIE_NAME': 'primary_reads',
+}
+HEARTBEAT_TABLE = 'replica_heartbeat'
+
+_state = ContextVar('replica_state', default=None)
+
+
+def setting(name):
+    return getattr(settings, 'REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+class RequestState:
+    """Replica routing for one request (shared with its worker threads)."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.forced = 0
+
+
+def begin_request(pinned=False):
+    """Starts routing reads for a request; returns (state, token)."""
+    state = RequestState(pinned)
+    return state, _state.set(state)
+
+
+def end_request(token):
+    _state.reset(token)
+
+
+@contextmanager
+def primary():
+    """Reads inside this block go to the primary."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    state.forced += 1
+    try:
+        yield
+    finally:
+        state.forced -= 1
+
+
+# -------------------------
+# Replication lag
+# -------------------------
+def measure_lag(connection):
+    """Seconds the replica is behind its primary, or None if unknown."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # An idle primary has nothing to replay; that isn't lag
+            cursor.execute(
+                "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )
+            row = cursor.fetchone()
+            return float(row[0]) if row and row[0] is not None else None
+        if connection.vendor == 'mysql':
+            cursor.execute("SHOW REPLICA STATUS")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            columns = [column[0] for column in cursor.description]
+            value = dict(zip(columns, row)).get('Seconds_Behind_Source')
+            return float(value) if value is not None else None
+        if connection.vendor == 'sqlite':
+            # Written by sync_sqlite_replica()
+            cursor.execute(f"SELECT synced_at FROM {HEARTBEAT_TABLE} WHERE id = 1")
+            row = cursor.fetchone()
+            return time.time() - row[0] if row else None
+    return None
+
+
+class ReplicaHealth:
+    """Per-process cache of each replica's lag."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    def lag(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            checked = self.checked.get(alias)
+        if checked and now - checked[0] < setting('CHECK_INTERVAL'):
+            return checked[1]
+        try:
+            lag = measure_lag(connections[alias])
+        except DatabaseError:
+            lag = None
+        with self.lock:
+            self.checked[alias] = (now, lag)
+        return lag
+
+    def usable(self):
+        max_lag = setting('MAX_LAG')
+        usable = []
+        for alias in replica_aliases():
+            lag = self.lag(alias)
+            if lag is not None and lag <= max_lag:
+                usable.append(alias)
+        return usable
+
+
+health = ReplicaHealth()
+
+
+# -------------------------
+# Router
+# -------------------------
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None or state.pinned or state.forced
+            or model._meta.label_lower not in REPLICA_MODELS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        replicas = health.usable()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Read our own writes for the rest of the request (and after it)
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in replica_aliases():
+            return False
+        return None
+
+
+# -------------------------
+# Simulated SQLite replicas
+# -------------------------
+def sync_sqlite_replica(alias):
+    """Copies the primary SQLite database into replica alias; returns seconds taken."""
+    primary_db = settings.DATABASES[DEFAULT_DB_ALIAS]
+    replica_db = settings.DATABASES[alias]
+    if 'sqlite3' not in primary_db['ENGINE'] or 'sqlite3' not in replica_db['ENGINE']:
+        raise ValueError(f"{alias}: only SQLite replicas of a SQLite primary can be simulated")
+    started = time.time()
+    source = sqlite3.connect(primary_db['NAME'])
+    target = sqlite3.connect(replica_db['NAME'])
+    try:
+        # A consistent snapshot of the primary as of `started`
+        source.backup(target)
+        target.execute(f"CREATE TABLE IF NOT EXISTS {HEARTBEAT_TABLE} (id INTEGER PRIMARY KEY, synced_at REAL)")
+        target.execute(f"INSERT OR REPLACE INTO {HEARTBEAT_TABLE} (id, synced_at) VALUES (1, ?)", [started])
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+    return time.time() - started
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import replicas
+from .fragment_cache import get_fragment_cache, get_version
+from .models import Review
+from .pagination import paginate, parse_timestamp
+
+# -------------------------
+# Product reviews
+# -------------------------
+# Reviews are listed newest first with keyset pagination on (created_at, id),
+# so page 200 of a product with thousands of reviews costs the same as page
+# 1. The first page is what almost everyone sees (it's on the product page),
+# so it is cached under a per-product 'reviews' version that signals bump on
+# every review write.
+
+PAGE_SIZE = 10
+DEFAULT_RATE_LIMIT = (5, 60 * 60)  # reviews per user per window (seconds)
+REVIEW_FIELDS = ('id', 'product_id', 'user_id', 'rating', 'comment', 'created_at', 'user__username')
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__("You have posted too many reviews recently. Please try again later.")
+
+
+def serialize(review):
+    return {
+        'id': review.id,
+        'user': review.user.username,
+        'rating': review.rating,
+        'comment': review.comment or '',
+        'created_at': review.created_at.isoformat(),
+        'date': review.created_at.strftime('%d %b %Y'),
+    }
+
+
+def review_queryset(product_id):
+    return Review.objects.filter(product_id=product_id).select_related('user').only(*REVIEW_FIELDS)
+
+
+def get_page(product_id, cursor=None, page_size=PAGE_SIZE):
+    """Returns {'reviews': [...], 'next_cursor': ...}; the first page comes from cache."""
+    if cursor is None and page_size == PAGE_SIZE:
+        return first_page(product_id)
+    return _load_page(product_id, cursor, page_size)
+
+
+def _load_page(product_id, cursor=None, page_size=PAGE_SIZE):
+    rows, next_cursor = paginate(
+        review_queryset(product_id), 'created_at', cursor,
+        descending=True, page_size=page_size, parse=parse_timestamp,
+    )
+    return {'reviews': [serialize(review) for review in rows], 'next_cursor': next_cursor}
+
+
+def first_page(product_id):
+    fragments = get_fragment_cache()
+    key = f'reviews:{product_id}:v{get_version("reviews", product_id)}'
+    page = fragments.get(key)
+    if page is None:
+        # Cached under the current version, so not from a lagging replica
+        with replicas.primary():
+            page = _load_page(product_id)
+        fragments.set(key, page)
+    return page
+
+
+# -------------------------
+# Submitting
+# -------------------------
+def check_rate_limit(user_id):
+    """Raises RateLimited if the user's quota of reviews for the window is used.
+
+    Counted from the reviews themselves, so the limit holds across worker
+    processes without a shared cache.
+    """
+    limit, window = getattr(settings, 'REVIEW_RATE_LIMIT', DEFAULT_RATE_LIMIT)
+    since = timezone.now() - timedelta(seconds=window)
+    with replicas.primary():
+        recent = list(
+            Review.objects.filter(user_id=user_id, created_at__gte=since)
+            .order_by('-created_at').values_list('created_at', flat=True)[:limit]
+        )
+    if len(recent) >= limit:
+        # The window frees up when the oldest of those ages out
+        oldest = recent[-1]
+        raise RateLimited(max(1, int((oldest - since).total_seconds()) + 1))
+
+
+def submit(user, product, form):
+    """Saves a valid ReviewForm for product; raises RateLimited."""
+    with transaction.atomic():
+        # Locking the user's row makes parallel posts from one user count one
+        # after another (SQLite's IMMEDIATE transactions already serialize them)
+        list(User.objects.filter(id=user.id).select_for_update().values_list('id', flat=True))
+        check_rate_limit(user.id)
+        review = form.save(commit=False)
+        review.user = user
+        review.product = product
+        review.save()
+    return review
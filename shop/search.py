@@ -0,0 +1,480 @@
+import bisect
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.db import connection, transaction, OperationalError, DatabaseError
+
+from .fragment_cache import get_version
+
+# -------------------------
+# Product search
+# -------------------------
+# Inverted index over the product text fields. On SQLite the index is an FTS5
+# virtual table (ranked with its built-in bm25()); on any other database it is
+# an in-process Python index with the same interface (also used on SQLite
+# builds without FTS5). Both are kept up to date from the Product/Category
+# signals in shop/signals.py.
+#
+# The in-process index only sees the signals of its own process, so every
+# worker reloads its copy when the catalog version (shop/fragment_cache.py)
+# has moved, checking at most every MEMORY_INDEX_TTL seconds: changes made in
+# other workers show up in search within that long.
+
+FTS_TABLE = 'shop_product_fts'
+FTS_VOCAB_TABLE = 'shop_product_fts_vocab'
+
+# Indexed fields and their BM25 weights (name matches count the most)
+FIELD_WEIGHTS = {
+    'name': 10.0,
+    'short_description': 4.0,
+    'description': 1.0,
+    'key_benefits': 2.0,  # ProductBenefit titles
+    'category': 3.0,
+}
+FIELDS = tuple(FIELD_WEIGHTS)
+
+# Typo-corrected vocabulary is rebuilt at most this often (seconds) unless
+# this process changed the index itself.
+SPELLER_TTL = 300
+
+# How often (seconds) the in-process index checks for changes made elsewhere
+MEMORY_INDEX_TTL = 60
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [t.lower() for t in TOKEN_RE.findall(text)]
+
+
+def product_document(product):
+    """The text fields that get indexed for a product."""
+    return {
+        'name': product.name or '',
+        'short_description': product.short_description or '',
+        'description': product.description or '',
+        'key_benefits': '\n'.join(benefit.title for benefit in product.benefits.all()),
+        'category': product.category.name if product.category_id else '',
+    }
+
+
+# -------------------------
+# Spelling correction
+# -------------------------
+class Speller:
+    """Symmetric-delete spelling corrector (edit distance 1, incl. transpositions).
+
+    Every vocabulary term is stored under each of its single-character
+    deletions, so a lookup is a handful of dict hits instead of a scan.
+    """
+
+    def __init__(self, term_counts):
+        self.counts = dict(term_counts)
+        self.sorted_terms = sorted(self.counts)
+        self.deletes = defaultdict(set)
+        for term in self.counts:
+            if len(term) < 4:
+                continue
+            for variant in self._variants(term):
+                self.deletes[variant].add(term)
+
+    @staticmethod
+    def _variants(word):
+        yield word
+        for i in range(len(word)):
+            yield word[:i] + word[i + 1:]
+
+    def known(self, token):
+        return token in self.counts
+
+    def has_prefix(self, prefix):
+        i = bisect.bisect_left(self.sorted_terms, prefix)
+        return i < len(self.sorted_terms) and self.sorted_terms[i].startswith(prefix)
+
+    def correct(self, token):
+        """Best vocabulary term within one edit of token, or token itself."""
+        if len(token) < 4 or token in self.counts:
+            return token
+        candidates = set()
+        for variant in self._variants(token):
+            candidates |= self.deletes.get(variant, set())
+        if not candidates:
+            return token
+        return max(candidates, key=lambda t: (self.counts[t], t))
+
+
+# -------------------------
+# Pure-Python index (non-SQLite databases)
+# -------------------------
+class MemoryIndex:
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = defaultdict(dict)   # term -> {doc_id: weighted tf}
+        self.name_terms = defaultdict(set)  # term -> doc ids with term in name
+        self.doc_terms = {}                 # doc_id -> set of terms (for removal)
+        self.doc_lengths = {}
+        self.total_length = 0.0
+        self.sorted_terms = []
+        self.loaded = False
+        self.version = None
+        self.checked = time.monotonic()
+        self._speller = None
+
+    def load(self, products):
+        # Changes committed while loading move the version and reload it again
+        self.version = get_version('catalog', 0)
+        with self.lock:
+            for product in products:
+                self.add(product.id, product_document(product))
+            self.loaded = True
+
+    def stale(self):
+        """Whether the catalog changed since load(), checked every MEMORY_INDEX_TTL seconds."""
+        now = time.monotonic()
+        if now - self.checked < MEMORY_INDEX_TTL:
+            return False
+        self.checked = now
+        return get_version('catalog', 0) != self.version
+
+    def add(self, doc_id, document):
+        with self.lock:
+            self.remove(doc_id)
+            weighted = defaultdict(float)
+            length = 0.0
+            for field, weight in FIELD_WEIGHTS.items():
+                tokens = tokenize(document.get(field))
+                length += weight * len(tokens)
+                for token in tokens:
+                    weighted[token] += weight
+                    if field == 'name':
+                        self.name_terms[token].add(doc_id)
+            for term, tf in weighted.items():
+                if term not in self.postings:
+                    bisect.insort(self.sorted_terms, term)
+                self.postings[term][doc_id] = tf
+            self.doc_terms[doc_id] = set(weighted)
+            self.doc_lengths[doc_id] = length
+            self.total_length += length
+            self._speller = None
+
+    def remove(self, doc_id):
+        with self.lock:
+            terms = self.doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            self.total_length -= self.doc_lengths.pop(doc_id, 0.0)
+            for term in terms:
+                docs = self.postings.get(term)
+                if docs is None:
+                    continue
+                docs.pop(doc_id, None)
+                self.name_terms.get(term, set()).discard(doc_id)
+                if not docs:
+                    del self.postings[term]
+                    self.name_terms.pop(term, None)
+                    i = bisect.bisect_left(self.sorted_terms, term)
+                    if i < len(self.sorted_terms) and self.sorted_terms[i] == term:
+                        del self.sorted_terms[i]
+            self._speller = None
+
+    def speller(self):
+        with self.lock:
+            if self._speller is None:
+                self._speller = Speller((t, len(d)) for t, d in self.postings.items())
+            return self._speller
+
+    def _prefix_terms(self, prefix, limit=50):
+        i = bisect.bisect_left(self.sorted_terms, prefix)
+        terms = []
+        while i < len(self.sorted_terms) and len(terms) < limit:
+            term = self.sorted_terms[i]
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+            i += 1
+        return terms
+
+    def _bm25(self, term, scores):
+        docs = self.postings.get(term)
+        if not docs:
+            return
+        n = len(self.doc_lengths)
+        avg_length = (self.total_length / n) if n else 1.0
+        idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+        for doc_id, tf in docs.items():
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+            scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def search(self, tokens, limit, prefix_last=False):
+        with self.lock:
+            scores = defaultdict(float)
+            matched = None
+            for i, token in enumerate(tokens):
+                if prefix_last and i == len(tokens) - 1:
+                    terms = self._prefix_terms(token)
+                else:
+                    terms = [token]
+                docs = set()
+                for term in terms:
+                    docs.update(self.postings.get(term, ()))
+                    self._bm25(term, scores)
+                matched = docs if matched is None else matched & docs
+            if not matched:
+                return []
+            ranked = sorted(matched, key=lambda d: (-scores[d], d))
+            return ranked[:limit]
+
+    def autocomplete(self, tokens, limit):
+        with self.lock:
+            *head, last = tokens
+            candidates = set()
+            for term in self._prefix_terms(last):
+                candidates |= self.name_terms.get(term, set())
+            for token in head:
+                candidates &= self.name_terms.get(token, set())
+            if not candidates:
+                return []
+            scores = defaultdict(float)
+            for term in head + self._prefix_terms(last):
+                self._bm25(term, scores)
+            return sorted(candidates, key=lambda d: (-scores[d], d))[:limit]
+
+
+# -------------------------
+# SQLite FTS5 index
+# -------------------------
+def _fts_phrase(token, prefix=False):
+    return '"%s"%s' % (token.replace('"', ''), '*' if prefix else '')
+
+
+class SqliteFTSIndex:
+    def __init__(self):
+        self._speller = None
+        self._speller_built = 0.0
+
+    @staticmethod
+    def create(cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(FIELDS)}, "
+            "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_VOCAB_TABLE} "
+            f"USING fts5vocab({FTS_TABLE}, 'row')"
+        )
+
+    @staticmethod
+    def drop(cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_VOCAB_TABLE}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def add(self, doc_id, document):
+        self.add_many([(doc_id, document)])
+
+    def add_many(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[doc_id] for doc_id, _ in documents])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) "
+                f"VALUES (%s, {', '.join(['%s'] * len(FIELDS))})",
+                [[doc_id] + [document[f] for f in FIELDS] for doc_id, document in documents],
+            )
+        self._speller = None
+
+    def remove(self, doc_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [doc_id])
+        self._speller = None
+
+    def rebuild(self, products):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            rows = [[p.id] + [document[f] for f in FIELDS]
+                    for p in products for document in [product_document(p)]]
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) "
+                f"VALUES (%s, {', '.join(['%s'] * len(FIELDS))})",
+                rows,
+            )
+        self._speller = None
+
+    def speller(self):
+        if self._speller is None or time.monotonic() - self._speller_built > SPELLER_TTL:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT term, doc FROM {FTS_VOCAB_TABLE}')
+                self._speller = Speller(cursor.fetchall())
+            self._speller_built = time.monotonic()
+        return self._speller
+
+    def _match(self, match, limit):
+        weights = ', '.join(str(FIELD_WEIGHTS[f]) for f in FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search(self, tokens, limit, prefix_last=False):
+        last = len(tokens) - 1
+        match = ' '.join(_fts_phrase(t, prefix_last and i == last) for i, t in enumerate(tokens))
+        return self._match(match, limit)
+
+    def autocomplete(self, tokens, limit):
+        last = len(tokens) - 1
+        match = 'name : (%s)' % ' '.join(_fts_phrase(t, i == last) for i, t in enumerate(tokens))
+        return self._match(match, limit)
+
+
+# -------------------------
+# Backend selection
+# -------------------------
+_index = None
+_index_lock = threading.Lock()
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT 1 FROM {FTS_TABLE} LIMIT 0')
+        return True
+    except (OperationalError, DatabaseError):
+        return False
+
+
+def searchable_products(queryset=None):
+    """Products with what product_document() reads, benefits prefetched."""
+    from .models import Product
+    queryset = Product.objects.all() if queryset is None else queryset
+    return (queryset.select_related('category')
+            .only('id', 'name', 'short_description', 'description', 'category__name')
+            .prefetch_related('benefits'))
+
+
+def _memory_index():
+    index = MemoryIndex()
+    index.load(searchable_products().iterator(chunk_size=2000))
+    return index
+
+
+def get_index():
+    global _index
+    index = _index
+    if index is None or (isinstance(index, MemoryIndex) and index.stale()):
+        with _index_lock:
+            if _index is index:
+                _index = SqliteFTSIndex() if fts5_available() else _memory_index()
+    return _index
+
+
+def _query_tokens(index, query):
+    """Tokenizes a query and fixes tokens that are not in the vocabulary."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    speller = index.speller()
+    stemmed = isinstance(index, SqliteFTSIndex)
+    last = len(tokens) - 1
+    corrected = []
+    for i, token in enumerate(tokens):
+        if (speller.known(token)
+                or (i == last and speller.has_prefix(token))
+                or (stemmed and _stem_known(speller, token))):
+            corrected.append(token)
+        else:
+            corrected.append(speller.correct(token))
+    return corrected
+
+
+def _stem_known(speller, token):
+    # FTS5 stores porter stems ("tablets" -> "tablet"), which FTS applies to the
+    # query too; don't "correct" a token whose stem is already indexed.
+    for cut in range(1, 4):
+        if len(token) - cut >= 3 and token[:-cut] in speller.counts:
+            return True
+    return False
+
+
+# -------------------------
+# Public API
+# -------------------------
+def index_product(product):
+    index = get_index()
+    document = product_document(product)
+    if isinstance(index, MemoryIndex):
+        transaction.on_commit(lambda: index.add(product.id, document))
+    else:
+        index.add(product.id, document)
+
+
+def index_products(products):
+    """index_product() for many products at once (bulk imports)."""
+    index = get_index()
+    documents = [(product.id, product_document(product)) for product in products]
+    if isinstance(index, MemoryIndex):
+        def add():
+            for doc_id, document in documents:
+                index.add(doc_id, document)
+        transaction.on_commit(add)
+    else:
+        index.add_many(documents)
+
+
+def remove_product(product_id):
+    index = get_index()
+    if isinstance(index, MemoryIndex):
+        transaction.on_commit(lambda: index.remove(product_id))
+    else:
+        index.remove(product_id)
+
+
+def rebuild_index():
+    """Re-indexes every product from scratch; returns the index in use."""
+    global _index
+    with _index_lock:
+        if fts5_available():
+            _index = _index if isinstance(_index, SqliteFTSIndex) else SqliteFTSIndex()
+            with transaction.atomic():
+                _index.rebuild(searchable_products().iterator(chunk_size=2000))
+        else:
+            _index = _memory_index()
+    return _index
+
+
+def search_ids(query, limit=20):
+    """Product ids matching query, best BM25 match first."""
+    index = get_index()
+    tokens = _query_tokens(index, query)
+    if not tokens:
+        return []
+    # Treat the last word as a prefix so half-typed queries still match
+    return index.search(tokens, limit, prefix_last=True)
+
+
+def autocomplete_ids(query, limit=8):
+    """Product ids whose name starts words with the typed prefix."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    index = get_index()
+    return index.autocomplete(tokens, limit)
+
+
+def search_products(query, limit=20):
+    """Product instances for query, in rank order."""
+    from .catalog import listing_queryset
+    ids = search_ids(query, limit)
+    products = listing_queryset().in_bulk(ids)
+    return [products[i] for i in ids if i in products]
@@ -1,6 +1,16 @@
-from django.db.models.signals import post_migrate
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save
 from django.dispatch import receiver
 from django.apps import apps
+from django.db import transaction
+
+from . import search, cart_summary, guest_cart, images, ratings, storage, tracking
+from .fragment_cache import bump_version
+from .models import (
+    Cart, Category, Order, Product, ProductBenefit, ProductImage, ProductThumbnail, ProductUserImage,
+    Review,
+)
+
 
 @receiver(post_migrate)
 def create_default_categories(sender, **kwargs):
@@ -16,3 +26,197 @@ def create_default_categories(sender, **kwargs):
         ]
         for cat_name in default_categories:
             Category.objects.get_or_create(name=cat_name)
+
+
+# -------------------------
+# Search index maintenance
+# -------------------------
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # The category name is part of every product document in it
+    if raw or created:
+        return
+    for product in search.searchable_products(instance.products.all()):
+        search.index_product(product)
+
+
+# -------------------------
+# Fragment cache versions
+# -------------------------
+# Bumped after commit so a concurrent request can't re-cache the old data
+# under the new version.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_version(sender, instance, **kwargs):
+    def bump():
+        bump_version('product', instance.id)
+        bump_version('category', instance.category_id)
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_version(sender, instance, **kwargs):
+    # Category names are listed on the categories page
+    transaction.on_commit(lambda: bump_version('category', instance.id))
+
+
+@receiver(post_save, sender=ProductThumbnail)
+@receiver(post_delete, sender=ProductThumbnail)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductBenefit)
+@receiver(post_delete, sender=ProductBenefit)
+def bump_parent_product_version(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version('product', instance.product_id))
+
+
+# -------------------------
+# Responsive image derivatives
+# -------------------------
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=ProductThumbnail)
+@receiver(post_save, sender=ProductUserImage)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    name = instance.image.name
+    if raw or not name or images.processed(name):
+        return
+    product_id = instance.id if sender is Product else instance.product_id
+
+    def refresh_fragments():
+        # HTML cached before the derivatives existed points at the original
+        bump_version('product', product_id)
+        if sender is Product:
+            bump_version('category', instance.category_id)
+    images.schedule(name, on_done=refresh_fragments)
+
+
+# -------------------------
+# Media reference counts
+# -------------------------
+# Rows loaded without their image column (.only()) are left alone.
+_DEFERRED = object()
+
+
+def _image_name(instance):
+    value = instance.__dict__.get('image', _DEFERRED)
+    if value is _DEFERRED:
+        return _DEFERRED
+    return getattr(value, 'name', value) or None
+
+
+@receiver(post_init, sender=Product)
+@receiver(post_init, sender=ProductImage)
+@receiver(post_init, sender=ProductThumbnail)
+@receiver(post_init, sender=ProductUserImage)
+def remember_image_name(sender, instance, **kwargs):
+    instance._stored_image_name = _image_name(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=ProductThumbnail)
+@receiver(post_save, sender=ProductUserImage)
+def count_image_reference(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_stored_image_name', _DEFERRED)
+    current = _image_name(instance)
+    if previous is _DEFERRED or current is _DEFERRED or previous == current:
+        return
+    storage.add_ref(current)
+    storage.release(previous)
+    instance._stored_image_name = current
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_delete, sender=ProductThumbnail)
+@receiver(post_delete, sender=ProductUserImage)
+def release_image_reference(sender, instance, **kwargs):
+    name = _image_name(instance)
+    if name is not _DEFERRED:
+        storage.release(name)
+
+
+# -------------------------
+# Product rating aggregates
+# -------------------------
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._stored_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ratings.review_added(instance.product_id, instance.rating)
+    else:
+        old_product_id, old_rating = instance._stored_rating
+        ratings.review_changed(old_product_id, old_rating, instance.product_id, instance.rating)
+    instance._stored_rating = (instance.product_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    ratings.review_removed(instance.product_id, instance.rating)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_reviews_version(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version('reviews', instance.product_id))
+
+
+# -------------------------
+# Cart summary
+# -------------------------
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def invalidate_cart_summary(sender, instance, **kwargs):
+    transaction.on_commit(lambda: cart_summary.invalidate(instance.user_id))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_cart_summaries_for_product(sender, instance, created, raw=False, **kwargs):
+    # A price change alters the subtotal of every cart holding the product
+    if raw or created:
+        return
+    user_ids = list(Cart.objects.filter(product_id=instance.id).values_list('user_id', flat=True))
+
+    def invalidate():
+        for user_id in user_ids:
+            cart_summary.invalidate(user_id)
+    transaction.on_commit(invalidate)
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    # login() has already cycled the session key, keeping its data
+    if request is not None and hasattr(request, 'session'):
+        guest_cart.merge(request.session, user)
+
+
+# -------------------------
+# Order status timeline
+# -------------------------
+@receiver(post_save, sender=Order)
+def record_order_status(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.status != getattr(instance, '_loaded_status', None):
+        tracking.record_status(instance, note=getattr(instance, '_status_note', ''))
+        instance._loaded_status = instance.status
+        instance._status_note = ''
@@ -0,0 +1,120 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+
+# -------------------------
+# Content-addressed media storage
+# -------------------------
+# Uploads are stored under their SHA-256, e.g.
+#   cas/3a/7b/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b.png
+# so uploading the same image twice (or for two products) keeps one file,
+# and a name never changes content, so media can be cached forever.
+#
+# Files are shared, so they can't be deleted along with a row. MediaBlob
+# counts the rows that point at each file (kept up to date by signals) and
+# `manage.py gc_media` removes files nothing refers to any more.
+
+CAS_ROOT = 'cas'
+# Resized copies (shop/images.py) are found by a name derived from their
+# original's, so they keep the name they're saved under
+DERIVATIVE_ROOT = 'derivatives'
+HASH_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class _AlreadyStored(Exception):
+    pass
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(CAS_ROOT + '/')
+
+
+def content_name(digest, ext):
+    return f'{CAS_ROOT}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def hash_file(content):
+    """SHA-256 hex digest and size of a File, read in chunks."""
+    sha = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        sha.update(chunk)
+        size += len(chunk)
+    content.seek(0)
+    return sha.hexdigest(), size
+
+
+class ContentAddressedMixin:
+    """Storage mixin naming files by content; add it in front of any Storage."""
+
+    def get_available_name(self, name, max_length=None):
+        if is_content_addressed(name):
+            if self.exists(name):
+                # Another upload wrote identical content first
+                raise _AlreadyStored(name)
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if name.startswith(DERIVATIVE_ROOT + '/'):
+            return super()._save(name, content)
+        digest, size = hash_file(content)
+        name = content_name(digest, posixpath.splitext(name)[1])
+        if not self.exists(name):
+            try:
+                name = super()._save(name, content)
+            except _AlreadyStored:
+                pass
+        register_blob(name, digest, size)
+        return name
+
+
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    pass
+
+
+# -------------------------
+# Reference counts
+# -------------------------
+def register_blob(name, digest, size):
+    from .models import MediaBlob
+    MediaBlob.objects.get_or_create(name=name, defaults={'sha256': digest, 'size': size})
+
+
+def add_ref(name):
+    from .models import MediaBlob
+    if not is_content_addressed(name):
+        return
+    if not MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        MediaBlob.objects.get_or_create(name=name, defaults={'sha256': _digest_of(name), 'refcount': 1})
+
+
+def release(name):
+    from .models import MediaBlob
+    if is_content_addressed(name):
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') - 1)
+
+
+def adjust_refs(deltas):
+    """Applies {name: delta} refcount changes with one UPDATE per name (bulk writes)."""
+    from .models import MediaBlob
+    for name, delta in deltas.items():
+        if not delta or not is_content_addressed(name):
+            continue
+        if not MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + delta) and delta > 0:
+            MediaBlob.objects.get_or_create(name=name, defaults={'sha256': _digest_of(name), 'refcount': delta})
+
+
+def _digest_of(name):
+    return posixpath.splitext(posixpath.basename(name))[0]
+
+
+# -------------------------
+# Serving
+# -------------------------
+def is_immutable(name):
+    """Content-addressed files (and their derivatives) never change under a name."""
+    return is_content_addressed(name) or is_content_addressed(name.removeprefix(DERIVATIVE_ROOT + '/'))
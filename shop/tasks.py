@@ -0,0 +1,53 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .jobs import task
+from .models import Order
+
+logger = logging.getLogger(__name__)
+analytics_logger = logging.getLogger('shop.analytics')
+
+# -------------------------
+# Post-order tasks
+# -------------------------
+# Queued by checkout.place_order() once the order has committed; they run in
+# the job queue (shop/jobs.py), not in the checkout request.
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').get(id=order_id)
+    recipient = order.email or order.user.email
+    if not recipient:
+        return
+    send_mail(
+        subject=f"Kani Medical - Order #{order.id} confirmed",
+        message=(
+            f"Hi {order.first_name},\n\n"
+            f"We have received your order #{order.id} for ₹{order.total}.\n"
+            f"Payment: {order.payment_method} ({order.payment_status}).\n\n"
+            "Thank you for shopping with Kani Medical!"
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[recipient],
+    )
+
+
+@task
+def record_order_event(order_id):
+    order = Order.objects.get(id=order_id)
+    items = list(order.items.values('product_id', 'quantity', 'price'))
+    analytics_logger.info(json.dumps({
+        'event': 'order_placed',
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'total': str(order.total),
+        'payment_method': order.payment_method,
+        'items': [
+            {'product_id': i['product_id'], 'quantity': i['quantity'], 'price': str(i['price'])}
+            for i in items
+        ],
+    }))
@@ -1,4 +1,8 @@
 from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from shop import images
 
 register = template.Library()
 
@@ -8,3 +12,59 @@ def times(number):
     if not number:
         return range(0)
     return range(number)
+
+
+def _image_name(image):
+    """FieldFile or name -> storage name ('' for empty fields)."""
+    return getattr(image, 'name', image) or ''
+
+
+def _format(fmt=None):
+    """fmt (default: the first modern format) if its copies are generated, else None.
+
+    None picks the original-format copies, which are always generated.
+    """
+    formats = images.modern_formats()
+    if fmt is None:
+        return formats[0] if formats else None
+    return fmt if fmt in formats else None
+
+
+@register.filter
+def srcset(image, fmt=None):
+    """srcset value for an image's derivatives, e.g. {{ product.image|srcset }}.
+
+    Defaults to WebP where it is generated; use srcset:'' for the
+    original-format copies.
+    """
+    return images.srcset(_image_name(image), _format(fmt) if fmt != '' else None)
+
+
+@register.filter
+def image_width(image, width):
+    """URL of an image's derivative closest to width px (the original if none)."""
+    name = _image_name(image)
+    if not name:
+        return ''
+    return images.url_for_width(name, int(width), _format())
+
+
+@register.simple_tag
+def responsive_img(image, alt='', sizes='100vw', css_class='', fallback=''):
+    """<picture> with WebP/original-format srcsets, falling back to the original file."""
+    name = _image_name(image)
+    if not name:
+        return format_html('<img src="{}" alt="{}" class="{}">', fallback, alt, css_class) if fallback else ''
+
+    src = default_storage.url(name)
+    if not images.available_widths(name):
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', src, alt, css_class)
+
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((images.MIME_TYPES[fmt], images.srcset(name, fmt), sizes) for fmt in images.modern_formats()),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        sources, src, images.srcset(name), sizes, alt, css_class,
+    )
@@ -1,3 +1,947 @@
-from django.test import TestCase
+import importlib
+import io
+import re
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve
+from PIL import Image
+
+from . import urls as shop_urls
+from . import (
+    async_views, benchmark, cart_summary, catalog, catalog_io, checkout, guest_cart, images, middleware, payments,
+    ratings, replicas, search, storage, tracking,
+)
+from .fragment_cache import (
+    LocalRedis, LocMemLRUBackend, RedisBackend, bump_version, get_fragment_cache, get_version, set_fragment_cache,
+)
+from .pagination import decode_cursor, encode_cursor, parse_decimal
+from .models import Cart, Category, Job, MediaBlob, Order, OrderStatusEvent, Product, Review
+
+
+def png(width, height=None):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height or width), (38, 151, 246)).save(buffer, format='PNG')
+    return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+
+class ShopTestCase(TestCase):
+    """Fresh caches and a throwaway MEDIA_ROOT for every test."""
+
+    def setUp(self):
+        cache.clear()
+        set_fragment_cache(LocMemLRUBackend())
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVES_MODE='sync')
+        media.enable()
+        self.addCleanup(media.disable)
+        self.category = Category.objects.get_or_create(name='Test Category')[0]
+
+    def make_product(self, image=None, **fields):
+        fields.setdefault('name', 'Thermometer')
+        fields.setdefault('description', 'Digital thermometer')
+        fields.setdefault('price', '100.00')
+        fields.setdefault('stock', 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(category=self.category, image=image or png(40), **fields)
+
+    def make_user(self, username='buyer'):
+        return User.objects.create_user(username, f'{username}@example.com', 'pass-1234')
+
+
+# -------------------------
+# Fragment cache
+# -------------------------
+class RedisBackendTests(TestCase):
+    def test_clear_leaves_other_keys_alone(self):
+        client = LocalRedis()
+        client.set('session:abc', b'1')
+        backend = RedisBackend(client=client, prefix='kani:')
+        for i in range(2500):
+            backend.set(f'pdp:{i}', i)
+        backend.clear()
+        self.assertIsNone(backend.get('pdp:1'))
+        self.assertEqual(client.get('session:abc'), b'1')
+
+
+# -------------------------
+# Media
+# -------------------------
+class ImageDerivativeTests(ShopTestCase):
+    def test_srcset_urls_are_served(self):
+        product = self.make_product(image=png(400))
+        html = Template('{% load custom_tags %}{% responsive_img product.image %}').render(
+            Context({'product': product})
+        )
+        urls = re.findall(r'(/media/\S+) \d+w', html)
+        self.assertTrue(urls, html)
+        response = self.client.get(urls[0])
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    @override_settings(IMAGE_DERIVATIVE_FORMATS=[])
+    def test_filters_without_modern_formats(self):
+        product = self.make_product(image=png(400))
+        html = Template('{% load custom_tags %}{{ product.image|srcset }} {{ product.image|image_width:160 }}').render(
+            Context({'product': product})
+        )
+        urls = re.findall(r'/media/\S+', html)
+        self.assertEqual(len(urls), 3, html)
+        self.assertNotIn('.webp', html)
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            response.close()
+
+    def test_refresh_pages_bumps_the_products_showing_an_image(self):
+        product = self.make_product(image=png(400))
+        other = self.make_product(name='Other', image=png(300))
+        versions = [get_version('product', product.id), get_version('category', self.category.id),
+                    get_version('product', other.id)]
+        self.assertEqual(images.refresh_pages([product.image.name]), 1)
+        self.assertNotEqual(get_version('product', product.id), versions[0])
+        self.assertNotEqual(get_version('category', self.category.id), versions[1])
+        self.assertEqual(get_version('product', other.id), versions[2])
+
+    def test_adopting_legacy_files_refreshes_their_pages(self):
+        product = self.make_product(image=png(400))
+        legacy = 'legacy.png'
+        with open(f'{settings.MEDIA_ROOT}/{legacy}', 'wb') as f:
+            f.write(png(300).read())
+        Product.objects.filter(id=product.id).update(image=legacy)
+        version = get_version('product', product.id)
+        get_fragment_cache().set('unrelated', 1)
+        call_command('gc_media', adopt_legacy=True, stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertTrue(product.image.name.startswith('cas/'))
+        self.assertNotEqual(get_version('product', product.id), version)
+        self.assertEqual(get_fragment_cache().get('unrelated'), 1)
+
+    def test_derivatives_are_not_content_addressed(self):
+        product = self.make_product(image=png(400))
+        name = images.derivative_name(product.image.name, 160)
+        self.assertTrue(name.startswith('derivatives/cas/'))
+        self.assertFalse(MediaBlob.objects.filter(name__startswith='derivatives/').exists())
+        self.assertEqual(MediaBlob.objects.count(), 1)
+
+    def test_small_images_are_not_rescheduled(self):
+        product = self.make_product(image=png(100))
+        self.assertEqual(images.available_widths(product.image.name), [])
+        with mock.patch.object(images, 'schedule') as schedule:
+            product.stock = 3
+            product.save()
+        schedule.assert_not_called()
+
+    def test_missing_derivatives_are_not_cached(self):
+        product = self.make_product(image=png(400))
+        name = product.image.name
+        cache.clear()
+        images.default_storage.delete(images.derivative_name(name, 160))
+        with self.assertLogs('shop.images', 'WARNING'):
+            images._finished(name, [160, 320], None)
+        self.assertEqual(images.available_widths(name), [320])
+
+
+class MediaServingTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.body = bytes(range(100))
+        with open(f'{settings.MEDIA_ROOT}/leaflet.pdf', 'wb') as f:
+            f.write(self.body)
+
+    def get(self, url='/media/leaflet.pdf', **extra):
+        response = self.client.get(url, **extra)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_content_addressed_files_are_cached_forever(self):
+        product = self.make_product(image=png(400))
+        for name in [product.image.name, images.derivative_name(product.image.name, 160)]:
+            response = self.get(f'/media/{name}')
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(response['Cache-Control'], storage.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(self.get()['Cache-Control'], 'public, max-age=3600')
+
+    def test_conditional_requests(self):
+        response = self.get()
+        self.assertEqual(self.content(response), self.body)
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_byte_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(self.content(response), self.body[10:20])
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.content(response), self.body[-5:])
+        response = self.get(HTTP_RANGE='bytes=100-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */100'))
+        # A range of a file that has changed since is answered with all of it
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, self.content(response)), (200, self.body))
+
+    def test_ranges_are_never_compressed(self):
+        with open(f'{settings.MEDIA_ROOT}/leaflet.pdf.gz', 'wb') as f:
+            f.write(b'gzipped')
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Content-Encoding'], response['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertEqual(self.content(response), b'gzipped')
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=0-3')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(self.content(response), self.body[:4])
+
+    def test_only_files_under_media_root(self):
+        self.assertEqual(self.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.get('/media/%2e%2e/manage.py').status_code, 404)
+        self.assertEqual(self.get('/media/products/').status_code, 404)
+        self.assertEqual(self.client.post('/media/leaflet.pdf').status_code, 405)
+
+
+# -------------------------
+# Catalog
+# -------------------------
+class CatalogTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [self.make_product(name=f'Product {i}', price=f'{10 * (i + 1)}.00') for i in range(5)]
+
+    def names(self, **kwargs):
+        return [p.name for p in catalog.get_catalog_page(**kwargs)]
+
+    def test_filters(self):
+        other = Category.objects.create(name='Other')
+        Product.objects.filter(id=self.products[0].id).update(category=other)
+        self.assertEqual(self.names(category=other.id), ['Product 0'])
+        self.assertEqual(self.names(category='Other'), ['Product 0'])
+        self.assertEqual(self.names(sort='low-high', min_price='20', max_price='40'),
+                         ['Product 1', 'Product 2', 'Product 3'])
+
+    def test_bad_filters_are_ignored(self):
+        for query in ('min_price=NaN', 'min_price=Infinity', 'max_price=-inf', 'min_price=sNaN',
+                      'category=99999999999999999999999', 'category=%C2%B2'):
+            with self.subTest(query):
+                self.assertEqual(self.client.get(f'/categories/?{query}').status_code, 200)
+        self.assertEqual(self.names(min_price='NaN'), self.names())
+        self.assertEqual(self.names(category='99999999999999999999999'), [])
+
+    def test_cursor_round_trip(self):
+        pages = []
+        cursor = None
+        while True:
+            page = catalog.get_catalog_page(sort='high-low', cursor=cursor, page_size=2)
+            pages.append([p.name for p in page])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(pages, [['Product 4', 'Product 3'], ['Product 2', 'Product 1'], ['Product 0']])
+
+    def test_malformed_cursors_give_the_first_page(self):
+        first = self.names(sort='low-high', page_size=2)
+        for value, pk in (('NaN', 1), ('sNaN', 1), ('Infinity', 1), ('10', 2 ** 64), ('x', 1)):
+            cursor = encode_cursor(value, pk)
+            with self.subTest(value=value, pk=pk):
+                self.assertIsNone(decode_cursor(cursor, parse_decimal))
+                self.assertEqual(self.names(sort='low-high', cursor=cursor, page_size=2), first)
+                response = self.client.get(f'/categories/?sort=low-high&cursor={cursor}')
+                self.assertEqual(response.status_code, 200)
+
+
+class CatalogImportTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_dir, ignore_errors=True)
+        for name, width in (('front.png', 50), ('side.png', 60), ('back.png', 70)):
+            with open(f'{self.media_dir}/{name}', 'wb') as f:
+                f.write(png(width).read())
+
+    def run_import(self, text, fmt='csv'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return catalog_io.import_catalog(io.StringIO(text), fmt, media_dir=self.media_dir)
+
+    def refcount(self, name):
+        return MediaBlob.objects.get(name=name).refcount
+
+    def import_two(self):
+        importer = self.run_import(
+            'sku,name,category,price,stock,image,images,benefits\n'
+            'TH-1,Thermometer,Health Devices,100,5,front.png,side.png|back.png,Fast|Accurate\n'
+            'BP-1,BP Monitor,Health Devices,900,2,front.png,,\n'
+        )
+        self.assertEqual(importer.errors, [])
+        return Product.objects.get(sku='TH-1'), Product.objects.get(sku='BP-1')
+
+    def test_upsert_on_sku(self):
+        thermometer, monitor = self.import_two()
+        self.assertEqual((thermometer.category.name, str(thermometer.price), thermometer.stock),
+                         ('Health Devices', '100.00', 5))
+        self.assertEqual(list(thermometer.benefits.values_list('title', flat=True)), ['Fast', 'Accurate'])
+        self.assertEqual(thermometer.images.count(), 2)
+        self.assertEqual(self.refcount(thermometer.image.name), 2)
+
+        importer = self.run_import('sku,price,stock\nTH-1,80,5\nNEW-1,10,1\n')
+        self.assertEqual(importer.stats['updated'], 1)
+        self.assertEqual([str(e) for e in importer.errors], ['line 3: new product needs name, category, image'])
+        thermometer.refresh_from_db()
+        self.assertEqual((str(thermometer.price), thermometer.name), ('80.00', 'Thermometer'))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_update_by_id_and_adopt_unskued_product(self):
+        product = self.make_product()
+        importer = self.run_import(f'id,stock\n{product.id},7\n')
+        self.assertEqual(importer.stats['updated'], 1)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.sku), (7, None))
+
+        importer = self.run_import(f'sku,id,price\nTH-9,{product.id},55\n')
+        self.assertEqual((importer.stats['created'], importer.stats['updated']), (0, 1))
+        product.refresh_from_db()
+        self.assertEqual((product.sku, str(product.price)), ('TH-9', '55.00'))
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_empty_list_cells_clear_lists(self):
+        thermometer, _ = self.import_two()
+        gallery = list(thermometer.images.values_list('image', flat=True))
+        self.run_import('sku,images,benefits\nTH-1,,\n')
+        self.assertFalse(thermometer.benefits.exists())
+        self.assertFalse(thermometer.images.exists())
+        for name in gallery:
+            self.assertEqual(self.refcount(name), 0)
+
+    def test_image_change_moves_the_reference(self):
+        thermometer, _ = self.import_two()
+        old = thermometer.image.name
+        self.run_import('sku,image\nTH-1,back.png\n')
+        thermometer.refresh_from_db()
+        self.assertNotEqual(thermometer.image.name, old)
+        # One reference left from BP-1, one more on back.png (also in the gallery)
+        self.assertEqual(self.refcount(old), 1)
+        self.assertEqual(self.refcount(thermometer.image.name), 2)
+
+    def test_export_round_trip_is_unchanged(self):
+        self.import_two()
+        for fmt in catalog_io.FORMATS:
+            with self.subTest(fmt):
+                stream = io.StringIO()
+                catalog_io.WRITERS[fmt](catalog_io.export_rows(), stream)
+                importer = self.run_import(stream.getvalue(), fmt)
+                self.assertEqual(importer.errors, [])
+                self.assertEqual(importer.stats['unchanged'], 2)
+                self.assertEqual(importer.stats['updated'], 0)
+
+    def test_bad_cells_are_row_errors(self):
+        self.import_two()
+        importer = self.run_import(
+            'sku,id,price,stock\n'
+            'TH-1,,NaN,1\n'
+            ',99999999999999999999999,5,1\n'
+            'TH-1,,5,99999999999999999999999\n'
+            'BP-1,,-Infinity,1\n'
+            'BP-1,,850,1\n'
+        )
+        self.assertEqual([e.line for e in importer.errors], [2, 3, 4, 5])
+        self.assertEqual(importer.stats['updated'], 1)
+        self.assertEqual(str(Product.objects.get(sku='BP-1').price), '850.00')
+
+
+# -------------------------
+# Search
+# -------------------------
+class SearchApiTests(ShopTestCase):
+    def test_limit_is_clamped(self):
+        for i in range(3):
+            self.make_product(name=f'Thermometer {i}')
+        for index in ('fts5', 'memory'):
+            with self.subTest(index), mock.patch.object(search, '_index', None), \
+                    mock.patch.object(search, 'fts5_available', return_value=index == 'fts5'):
+                for limit, expected in (('2', 2), ('-5', 1), ('0', 1), ('x', 3)):
+                    response = self.client.get('/api/search/', {'q': 'thermometer', 'limit': limit})
+                    self.assertEqual(len(response.json()['results']), expected, limit)
+
+
+class MemoryIndexTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        for patch in (mock.patch.object(search, 'fts5_available', return_value=False),
+                      mock.patch.object(search, '_index', None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_changes_from_other_workers_are_picked_up(self):
+        product = self.make_product(name='Nebulizer')
+        self.assertEqual(search.search_ids('nebulizer'), [product.id])
+        # Written without this process's signals, as another worker would
+        Product.objects.filter(id=product.id).update(name='Oximeter')
+        bump_version('category', self.category.id)
+        self.assertEqual(search.search_ids('oximeter'), [])
+        with mock.patch.object(search, 'MEMORY_INDEX_TTL', 0):
+            self.assertEqual(search.search_ids('oximeter'), [product.id])
+
+
+# -------------------------
+# Ratings
+# -------------------------
+class RatingTests(ShopTestCase):
+    def test_recompute_counts_only_reviews(self):
+        reviewed = self.make_product()
+        unreviewed = self.make_product(name='Nebulizer', rating=4, rating_count=12)
+        user = self.make_user()
+        Review.objects.bulk_create([Review(product=reviewed, user=user, rating=r) for r in (5, 4, 4)])
+        self.assertEqual(ratings.recompute(), 2)
+        reviewed.refresh_from_db()
+        unreviewed.refresh_from_db()
+        self.assertEqual((reviewed.rating, reviewed.rating_count, reviewed.stars_4), (4, 3, 2))
+        self.assertEqual(str(reviewed.rating_avg), '4.33')
+        self.assertEqual((unreviewed.rating, unreviewed.rating_count, unreviewed.rating_sum), (0, 0, 0))
+
+
+@override_settings(REVIEW_RATE_LIMIT=(2, 3600))
+class ReviewRateLimitTests(ShopTestCase):
+    def post_review(self, product):
+        return self.client.post(f'/products/{product.id}/reviews/', {'rating': 5, 'comment': 'Good'},
+                                headers={'Accept': 'application/json'})
+
+    def test_limit_is_counted_from_stored_reviews(self):
+        product = self.make_product()
+        self.client.force_login(self.make_user())
+        self.assertEqual(self.post_review(product).status_code, 201)
+        self.assertEqual(self.post_review(product).status_code, 201)
+        # Another worker's cache wouldn't have seen those
+        cache.clear()
+        response = self.post_review(product)
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 3600)
+        self.assertEqual(Review.objects.count(), 2)
+
+
+# -------------------------
+# Query budgets
+# -------------------------
+class QueryBudgetTests(ShopTestCase):
+    """Warm pages for a logged-in user; the counts mustn't grow with the catalog or the cart."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.client.force_login(self.user)
+        self.add_products(3)
+
+    def add_products(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = self.make_product(name=f'Product {i}')
+            Cart.objects.create(user=self.user, product=product, quantity=1)
+        self.product = product
+
+    def assertPageQueries(self, scenario, path, expected):
+        self.assertLessEqual(expected, benchmark.QUERY_BUDGETS[scenario])
+        self.assertEqual(self.client.get(path).status_code, 200)
+        with self.assertNumQueries(expected):
+            self.client.get(path)
+        self.add_products(5)
+        self.client.get(path)
+        with self.assertNumQueries(expected):
+            self.client.get(path)
+
+    def test_categories(self):
+        self.assertPageQueries('categories', '/categories/', 3)
+
+    def test_product_detail(self):
+        self.assertPageQueries('product_detail', f'/products/{self.product.id}/', 1)
+
+    def test_cart_page(self):
+        self.assertPageQueries('cart_page', '/cart/', 2)
+
+
+# -------------------------
+# Async views
+# -------------------------
+# The project urlconf keeps the include() of shop.urls made at import time
+@override_settings(IMAGE_DERIVATIVES_MODE='off', ROOT_URLCONF='shop.urls')
+class AsyncViewTests(TransactionTestCase):
+    """The ASGI storefront views; their queries run on other threads, so rows must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        set_fragment_cache(LocMemLRUBackend())
+        with override_settings(ASYNC_VIEWS=True):
+            importlib.reload(shop_urls)
+        self.addCleanup(importlib.reload, shop_urls)
+        clear_url_caches()
+        category = Category.objects.get_or_create(name='Test Category')[0]
+        self.product = Product.objects.create(category=category, name='Nebulizer', description='Compact',
+                                              price='100.00', stock=5, image='products/nebulizer.png')
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'pass-1234')
+        Cart.objects.create(user=self.user, product=self.product, quantity=2)
+
+    def test_urls_use_the_async_views(self):
+        self.assertIs(resolve('/categories/').func, async_views.categories)
+
+    async def test_storefront_pages(self):
+        client = AsyncClient()
+        for path in ('/', '/categories/', f'/products/{self.product.id}/', '/cart/'):
+            response = await client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+        response = await client.get(f'/products/{self.product.id}/')
+        self.assertContains(response, 'Nebulizer')
+        # Cached page: a hit doesn't render again
+        self.assertEqual((await client.get(f'/products/{self.product.id}/')).content, response.content)
+        response = await client.get('/categories/?sort=low-high')
+        self.assertContains(response, 'Nebulizer')
+        self.assertEqual((await client.get('/products/999999/')).status_code, 404)
+
+    async def test_cart_page_for_a_user(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get('/cart/')
+        self.assertContains(response, 'Nebulizer')
+        self.assertContains(response, '200.00')
+
+
+# -------------------------
+# Cart
+# -------------------------
+class CartSummaryTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.client.force_login(self.user)
+        self.product = self.make_product(price='100.00')
+
+    def badge(self):
+        return re.sub(r'\s+', ' ', self.client.get('/cart/badge/').content.decode()).strip()
+
+    def test_badge_is_served_from_the_summary(self):
+        self.client.get(f'/cart/add/{self.product.id}/')
+        self.client.get(f'/cart/add/{self.make_product(name="Mask").id}/')
+        self.assertIn('> 2 <', self.badge())
+        # Only the session's user is loaded, nothing is counted
+        with self.assertNumQueries(1):
+            self.badge()
+
+    def test_add_to_cart_writes_the_summary_through(self):
+        self.client.get(f'/cart/add/{self.product.id}/')
+        self.client.get(f'/cart/add/{self.product.id}/')
+        with self.assertNumQueries(0):
+            summary = cart_summary.get_summary(self.user.id)
+        self.assertEqual(summary, {'item_count': 1, 'quantity': 2, 'subtotal': Decimal('200.00')})
+
+    def test_cart_and_price_changes_invalidate_it(self):
+        Cart.objects.create(user=self.user, product=self.product, quantity=1)
+        self.assertEqual(cart_summary.get_summary(self.user.id)['subtotal'], Decimal('100.00'))
+        self.product.price = '80.00'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(cart_summary.get_summary(self.user.id)['subtotal'], Decimal('80.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Cart.objects.get(user=self.user).delete()
+        self.assertEqual(cart_summary.get_summary(self.user.id), cart_summary.EMPTY_SUMMARY)
+
+
+class GuestCartTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product(price='100.00')
+
+    def add(self, product, **kwargs):
+        return self.client.get(f'/cart/add/{product.id}/', **kwargs)
+
+    def test_guest_cart_stays_in_the_session(self):
+        self.add(self.product)
+        self.add(self.product)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(guest_cart.get_lines(self.client.session), {self.product.id: 2})
+        badge = re.sub(r'\s+', ' ', self.client.get('/cart/badge/').content.decode())
+        self.assertIn('> 2 <', badge)
+        self.assertEqual(self.client.get('/cart/').context['subtotal'], Decimal('200.00'))
+
+    def test_full_cart_refuses_new_products(self):
+        other = self.make_product(name='Mask')
+        with mock.patch.object(guest_cart, 'MAX_LINES', 1):
+            self.add(self.product)
+            response = self.add(other, follow=True)
+            self.add(self.product)
+        self.assertIn('Your cart is full', ' '.join(str(message) for message in response.context['messages']))
+        self.assertEqual(guest_cart.get_lines(self.client.session), {self.product.id: 2})
+
+    def test_login_merges_the_guest_cart(self):
+        user = self.make_user()
+        Cart.objects.create(user=user, product=self.product, quantity=2)
+        self.assertEqual(cart_summary.get_summary(user.id)['quantity'], 2)
+        other, deleted = self.make_product(name='Mask'), self.make_product(name='Gloves')
+        for product in [self.product, other, deleted]:
+            self.add(product)
+        deleted.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/login/', {'username': 'buyer', 'password': 'pass-1234'})
+        rows = dict(Cart.objects.filter(user=user).values_list('product_id', 'quantity'))
+        self.assertEqual(rows, {self.product.id: 3, other.id: 1})
+        self.assertEqual(guest_cart.get_lines(self.client.session), {})
+        self.assertEqual(cart_summary.get_summary(user.id)['quantity'], 4)
+
+
+# -------------------------
+# Checkout
+# -------------------------
+ORDER_FIELDS = {
+    'first_name': 'Asha', 'last_name': 'K', 'email': 'buyer@example.com', 'phone': '9999999999',
+    'address': '1 Main Road',
+}
+
+
+@override_settings(JOB_QUEUE_MODE='db')
+class CheckoutTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.product = self.make_product(stock=5)
+        Cart.objects.create(user=self.user, product=self.product, quantity=2)
+
+    def test_order_takes_stock_and_clears_cart(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = checkout.place_order(self.user, **ORDER_FIELDS)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')), [(self.product.id, 2)])
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_caches_are_refreshed_without_a_job_worker(self):
+        version = get_version('product', self.product.id)
+        self.assertEqual(cart_summary.get_summary(self.user.id)['quantity'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout.place_order(self.user, **ORDER_FIELDS)
+        # Nothing has run the queued jobs
+        self.assertTrue(Job.objects.filter(status='queued').exists())
+        self.assertNotEqual(get_version('product', self.product.id), version)
+        self.assertEqual(cart_summary.get_summary(self.user.id)['quantity'], 0)
+
+    def test_same_cart_cannot_be_ordered_twice(self):
+        # Both submits read the cart before either one committed
+        stale_cart = checkout.price_cart(self.user)
+        with mock.patch.object(checkout, 'price_cart', return_value=stale_cart):
+            checkout.place_order(self.user, **ORDER_FIELDS)
+            with self.assertRaises(checkout.EmptyCartError):
+                checkout.place_order(self.user, **ORDER_FIELDS)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_payment_is_used_once(self):
+        payment_order = {'order_id': 'order_1'}
+        fields = {**ORDER_FIELDS, 'razorpay_order_id': 'order_1', 'payment_status': 'Paid'}
+        with mock.patch.object(payments, 'matches_cart', return_value=True):
+            checkout.place_order(self.user, payment_order=payment_order, **fields)
+            Cart.objects.create(user=self.user, product=self.product, quantity=1)
+            with self.assertRaises(checkout.PaymentMismatchError):
+                checkout.place_order(self.user, payment_order=payment_order, **fields)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(Order.objects.count(), 1)
+        # Cash on Delivery orders have no payment id
+        checkout.place_order(self.user, **ORDER_FIELDS)
+        self.assertEqual(Order.objects.filter(razorpay_order_id=None).count(), 1)
+
+    def test_out_of_stock_writes_nothing(self):
+        Cart.objects.filter(user=self.user).update(quantity=6)
+        with self.assertRaises(checkout.OutOfStockError):
+            checkout.place_order(self.user, **ORDER_FIELDS)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(user=self.user).exists())
+
+
+class OnlinePaymentTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gateway = payments.FakeGateway()
+        payments.set_gateway(self.gateway)
+        self.addCleanup(payments.set_gateway, None)
+        self.user = self.make_user()
+        self.product = self.make_product(stock=10)
+        Cart.objects.create(user=self.user, product=self.product, quantity=1)
+        self.client.force_login(self.user)
+
+    def start_payment(self):
+        return self.client.post('/cart/pay/').json()['order_id']
+
+    def pay(self, order_id, payment_id='pay_1'):
+        return self.client.post('/checkout/', {
+            **ORDER_FIELDS,
+            'razorpay_order_id': order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': self.gateway.sign(order_id, payment_id),
+        })
+
+    def test_paid_checkout(self):
+        order_id = self.start_payment()
+        self.pay(order_id)
+        order = Order.objects.get()
+        self.assertEqual((order.payment_status, order.razorpay_order_id), ('Paid', order_id))
+        self.assertNotIn(payments.SESSION_KEY, self.client.session)
+
+    def test_payment_cannot_be_replayed(self):
+        order_id = self.start_payment()
+        cookies = self.client.cookies.output()
+        self.pay(order_id)
+        # Same cart again, and the session cookie from before the order
+        Cart.objects.create(user=self.user, product=self.product, quantity=1)
+        self.client.cookies.load(cookies.replace('Set-Cookie: ', ''))
+        with self.assertLogs('shop.views', 'WARNING'):
+            self.pay(order_id)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_payment_for_another_order_is_rejected(self):
+        self.start_payment()
+        other = self.gateway.create_order(100)
+        self.pay(other)
+        self.assertFalse(Order.objects.exists())
+
+    def test_cart_changed_after_payment_started(self):
+        order_id = self.start_payment()
+        Cart.objects.filter(user=self.user).update(quantity=5)
+        with self.assertLogs('shop.views', 'WARNING'):
+            self.pay(order_id)
+        self.assertFalse(Order.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+
+class OrderTrackingTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.order = self.make_order()
+
+    def make_order(self, **fields):
+        fields.setdefault('user', self.user)
+        return Order.objects.create(**{**ORDER_FIELDS, **fields})
+
+    def statuses(self, order):
+        return list(order.status_events.order_by('id').values_list('status', flat=True))
+
+    def test_guest_lookup_needs_the_order_email(self):
+        response = self.client.post('/track/', {'order_id': self.order.id, 'email': ' Buyer@Example.com '})
+        self.assertEqual(response.context['order'], self.order)
+        response = self.client.post('/track/', {'order_id': self.order.id, 'email': 'someone@example.com'})
+        self.assertIsNone(response.context['order'])
+        self.assertTrue(response.context['error'])
+
+    def test_owner_sees_order_without_email(self):
+        self.assertIsNone(self.client.get(f'/track/{self.order.id}/').context['order'])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/track/{self.order.id}/').context['order'], self.order)
+        self.client.force_login(self.make_user('other'))
+        self.assertIsNone(self.client.get(f'/track/{self.order.id}/').context['order'])
+
+    def test_status_changes_are_recorded(self):
+        tracking.set_status(self.order, 'shipped', note='Courier picked up')
+        self.order.save()
+        self.assertEqual(self.statuses(self.order), ['placed', 'shipped'])
+        self.assertEqual(self.order.status_events.last().note, 'Courier picked up')
+        steps = tracking.timeline(self.order)
+        self.assertEqual([step['done'] for step in steps], [True, True, False])
+        self.assertIsNone(steps[2]['at'])
+
+    def test_bulk_status_moves_allowed_orders_only(self):
+        delivered = self.make_order()
+        tracking.set_status(delivered, 'shipped')
+        tracking.set_status(delivered, 'delivered')
+        moved = tracking.bulk_set_status(Order.objects.all(), 'cancelled', note='Stock recall')
+        self.assertEqual(moved, 1)
+        self.order.refresh_from_db()
+        delivered.refresh_from_db()
+        self.assertEqual((self.order.status, delivered.status), ('cancelled', 'delivered'))
+        self.assertEqual(self.statuses(self.order), ['placed', 'cancelled'])
+        self.assertEqual(OrderStatusEvent.objects.filter(status='cancelled').get().note, 'Stock recall')
+        self.assertEqual(tracking.bulk_set_status(Order.objects.all(), 'cancelled'), 0)
+        self.assertEqual([step['status'] for step in tracking.timeline(self.order)], ['placed', 'cancelled'])
+
+    def test_history_api_pages_newest_first(self):
+        orders = [self.order] + [self.make_order() for _ in range(tracking.HISTORY_PAGE_SIZE)]
+        self.make_order(user=self.make_user('other'))
+        self.client.force_login(self.user)
+        first = self.client.get('/api/orders/').json()
+        second = self.client.get('/api/orders/', {'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(first['results']), tracking.HISTORY_PAGE_SIZE)
+        ids = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, [order.id for order in reversed(orders)])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(first['results'][0]['url'], f'/track/{orders[-1].id}/')
+
+
+# -------------------------
+# Page cache
+# -------------------------
+class PageCacheTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+
+    def test_conditional_get_and_hits_skip_the_view(self):
+        first = self.client.get('/categories/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        with self.assertNumQueries(0):
+            again = self.client.get('/categories/?utm_source=mail')
+        self.assertEqual(again.content, first.content)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/categories/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_catalog_change_changes_the_etag(self):
+        etag = self.client.get(f'/products/{self.product.id}/')['ETag']
+        self.product.price = '90.00'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response = self.client.get(f'/products/{self.product.id}/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_logged_in_pages_are_private(self):
+        self.client.force_login(self.make_user())
+        response = self.client.get('/categories/')
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_cached_pages_are_rendered_from_the_primary(self):
+        decisions = []
+        original = replicas.ReplicaRouter.db_for_read
+
+        def db_for_read(router, model, **hints):
+            decisions.append(original(router, model, **hints))
+            # There is no replica database in tests
+            return DEFAULT_DB_ALIAS
+
+        # TestCase runs every test inside a transaction, which pins reads
+        outside_transaction = {DEFAULT_DB_ALIAS: mock.Mock(in_atomic_block=False)}
+        with mock.patch.object(replicas, 'replica_aliases', return_value=['replica_1']), \
+                mock.patch.object(replicas.health, 'usable', return_value=['replica_1']), \
+                mock.patch.object(replicas, 'connections', outside_transaction), \
+                mock.patch.object(replicas.ReplicaRouter, 'db_for_read', db_for_read):
+            self.assertEqual(self.client.get('/categories/').status_code, 200)
+            self.assertTrue(decisions)
+            self.assertNotIn('replica_1', decisions)
+            # Private pages can still read from replicas
+            decisions.clear()
+            self.client.force_login(self.make_user())
+            self.client.get('/categories/')
+            self.assertIn('replica_1', decisions)
+
+
+# -------------------------
+# Replicas
+# -------------------------
+class ReplicaRoutingTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = replicas.ReplicaRouter()
+        # TestCase runs every test inside a transaction, which pins reads
+        self.connections = {
+            DEFAULT_DB_ALIAS: mock.Mock(in_atomic_block=False),
+            'replica_1': mock.Mock(alias='replica_1'),
+            'replica_2': mock.Mock(alias='replica_2'),
+        }
+        patches = [
+            mock.patch.object(replicas, 'replica_aliases', return_value=['replica_1']),
+            mock.patch.object(replicas.health, 'usable', return_value=['replica_1']),
+            mock.patch.object(replicas, 'connections', self.connections),
+        ]
+        self.aliases, self.usable, _ = [patch.start() for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def read(self, model=Product):
+        return self.router.db_for_read(model)
+
+    def request(self, method='GET', cookies=None, view=lambda: None):
+        """Runs view behind ReplicaMiddleware; returns (response, databases read before and after it)."""
+        reads = []
+
+        def get_response(request):
+            reads.append(self.read())
+            view()
+            reads.append(self.read())
+            return HttpResponse()
+
+        request = RequestFactory().generic(method, '/')
+        request.COOKIES.update(cookies or {})
+        return middleware.ReplicaMiddleware(get_response)(request), reads
+
+    def test_catalog_reads_in_requests_go_to_a_replica(self):
+        self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+        response, reads = self.request()
+        self.assertEqual(reads, ['replica_1', 'replica_1'])
+        self.assertFalse(response.cookies)
+
+        state, token = replicas.begin_request()
+        try:
+            self.assertEqual(self.read(Order), DEFAULT_DB_ALIAS)
+            with replicas.primary():
+                self.assertEqual(self.read(), DEFAULT_DB_ALIAS)
+            self.assertEqual(self.read(), 'replica_1')
+        finally:
+            replicas.end_request(token)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response, reads = self.request(view=lambda: self.router.db_for_write(Product))
+        self.assertEqual(reads, ['replica_1', DEFAULT_DB_ALIAS])
+        cookie_name = replicas.setting('COOKIE_NAME')
+        cookie = response.cookies[cookie_name]
+        self.assertEqual(cookie['max-age'], replicas.setting('STICKY_SECONDS'))
+        self.assertTrue(cookie['httponly'])
+        # The next requests while the cookie lasts, and any unsafe method
+        self.assertEqual(self.request(cookies={cookie_name: '1'})[1], [DEFAULT_DB_ALIAS] * 2)
+        self.assertEqual(self.request('POST')[1], [DEFAULT_DB_ALIAS] * 2)
+
+    def test_lagging_replicas_fall_back_to_the_primary(self):
+        self.usable.return_value = []
+        self.assertEqual(self.request()[1], [DEFAULT_DB_ALIAS] * 2)
+
+    def test_lag_is_measured_at_most_every_interval(self):
+        self.aliases.return_value = ['replica_1', 'replica_2']
+        lags = {'replica_1': 1.0, 'replica_2': replicas.setting('MAX_LAG') + 1}
+        health = replicas.ReplicaHealth()
+        with mock.patch.object(replicas, 'measure_lag', side_effect=lambda conn: lags[conn.alias]) as measure, \
+                mock.patch.object(replicas.time, 'monotonic', return_value=1000.0) as clock:
+            self.assertEqual(health.usable(), ['replica_1'])
+            lags['replica_1'] = None
+            self.assertEqual(health.usable(), ['replica_1'])
+            self.assertEqual(measure.call_count, 2)
+            # Unknown lag counts as too far behind
+            clock.return_value += replicas.setting('CHECK_INTERVAL')
+            self.assertEqual(health.usable(), [])
+            measure.side_effect = DatabaseError
+            lags['replica_1'] = 1.0
+            clock.return_value += replicas.setting('CHECK_INTERVAL')
+            self.assertEqual(health.usable(), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'the heartbeat table is for simulated SQLite replicas')
+    def test_sqlite_lag_comes_from_the_heartbeat(self):
+        with self.assertRaises(DatabaseError):
+            replicas.measure_lag(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {replicas.HEARTBEAT_TABLE} (id INTEGER PRIMARY KEY, synced_at REAL)")
+            cursor.execute(
+                f"INSERT INTO {replicas.HEARTBEAT_TABLE} (id, synced_at) VALUES (1, %s)", [time.time() - 30],
+            )
+        self.assertAlmostEqual(replicas.measure_lag(connection), 30, delta=5)
@@ -0,0 +1,108 @@
+from django.db import transaction
+
+from .models import ORDER_STATUS, Order, OrderStatusEvent
+from .pagination import paginate, parse_timestamp
+
+# -------------------------
+# Order lookup & tracking
+# -------------------------
+# Orders are found by (id, email) or by user, both served by indexes on
+# Order, and every status change is appended to OrderStatusEvent so the
+# tracking page reads the timeline instead of guessing it from one column.
+
+HISTORY_PAGE_SIZE = 20
+
+# Steps shown on the tracking page, in order
+TRACKING_STEPS = [status for status, label in ORDER_STATUS if status != 'cancelled']
+STATUS_LABELS = dict(ORDER_STATUS)
+
+# Statuses an order may move to, and the statuses it may move from
+TRANSITIONS = {
+    'shipped': ['placed'],
+    'delivered': ['shipped'],
+    'cancelled': ['placed', 'shipped'],
+}
+
+
+def normalize_email(email):
+    """Emails are stored lower-cased so lookups can use the index directly."""
+    return (email or '').strip().lower()
+
+
+def find_order(order_id, email):
+    """Returns the order with this id placed with this email, or None."""
+    email = normalize_email(email)
+    if not email:
+        return None
+    return Order.objects.filter(id=order_id, email=email).first()
+
+
+def user_owns(user, order):
+    return user.is_authenticated and order.user_id == user.id
+
+
+def order_history(user, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """Returns (orders, next_cursor) for user, newest first."""
+    qs = Order.objects.filter(user=user).only(
+        'id', 'user_id', 'total', 'status', 'payment_method', 'payment_status', 'created_at',
+    )
+    return paginate(qs, 'created_at', cursor, descending=True, page_size=page_size,
+                    parse=parse_timestamp)
+
+
+def record_status(order, note=''):
+    """Appends order's current status to its timeline (called from signals)."""
+    return OrderStatusEvent.objects.create(order=order, status=order.status, note=note)
+
+
+def set_status(order, status, note=''):
+    """Changes an order's status; the post_save signal records the event."""
+    order.status = status
+    order._status_note = note
+    order.save(update_fields=['status'])
+
+
+def bulk_set_status(queryset, status, note=''):
+    """Moves every order in queryset that may go to status; returns how many moved.
+
+    One UPDATE for the orders and one INSERT for their timeline events, so
+    the post_save signal doesn't run and the events are written here.
+    """
+    with transaction.atomic():
+        ids = list(
+            queryset.filter(status__in=TRANSITIONS[status]).select_for_update()
+            .values_list('id', flat=True)
+        )
+        if not ids:
+            return 0
+        Order.objects.filter(id__in=ids).update(status=status)
+        OrderStatusEvent.objects.bulk_create(
+            [OrderStatusEvent(order_id=order_id, status=status, note=note) for order_id in ids],
+        )
+    return len(ids)
+
+
+def timeline(order):
+    """Returns the tracking steps for order as dicts with label/done/at."""
+    events = list(order.status_events.all())
+    reached = {}
+    for event in events:
+        reached.setdefault(event.status, event.created_at)
+    if not events:
+        # Orders placed before the timeline existed
+        reached[order.status] = order.created_at
+
+    if order.status == 'cancelled':
+        steps = [s for s in TRACKING_STEPS if s in reached] + ['cancelled']
+    else:
+        steps = TRACKING_STEPS
+    current = steps.index(order.status) if order.status in steps else 0
+    return [
+        {
+            'status': status,
+            'label': STATUS_LABELS[status],
+            'done': index <= current,
+            'at': reached.get(status),
+        }
+        for index, status in enumerate(steps)
+    ]
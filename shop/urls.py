@@ -1,10 +1,15 @@
 from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
 from . import views
 
+# Read-heavy storefront pages get their async versions under ASGI
+if settings.ASYNC_VIEWS:
+    from . import async_views as storefront
+else:
+    storefront = views
+
 urlpatterns = [
-    path('', views.home, name='home'),
+    path('', storefront.home, name='home'),
     path('about/', views.about_page, name='About'),
     path('contact/', views.contact_page, name='Contact'),
     path('contact/submit/', views.contact_page, name='contact_submit'),
@@ -15,21 +20,31 @@ urlpatterns = [
 
     # Cart
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/', views.cart_page, name='cart_page'),
+    path('cart/', storefront.cart_page, name='cart_page'),
+    path('cart/badge/', views.cart_badge, name='cart_badge'),
+    path('cart/pay/', views.start_payment, name='start_payment'),
 
     # Checkout
     path('checkout/', views.checkout_page, name='checkout_page'),
     path('order-success/<int:order_id>/', views.order_success, name='order_success'),
 
     # Order Tracking
+    path('track/', views.track_order, name='track_order_lookup'),
     path('track/<int:order_id>/', views.track_order, name='track_order'),
+    path('api/orders/', views.order_history_api, name='order_history_api'),
 
     # Products
-    path('products/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('products/<int:product_id>/', storefront.product_detail, name='product_detail'),
+    path('products/<int:product_id>/reviews/', views.submit_review, name='submit_review'),
+    path('api/products/<int:product_id>/reviews/', views.review_list_api, name='review_list_api'),
 
     # Categories
-    path('categories/', views.categories, name='categories'),
-]
+    path('categories/', storefront.categories, name='categories'),
 
-# Serve media files even when DEBUG = False (Render deploy)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Search
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/search/autocomplete/', views.autocomplete_api, name='autocomplete_api'),
+
+    # Monitoring
+    path('metrics/', views.metrics, name='metrics'),
+]
@@ -1,18 +1,26 @@
 from django.shortcuts import render, get_object_or_404, redirect 
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.template.loader import render_to_string
 from django.contrib.auth import login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_POST
+from django.http import HttpResponse, JsonResponse
 from datetime import timedelta, date
-from decimal import Decimal
 from django.conf import settings
+import hmac
 import os
 import logging
 
 from .models import Product, Cart, Category, Order
-from .forms import SignupForm, LoginForm
-import razorpay
-from django.conf import settings
-
+from .forms import SignupForm, LoginForm, OrderTrackForm, ReviewForm
+from .catalog import get_catalog_page, DEFAULT_SORT
+from . import search, cart_summary, guest_cart, payments, profiling, checkout, replicas, reviews, tracking
+from .page_cache import cached_page
+from .fragment_cache import get_fragment_cache, get_version
+from .pricing import price_cart
 
 
 # Initialize logger
@@ -21,25 +29,19 @@ logger = logging.getLogger(__name__)
 # -------------------------
 # Home / Product Listing
 # -------------------------
+@cached_page()
 def home(request):
     hero_image = None
     if os.path.exists(os.path.join(settings.MEDIA_ROOT, "image1.png")):
         hero_image = {"url": settings.MEDIA_URL + "image1.png"}
 
-    cart_items_count = 0
-    if request.user.is_authenticated:
-        cart_items_count = Cart.objects.filter(user=request.user).count()
-    else:
-        cart = request.session.get('cart', {})
-        for item in cart.values():
-            cart_items_count += item.get('quantity', 0)
-
+    # cart_items_count comes from the cart_count context processor
     context = {
         "hero_image": hero_image,
-        "cart_items_count": cart_items_count
     }
     return render(request, "shop/home.html", context)
 
+@cached_page()
 def about_page(request):
     return render(request, 'shop/about.html')
 
@@ -90,8 +92,14 @@ def login_view(request):
         form = LoginForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
+            # A guest cart in the session is merged on the user_logged_in signal
             login(request, user)
             messages.success(request, f'Welcome {user.username}!')
+            next_url = request.POST.get('next') or request.GET.get('next')
+            if next_url and url_has_allowed_host_and_scheme(
+                next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure(),
+            ):
+                return redirect(next_url)
             return redirect('home')
     else:
         form = LoginForm()
@@ -110,165 +118,394 @@ def logout_view(request):
 # -------------------------
 # Categories
 # -------------------------
-def categories(request):
-    all_categories = Category.objects.all()
-    all_products = Product.objects.all()
-    context = {
+def _catalog_params(request):
+    return {
+        'category': request.GET.get('category', ''),
+        'sort': request.GET.get('sort', DEFAULT_SORT),
+        'cursor': request.GET.get('cursor'),
+        'min_price': request.GET.get('min_price'),
+        'max_price': request.GET.get('max_price'),
+        'featured': request.GET.get('featured') == '1',
+    }
+
+
+def _categories_context(request, all_categories, page):
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+
+    return {
         'categories': all_categories,
-        'products': all_products,
+        'products': page.products,
+        'page': page,
+        'selected_category': request.GET.get('category', ''),
+        'sort': page.sort,
+        'next_query': next_query,
     }
+
+
+# Every product and category can show up on it
+def _categories_versions(request):
+    return [get_version('catalog', 0)]
+
+
+CATALOG_PARAMS = ('category', 'sort', 'cursor', 'min_price', 'max_price', 'featured')
+
+
+@cached_page(_categories_versions, params=CATALOG_PARAMS)
+def categories(request):
+    all_categories = Category.objects.only('id', 'name').order_by('name')
+    page = get_catalog_page(**_catalog_params(request))
+    context = _categories_context(request, all_categories, page)
     return render(request, 'shop/categories.html', context)
 
 
+# -------------------------
+# Search API
+# -------------------------
+def _product_json(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'category': product.category.name,
+        'price': str(product.price),
+        'final_price': str(product.final_price),
+        'image': product.image.url if product.image else None,
+        'url': reverse('product_detail', args=[product.id]),
+    }
+
+
+def search_api(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    products = search.search_products(query, limit) if query else []
+    return JsonResponse({
+        'query': query,
+        'results': [_product_json(p) for p in products],
+    })
+
+
+def autocomplete_api(request):
+    query = request.GET.get('q', '').strip()
+    ids = search.autocomplete_ids(query) if query else []
+    names = dict(Product.objects.filter(id__in=ids).values_list('id', 'name'))
+    return JsonResponse({
+        'query': query,
+        'suggestions': [{'id': i, 'name': names[i]} for i in ids if i in names],
+    })
+
+
 # -------------------------
 # Product Detail
 # -------------------------
+def _product_key(product_id):
+    version = get_version('product', product_id)
+    return f'pdp:{product_id}:v{version}', version
+
+
+def _related_key(product_id, version, category_id):
+    return f'pdp-related:{product_id}:v{version}:c{get_version("category", category_id)}'
+
+
+RELATED_FIELDS = ('id', 'name', 'price', 'image')
+
+
+def _related_products(product, limit=4):
+    """Precomputed recommendations (manage.py build_related_products).
+
+    Falls back to category siblings for products the recommender hasn't
+    seen yet.
+    """
+    related = list(
+        Product.objects.filter(recommended_for__product_id=product.id)
+        .order_by('recommended_for__rank')
+        .only(*RELATED_FIELDS)[:limit]
+    )
+    if not related:
+        related = list(
+            Product.objects.filter(category_id=product.category_id)
+            .exclude(id=product.id)
+            .only(*RELATED_FIELDS)[:limit]
+        )
+    return related
+
+
+def _product_data(product, thumbnails):
+    return {
+        'product': product,
+        'gallery': render_to_string('shop/partials/product_gallery.html', {
+            'thumbnails': thumbnails,
+        }),
+        'benefits': render_to_string('shop/partials/product_benefits.html', {
+            'product': product,
+        }),
+    }
+
+
+def _related_fragment(related_products):
+    return render_to_string('shop/partials/related_products.html', {
+        'related_products': related_products,
+    })
+
+
+def _product_fragments(product_id):
+    """Product plus its rendered gallery/benefits/related fragments.
+
+    Everything is cached under the product's (and its category's) version, so
+    a warm product page needs no database queries at all.
+    """
+    cache = get_fragment_cache()
+    key, version = _product_key(product_id)
+    data = cache.get(key)
+    if data is None:
+        # Cached under the current version, so not from a lagging replica
+        with replicas.primary():
+            product = get_object_or_404(Product.objects.select_related('category').prefetch_related('benefits'),
+                                        id=product_id)
+            data = _product_data(product, list(product.thumbnails.all()))
+        cache.set(key, data)
+
+    product = data['product']
+    related_key = _related_key(product_id, version, product.category_id)
+    related = cache.get(related_key)
+    if related is None:
+        with replicas.primary():
+            related = _related_fragment(_related_products(product))
+        cache.set(related_key, related)
+
+    fragments = {
+        'gallery': data['gallery'],
+        'benefits': data['benefits'],
+        'related': related,
+    }
+    return product, fragments
+
+
+def _product_page_versions(request, product_id):
+    """Versions behind a product page; None for products that don't exist."""
+    data = get_fragment_cache().get(_product_key(product_id)[0])
+    if data is not None:
+        category_id = data['product'].category_id
+    else:
+        category_id = Product.objects.filter(id=product_id).values_list('category_id', flat=True).first()
+        if category_id is None:
+            return None
+    return [
+        get_version('product', product_id),
+        # Related products fall back to the category's
+        get_version('category', category_id),
+        get_version('reviews', product_id),
+    ]
+
+
+PRODUCT_PARAMS = ('from_category',)
+
+
+@cached_page(_product_page_versions, params=PRODUCT_PARAMS)
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    related_products = Product.objects.filter(category=product.category).exclude(id=product_id)[:4]
+    product, fragments = _product_fragments(product_id)
     from_category = request.GET.get('from_category') == '1'
 
     context = {
         'product': product,
-        'related_products': related_products,
+        'fragments': fragments,
         'from_category': from_category,
+        'reviews_page': reviews.first_page(product_id),
     }
     return render(request, 'shop/product_detail.html', context)
 
 
 # -------------------------
-# Add to Cart
+# Reviews
 # -------------------------
+def review_list_api(request, product_id):
+    """Reviews for a product, newest first; pass next_cursor back as ?cursor=."""
+    return JsonResponse(reviews.get_page(product_id, cursor=request.GET.get('cursor')))
+
+
 @login_required
+@require_POST
+def submit_review(request, product_id):
+    product = get_object_or_404(Product.objects.only('id'), id=product_id)
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    form = ReviewForm(request.POST)
+
+    if not form.is_valid():
+        if wants_json:
+            return JsonResponse({'errors': form.errors}, status=400)
+        messages.error(request, "Please give a rating from 1 to 5.")
+    else:
+        try:
+            review = reviews.submit(request.user, product, form)
+        except reviews.RateLimited as exc:
+            if wants_json:
+                return JsonResponse({'error': str(exc)}, status=429,
+                                    headers={'Retry-After': str(exc.retry_after)})
+            messages.error(request, str(exc))
+        else:
+            if wants_json:
+                return JsonResponse(reviews.serialize(review), status=201)
+            messages.success(request, "Thanks for your review!")
+
+    return redirect(reverse('product_detail', args=[product_id]) + '#reviews')
+
+
+# -------------------------
+# Add to Cart
+# -------------------------
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    cart_item, created = Cart.objects.get_or_create(user=request.user, product=product)
-    if not created:
-        cart_item.quantity += 1
-        cart_item.save()
+    product = get_object_or_404(Product.objects.only('id', 'name'), id=product_id)
+    if not request.user.is_authenticated:
+        # Guests: kept in the session only, no database write
+        if not guest_cart.add(request.session, product.id):
+            messages.error(request, "Your cart is full. Please log in to add more products.")
+            return redirect('cart_page')
+    else:
+        cart_item, created = Cart.objects.get_or_create(user=request.user, product=product)
+        if not created:
+            cart_item.quantity += 1
+            cart_item.save()
+        cart_summary.refresh(request.user.id)
     messages.success(request, f"{product.name} has been added to your cart!")
     return redirect('cart_page')
 
 
 # -------------------------
-# Cart Page
+# Cart badge
 # -------------------------
-from decimal import Decimal
-import razorpay
-from django.conf import settings
+@never_cache
+def cart_badge(request):
+    """The navbar cart count, for pages from the page cache (shop/page_cache.py)."""
+    return render(request, 'shop/partials/cart_badge.html')
 
-@login_required
+
+# -------------------------
+# Cart Page
+# -------------------------
 def cart_page(request):
-    cart_items = Cart.objects.filter(user=request.user)
-    subtotal = discount = total = Decimal('0.00')
-
-    # Calculate subtotal, discount, total
-    for item in cart_items:
-        price = item.product.price
-        final_price = item.product.final_price
-        subtotal += Decimal(price) * item.quantity
-        discount += (Decimal(price) - Decimal(final_price)) * item.quantity
-
-    total = subtotal - discount
-
-    # Razorpay minimum amount check
-    total_amount = int(total * 100)
-    if total_amount < 100:
-        total_amount = 100  # Minimum ₹1 in paise
-
-    # Create Razorpay order
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-    razorpay_order = client.order.create({
-        "amount": total_amount,
-        "currency": "INR",
-        "payment_capture": 1
-    })
+    if request.user.is_authenticated:
+        cart = price_cart(request.user)
+    else:
+        cart = guest_cart.price_guest_cart(request.session)
+    total = cart.total
 
+    # The Razorpay order is created by start_payment when the user clicks Pay
     context = {
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'discount': discount,
+        'cart_items': cart.items,
+        'subtotal': cart.subtotal,
+        'discount': cart.discount,
         'total': total,
-        'razorpay_order_id': razorpay_order['id'],
-        'razorpay_key_id': settings.RAZORPAY_KEY_ID,
+        'razorpay_key_id': payments.get_gateway().key_id,
     }
     return render(request, 'shop/cart.html', context)
 
 
 # -------------------------
-# Checkout Page (Dummy Payment)
+# Start Online Payment
 # -------------------------
 @login_required
-def checkout_page(request):
-    cart_items = Cart.objects.filter(user=request.user)
-    subtotal = discount = total = Decimal('0.00')
-
-    # Calculate totals
-    for item in cart_items:
-        price = item.product.price
-        final_price = item.product.final_price
-        subtotal += Decimal(price) * item.quantity
-        discount += (Decimal(price) - Decimal(final_price)) * item.quantity
+@require_POST
+def start_payment(request):
+    cart = price_cart(request.user)
+    if cart.is_empty:
+        return JsonResponse({'error': 'Your cart is empty.'}, status=400)
+    try:
+        payment_order = payments.get_or_create_order(request.session, cart)
+    except Exception:
+        logger.exception("Payment order creation failed for user %s", request.user.id)
+        return JsonResponse({'error': 'Could not start payment. Try again!'}, status=502)
+    return JsonResponse({
+        'order_id': payment_order['order_id'],
+        'amount': payment_order['amount'],
+        'currency': payment_order['currency'],
+        'key': payments.get_gateway().key_id,
+    })
 
-    total = subtotal - discount
 
+# -------------------------
+# Checkout Page (Dummy Payment)
+# -------------------------
+@login_required
+def checkout_page(request):
     if request.method == "POST":
         first_name = request.POST.get("first_name")
         last_name = request.POST.get("last_name")
+        email = tracking.normalize_email(request.POST.get("email") or request.user.email)
         phone = request.POST.get("phone")
         address = request.POST.get("address")
         payment_method = request.POST.get("payment_method")
 
         # Handle Razorpay payment verification
+        payment_order = None
         if "razorpay_payment_id" in request.POST:
             razorpay_payment_id = request.POST.get("razorpay_payment_id")
             razorpay_order_id = request.POST.get("razorpay_order_id")
             razorpay_signature = request.POST.get("razorpay_signature")
 
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-            params_dict = {
-                'razorpay_order_id': razorpay_order_id,
-                'razorpay_payment_id': razorpay_payment_id,
-                'razorpay_signature': razorpay_signature
-            }
-
             try:
-                # Verify the payment signature
-                client.utility.verify_payment_signature(params_dict)
+                # The order start_payment created for this session...
+                payment_order = payments.session_order(request.session, razorpay_order_id)
+                # ...and a valid signature for it
+                payments.get_gateway().verify_payment(
+                    razorpay_order_id, razorpay_payment_id, razorpay_signature
+                )
                 payment_status = "Paid"
                 payment_method = "Paid Online"
-            except razorpay.errors.SignatureVerificationError:
+            except payments.PaymentVerificationError:
                 messages.error(request, "Payment verification failed. Try again!")
                 return redirect("cart_page")
         else:
             # Cash on Delivery
             payment_status = "Pending"
             payment_method = "Cash on Delivery"
+            razorpay_order_id = razorpay_payment_id = razorpay_signature = None
 
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            first_name=first_name,
-            last_name=last_name,
-            phone=phone,
-            address=address,
-            payment_method=payment_method,
-            payment_status=payment_status,
-            total=total,
-        )
-
-        # Optionally, save cart items to order items
-        # Clear the cart
-        cart_items.delete()
+        # Create order, order items and take stock in one transaction
+        try:
+            order = checkout.place_order(
+                request.user,
+                payment_order=payment_order,
+                first_name=first_name,
+                last_name=last_name,
+                email=email,
+                phone=phone,
+                address=address,
+                payment_method=payment_method,
+                payment_status=payment_status,
+                razorpay_order_id=razorpay_order_id,
+                razorpay_payment_id=razorpay_payment_id,
+                razorpay_signature=razorpay_signature,
+            )
+        except checkout.EmptyCartError:
+            messages.error(request, "Your cart is empty.")
+            return redirect("cart_page")
+        except checkout.PaymentMismatchError as exc:
+            logger.warning("Rejected payment %s for user %s: %s", razorpay_order_id, request.user.id, exc)
+            messages.error(request, f"Sorry, {exc}")
+            payments.clear_order(request.session)
+            return redirect("cart_page")
+        except checkout.OutOfStockError as exc:
+            if payment_status == "Paid":
+                logger.warning("Paid checkout failed on stock for user %s: %s", request.user.id, exc)
+            messages.error(request, f"Sorry, {exc}")
+            return redirect("cart_page")
+
+        payments.clear_order(request.session)
 
         messages.success(request, "Order placed successfully!")
         return redirect("order_success", order_id=order.id)
 
+    cart = price_cart(request.user)
     context = {
-        'cart_items': cart_items,
-        'subtotal': subtotal,
-        'discount': discount,
-        'total': total,
+        'cart_items': cart.items,
+        'subtotal': cart.subtotal,
+        'discount': cart.discount,
+        'total': cart.total,
     }
     return render(request, 'shop/cart.html', context)
 
@@ -277,37 +514,69 @@ def checkout_page(request):
 # -------------------------
 @login_required
 def order_success(request, order_id):
-    order = get_object_or_404(Order, id=order_id)
-    tracked_order = None
+    order = get_object_or_404(Order, id=order_id, user=request.user)
+    return render(request, "shop/order_success.html", {"order": order})
+
+
+# -------------------------
+# Order Tracking
+# -------------------------
+def track_order(request, order_id=None):
+    order = None
+    error = None
 
     if request.method == "POST":
-        email = request.POST.get("email")
-        try:
-            tracked_order = Order.objects.get(email=email)
-        except Order.DoesNotExist:
-            tracked_order = None
+        form = OrderTrackForm(request.POST)
+        if form.is_valid():
+            order = tracking.find_order(form.cleaned_data['order_id'], form.cleaned_data['email'])
+            if order is None:
+                error = "No order found with that order ID and email."
+    else:
+        form = OrderTrackForm(initial={'order_id': order_id})
+        if order_id is not None and request.user.is_authenticated:
+            # Customers can see their own orders without re-entering the email
+            order = Order.objects.filter(id=order_id, user=request.user).first()
+
+    return render(request, 'shop/track_order.html', {
+        'form': form,
+        'order': order,
+        'steps': tracking.timeline(order) if order else [],
+        'error': error,
+    })
+
 
-    return render(request, "shop/order_success.html", {
-        "order": order,
-        "tracked_order": tracked_order,
+@login_required
+def order_history_api(request):
+    """The signed-in user's orders, newest first, keyset paginated."""
+    orders, next_cursor = tracking.order_history(request.user, cursor=request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [
+            {
+                'id': order.id,
+                'created_at': order.created_at.isoformat(),
+                'total': str(order.total),
+                'status': order.status,
+                'payment_method': order.payment_method,
+                'payment_status': order.payment_status,
+                'url': reverse('track_order', args=[order.id]),
+            }
+            for order in orders
+        ],
+        'next_cursor': next_cursor,
     })
-    
-def track_order(request, order_id):
-    tracked_order = None
-    if request.method == "POST":
-        email = request.POST.get('email')
-        try:
-            tracked_order = Order.objects.get(email=email)
-            # Redirect to order_success with order_id
-            return redirect('order_success', order_id=tracked_order.id)
-        except Order.DoesNotExist:
-            tracked_order = None
-            # If you want to stay on the same page and show "No order found", you can render a template instead
-            return render(request, 'shop/order_success.html', {
-                "order": None,
-                "tracked_order": None,
-                "error": "No order found for this email."
-            })
-    return redirect('home')
 
 
+# -------------------------
+# Metrics
+# -------------------------
+def metrics(request):
+    """Request profiling totals of this process, for Prometheus to scrape."""
+    token = profiling.setting('METRICS_TOKEN')
+    if token:
+        sent = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        allowed = hmac.compare_digest(sent.encode(), token.encode())
+    else:
+        allowed = request.user.is_active and request.user.is_staff
+    if not allowed:
+        return HttpResponse(status=403)
+    return HttpResponse(profiling.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')